@@ -49,6 +49,14 @@ def create_app(config=None):
     from app.routes import api_bp
     app.register_blueprint(api_bp, url_prefix='/api')
 
+    # Request, SQL and publish metrics, served at /api/metrics
+    from app import metrics
+    metrics.init_app(app)
+
+    # Opt-in request profiling (only hooked in when a secret is configured)
+    from app import profiling
+    profiling.init_app(app)
+
     # --- 4. Swagger UI ---
     SWAGGER_URL = '/api/docs'
     API_URL = '/api/swagger.yaml'
@@ -1,12 +1,30 @@
 """Database manager for social media posts"""
 
-from sqlalchemy import create_engine, Column, Integer, String, LargeBinary, TIMESTAMP, Text
+from sqlalchemy import (
+    create_engine, Column, Integer, BigInteger, String, LargeBinary, TIMESTAMP, Text,
+    Float, Enum, Index, text
+)
 from sqlalchemy.orm import declarative_base, sessionmaker
 from sqlalchemy.sql import func
+from datetime import datetime
 from typing import Optional, Dict, List, Any
+import threading
+
+from app.metrics import TimedQueuePool
 
 Base = declarative_base()
 
+SENTIMENT_LABELS = ('POSITIVE', 'NEGATIVE', 'NEUTRAL', 'UNKNOWN')
+SentimentLabel = Enum(*SENTIMENT_LABELS, name='sentiment_label')
+
+# Granularities accepted by get_sentiment_analytics (Postgres date_trunc units)
+ANALYTICS_BUCKETS = ('hour', 'day', 'week', 'month')
+
+# Enrichment latency: stages recorded by the workers (worker_runtime.tracing)
+# and the upper bounds of the histogram buckets, in milliseconds
+TRACE_STAGES = ('queue_wait', 'fetch', 'compute', 'write', 'total')
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
 class Post(Base):
     __tablename__ = 'posts'
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -14,15 +32,175 @@ class Post(Base):
     text = Column(Text, nullable=False)
     image = Column(LargeBinary)
     image_thumb = Column(LargeBinary)
-    sentiment_label = Column(String(20))
-    sentiment_score = Column(String(50))
+    sentiment_label = Column(SentimentLabel)
+    sentiment_score = Column(Float)
+    sentiment_version = Column(String(200))
     created_at = Column(TIMESTAMP, server_default=func.now())
+    # When each worker finished enriching the post
+    thumb_completed_at = Column(TIMESTAMP)
+    sentiment_completed_at = Column(TIMESTAMP)
+
+    __table_args__ = (
+        Index('ix_posts_sentiment_label_created_at', 'sentiment_label', 'created_at'),
+    )
+
+
+class SentimentRollup(Base):
+    """Hourly sentiment counts per user, maintained by a trigger on posts"""
+    __tablename__ = 'sentiment_rollup'
+    bucket = Column(TIMESTAMP, primary_key=True)
+    user = Column(String, primary_key=True)
+    sentiment_label = Column(SentimentLabel, primary_key=True)
+    post_count = Column(BigInteger, nullable=False, default=0)
+    score_sum = Column(Float, nullable=False, default=0.0)
+
+
+class EnrichmentTrace(Base):
+    """Latency of one post through one worker, written by worker_runtime.tracing"""
+    __tablename__ = 'enrichment_traces'
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    trace_id = Column(String(32))
+    service = Column(String(50), nullable=False)
+    post_id = Column(Integer)
+    published_at = Column(TIMESTAMP)
+    completed_at = Column(TIMESTAMP, nullable=False)
+    queue_wait_ms = Column(Float)
+    fetch_ms = Column(Float)
+    compute_ms = Column(Float)
+    write_ms = Column(Float)
+    total_ms = Column(Float)
+
+    __table_args__ = (
+        Index('ix_enrichment_traces_service_completed_at', 'service', 'completed_at'),
+    )
+
+
+# Keeps sentiment_rollup in step with every insert/update/delete on posts,
+# whichever service writes the sentiment
+_ROLLUP_TRIGGER_SQL = [
+    """
+    CREATE OR REPLACE FUNCTION sentiment_rollup_apply() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.sentiment_label IS NOT NULL THEN
+            UPDATE sentiment_rollup
+            SET post_count = post_count - 1,
+                score_sum = score_sum - COALESCE(OLD.sentiment_score, 0)
+            WHERE bucket = date_trunc('hour', COALESCE(OLD.created_at, now()))
+              AND "user" = OLD."user"
+              AND sentiment_label = OLD.sentiment_label;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.sentiment_label IS NOT NULL THEN
+            INSERT INTO sentiment_rollup (bucket, "user", sentiment_label, post_count, score_sum)
+            VALUES (date_trunc('hour', COALESCE(NEW.created_at, now())), NEW."user",
+                    NEW.sentiment_label, 1, COALESCE(NEW.sentiment_score, 0))
+            ON CONFLICT (bucket, "user", sentiment_label) DO UPDATE
+            SET post_count = sentiment_rollup.post_count + 1,
+                score_sum = sentiment_rollup.score_sum + EXCLUDED.score_sum;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER posts_sentiment_rollup
+    AFTER INSERT OR DELETE OR UPDATE OF sentiment_label, sentiment_score, "user", created_at ON posts
+    FOR EACH ROW EXECUTE FUNCTION sentiment_rollup_apply()
+    """,
+]
+
+# Databases created before sentiment was typed store it as free text
+_TYPED_SENTIMENT_SQL = [
+    """
+    ALTER TABLE posts ALTER COLUMN sentiment_label TYPE sentiment_label
+    USING (CASE WHEN sentiment_label IN ('POSITIVE', 'NEGATIVE', 'NEUTRAL', 'UNKNOWN')
+                THEN sentiment_label END)::sentiment_label
+    """,
+    """
+    ALTER TABLE posts ALTER COLUMN sentiment_score TYPE DOUBLE PRECISION
+    USING (CASE WHEN sentiment_score ~ '^[0-9]*\\.?[0-9]+$'
+                THEN sentiment_score::double precision END)
+    """,
+]
+
+# Columns added to posts after it was first created
+_ADDED_POST_COLUMNS = {
+    "sentiment_version": "VARCHAR(200)",
+    "thumb_completed_at": "TIMESTAMP",
+    "sentiment_completed_at": "TIMESTAMP",
+}
+
+_schema_lock = threading.Lock()
+_upgraded_urls = set()
+
+
+def _upgrade_schema(engine) -> None:
+    """
+    Bring an existing database up to the current schema (once per process)
+
+    Each step runs only if the catalog shows it is missing: DDL on posts
+    takes an ACCESS EXCLUSIVE lock, which an up-to-date database must not
+    pay for on every start. An advisory lock serializes replicas that
+    start together.
+    """
+    url = str(engine.url)
+    with _schema_lock:
+        if url in _upgraded_urls:
+            return
+
+        with engine.begin() as conn:
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('social_media_schema_upgrade'))"))
+            columns = dict(conn.execute(text("""
+                SELECT column_name, data_type FROM information_schema.columns
+                WHERE table_name = 'posts' AND table_schema = current_schema()
+            """)).all())
+            if columns.get('sentiment_score') != 'double precision':
+                SentimentLabel.create(conn, checkfirst=True)
+                for statement in _TYPED_SENTIMENT_SQL:
+                    conn.execute(text(statement))
+
+            for column, column_type in _ADDED_POST_COLUMNS.items():
+                if column not in columns:
+                    conn.execute(text(f"ALTER TABLE posts ADD COLUMN {column} {column_type}"))
+
+            has_index = conn.execute(text(
+                "SELECT 1 FROM pg_indexes WHERE indexname = 'ix_posts_sentiment_label_created_at'"
+            )).scalar()
+            if not has_index:
+                conn.execute(text(
+                    "CREATE INDEX ix_posts_sentiment_label_created_at "
+                    "ON posts (sentiment_label, created_at)"
+                ))
+
+            has_trigger = conn.execute(text(
+                "SELECT 1 FROM pg_trigger WHERE tgname = 'posts_sentiment_rollup'"
+            )).scalar()
+            if not has_trigger:
+                for statement in _ROLLUP_TRIGGER_SQL:
+                    conn.execute(text(statement))
+                rebuild_sentiment_rollup(conn)
+
+        _upgraded_urls.add(url)
+
+
+def rebuild_sentiment_rollup(conn) -> None:
+    """Recompute sentiment_rollup from scratch (within the caller's transaction)"""
+    conn.execute(text("LOCK TABLE posts IN SHARE MODE"))
+    conn.execute(text("DELETE FROM sentiment_rollup"))
+    conn.execute(text("""
+        INSERT INTO sentiment_rollup (bucket, "user", sentiment_label, post_count, score_sum)
+        SELECT date_trunc('hour', COALESCE(created_at, now())), "user", sentiment_label,
+               COUNT(*), COALESCE(SUM(sentiment_score), 0)
+        FROM posts
+        WHERE sentiment_label IS NOT NULL
+        GROUP BY 1, 2, 3
+    """))
 
 class SocialMediaDB:
     def __init__(self, db_url: str):
-        self.engine = create_engine(db_url)
+        self.engine = create_engine(db_url, poolclass=TimedQueuePool)
         self.Session = sessionmaker(bind=self.engine)
         Base.metadata.create_all(self.engine)
+        _upgrade_schema(self.engine)
 
     def add_post(self, user: str, text: str, image_path: Optional[str] = None) -> int:
         session = self.Session()
@@ -147,18 +325,152 @@ class SocialMediaDB:
         session.close()
         return True
 
-    def update_post_sentiment(self, post_id: int, sentiment_label: str, sentiment_score: str) -> bool:
+    def update_post_sentiment(self, post_id: int, sentiment_label: str, sentiment_score: float) -> bool:
         session = self.Session()
         post = session.query(Post).filter_by(id=post_id).first()
         if not post:
             session.close()
             return False
         post.sentiment_label = sentiment_label
-        post.sentiment_score = sentiment_score
+        post.sentiment_score = float(sentiment_score)
         session.commit()
         session.close()
         return True
 
+    def get_sentiment_analytics(self, bucket: str = 'day', since: Optional[datetime] = None,
+                                until: Optional[datetime] = None, user: Optional[str] = None,
+                                user_limit: int = 50) -> Dict[str, Any]:
+        """
+        Sentiment counts and mean scores per time bucket and per user, from the rollup
+
+        The rollup is hourly, so `since` and `until` are both rounded down to
+        the hour: the window covers the hours from since's up to, not
+        including, until's. `users` holds the labels of the `user_limit`
+        users with the most posts in it.
+        """
+        if bucket not in ANALYTICS_BUCKETS:
+            raise ValueError(f"bucket must be one of {', '.join(ANALYTICS_BUCKETS)}")
+
+        filters = ["post_count > 0"]
+        params = {"unit": bucket, "user_limit": user_limit}
+        if since:
+            filters.append("bucket >= date_trunc('hour', CAST(:since AS TIMESTAMP))")
+            params["since"] = since
+        if until:
+            filters.append("bucket < date_trunc('hour', CAST(:until AS TIMESTAMP))")
+            params["until"] = until
+        if user:
+            filters.append('"user" = :user')
+            params["user"] = user
+        where = " AND ".join(filters)
+
+        session = self.Session()
+        try:
+            bucket_rows = session.execute(text(f"""
+                SELECT date_trunc(:unit, bucket) AS b, sentiment_label,
+                       SUM(post_count), SUM(score_sum)
+                FROM sentiment_rollup
+                WHERE {where}
+                GROUP BY b, sentiment_label
+                ORDER BY b, sentiment_label
+            """), params).fetchall()
+            # Rank users first: a LIMIT on (user, label) rows would cut
+            # users short and return fewer than user_limit of them
+            user_rows = session.execute(text(f"""
+                WITH top_users AS (
+                    SELECT "user", SUM(post_count) AS total
+                    FROM sentiment_rollup
+                    WHERE {where}
+                    GROUP BY "user"
+                    ORDER BY total DESC, "user"
+                    LIMIT :user_limit
+                )
+                SELECT "user", sentiment_label, SUM(post_count), SUM(score_sum)
+                FROM sentiment_rollup
+                JOIN top_users USING ("user")
+                WHERE {where}
+                GROUP BY "user", sentiment_label, top_users.total
+                ORDER BY top_users.total DESC, "user", sentiment_label
+            """), params).fetchall()
+        finally:
+            session.close()
+
+        def mean(total, count):
+            return round(float(total) / int(count), 4) if count else None
+
+        return {
+            'buckets': [
+                {'bucket': row[0], 'label': row[1], 'count': int(row[2]), 'mean_score': mean(row[3], row[2])}
+                for row in bucket_rows
+            ],
+            'users': [
+                {'user': row[0], 'label': row[1], 'count': int(row[2]), 'mean_score': mean(row[3], row[2])}
+                for row in user_rows
+            ],
+        }
+
+    def get_enrichment_latency(self, since: Optional[datetime] = None,
+                               service: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Latency histogram and p50/p95/p99 per service and stage, from enrichment_traces
+
+        Bucket i counts durations below LATENCY_BUCKETS_MS[i] and at or above
+        the previous bound; the last bucket (upper_ms None) holds the rest.
+        """
+        filters = ["ms IS NOT NULL"]
+        params = {"bounds": list(LATENCY_BUCKETS_MS)}
+        if since:
+            filters.append("completed_at >= :since")
+            params["since"] = since
+        if service:
+            filters.append("service = :service")
+            params["service"] = service
+        stages = ", ".join(f"('{stage}', {stage}_ms)" for stage in TRACE_STAGES)
+        source = f"""
+            FROM enrichment_traces, LATERAL (VALUES {stages}) AS s(stage, ms)
+            WHERE {" AND ".join(filters)}
+        """
+
+        session = self.Session()
+        try:
+            summary_rows = session.execute(text(f"""
+                SELECT service, stage, COUNT(*),
+                       percentile_cont(ARRAY[0.5, 0.95, 0.99]) WITHIN GROUP (ORDER BY ms), MAX(ms)
+                {source}
+                GROUP BY service, stage
+            """), params).fetchall()
+            bucket_rows = session.execute(text(f"""
+                SELECT service, stage, width_bucket(ms, CAST(:bounds AS DOUBLE PRECISION[])), COUNT(*)
+                {source}
+                GROUP BY 1, 2, 3
+            """), params).fetchall()
+        finally:
+            session.close()
+
+        histograms = {}
+        for svc, stage, index, count in bucket_rows:
+            counts = histograms.setdefault((svc, stage), [0] * (len(LATENCY_BUCKETS_MS) + 1))
+            counts[index] = int(count)
+
+        order = {stage: i for i, stage in enumerate(TRACE_STAGES)}
+        results = []
+        for svc, stage, count, quantiles, max_ms in sorted(summary_rows, key=lambda r: (r[0], order[r[1]])):
+            p50, p95, p99 = (round(float(q), 3) for q in quantiles)
+            results.append({
+                'service': svc,
+                'stage': stage,
+                'count': int(count),
+                'p50_ms': p50,
+                'p95_ms': p95,
+                'p99_ms': p99,
+                'max_ms': round(float(max_ms), 3),
+                'histogram': [
+                    {'upper_ms': bound, 'count': n}
+                    for bound, n in zip(list(LATENCY_BUCKETS_MS) + [None], histograms[(svc, stage)])
+                ],
+            })
+        return results
+
     def get_post_text_by_id(self, post_id: int) -> Optional[str]:
         session = self.Session()
         post = session.query(Post).filter_by(id=post_id).first()
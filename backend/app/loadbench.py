@@ -0,0 +1,317 @@
+"""
+Load and latency benchmark of the REST API over a synthetic dataset
+
+Seeds Postgres with synthetic posts (a configurable share of them with
+images of configurable sizes, most already thumbnailed and scored), then
+drives the API with concurrent clients doing a weighted mix of feed,
+detail, search, latest and create requests, and prints throughput and
+p50/p95/p99 latencies per endpoint as JSON.
+
+Runs fully offline: by default the app is served in-process (Flask test
+clients, one per client thread, TESTING on so no events are published),
+so all it needs is a Postgres it may write to. --url drives an already
+running API instead. Seeding and --reset write to DATABASE_URL; never
+point them at a database whose data matters.
+
+Usage:
+    python -m app.loadbench --posts 10000 --reset
+    python -m app.loadbench --posts 100000 --clients 16 --duration 60 --output run.json
+    python -m app.loadbench --skip-seed --mix feed=5,detail=3,search=1 --compare run.json
+    python -m app.loadbench --images 0=0.6,20000=0.3,200000=0.1   # image bytes=share of posts
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Optional
+
+from sqlalchemy import create_engine, insert, select, func, text
+
+from app.database import Base, Post, SENTIMENT_LABELS
+from worker_runtime.metrics import percentile
+
+ENDPOINTS = ("feed", "detail", "search", "latest", "create")
+DEFAULT_MIX = "feed=4,detail=4,search=1,latest=2,create=1"
+DEFAULT_IMAGES = "0=0.7,20000=0.25,200000=0.05"
+FEED_LIMIT = 20
+SEED_BATCH = 1000
+
+WORDS = (
+    "coffee tea morning launch game weekend music travel code python coffee sunny rain "
+    "great awful love hate news update team city food pizza movie book train bike coffee "
+    "happy tired work holiday beach mountain photo friends family release bug deploy"
+).split()
+
+
+def parse_weights(spec: str, cast=str) -> dict:
+    """'a=1,b=2' -> {a: 1.0, b: 2.0}"""
+    weights = {}
+    for part in spec.split(","):
+        key, _, weight = part.partition("=")
+        weights[cast(key.strip())] = float(weight)
+    return weights
+
+
+def _text(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 30)))
+
+
+def seed(engine, posts: int, images: dict, rng: random.Random, reset: bool = False) -> int:
+    """Insert `posts` synthetic posts; returns how many the table holds"""
+    Base.metadata.create_all(engine)
+    if reset:
+        with engine.begin() as conn:
+            conn.execute(text("TRUNCATE TABLE posts RESTART IDENTITY CASCADE"))
+            conn.execute(text("TRUNCATE TABLE sentiment_rollup"))
+
+    sizes, shares = list(images), list(images.values())
+    # One random blob per size, sliced per post: content doesn't matter, size does
+    blobs = {size: rng.randbytes(size) for size in sizes if size}
+    users = [f"user{i}" for i in range(max(1, posts // 20))]
+
+    for offset in range(0, posts, SEED_BATCH):
+        rows = []
+        for _ in range(min(SEED_BATCH, posts - offset)):
+            size = rng.choices(sizes, shares)[0]
+            image = blobs[size] if size else None
+            enriched = rng.random() < 0.9
+            rows.append({
+                "user": rng.choice(users),
+                "text": _text(rng),
+                "image": image,
+                "image_thumb": image[:max(1, size // 10)] if image and enriched else None,
+                "sentiment_label": rng.choice(SENTIMENT_LABELS[:3]) if enriched else None,
+                "sentiment_score": round(rng.random(), 4) if enriched else None,
+            })
+        with engine.begin() as conn:
+            conn.execute(insert(Post), rows)
+
+    with engine.begin() as conn:
+        return conn.execute(select(func.count()).select_from(Post)).scalar()
+
+
+class _InProcessClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method: str, path: str, body: Optional[dict] = None) -> tuple[int, int]:
+        resp = self.client.open(path, method=method, json=body)
+        size = len(resp.get_data())
+        resp.close()
+        return resp.status_code, size
+
+
+class _HttpClient:
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+
+    def request(self, method: str, path: str, body: Optional[dict] = None) -> tuple[int, int]:
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                     headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=60) as resp:
+                return resp.status, len(resp.read())
+        except urllib.error.HTTPError as e:
+            return e.code, len(e.read())
+
+
+def _call(client, endpoint: str, rng: random.Random, max_id: int) -> tuple[int, int]:
+    if endpoint == "feed":
+        return client.request("GET", f"/api/posts?limit={FEED_LIMIT}")
+    if endpoint == "detail":
+        return client.request("GET", f"/api/posts/{rng.randint(1, max(1, max_id))}")
+    if endpoint == "search":
+        return client.request("GET", f"/api/posts/search?q={rng.choice(WORDS)}")
+    if endpoint == "latest":
+        return client.request("GET", "/api/posts/latest")
+    return client.request("POST", "/api/posts", {"user": "loadbench", "text": _text(rng)})
+
+
+def run_load(make_client, mix: dict, clients: int, duration_s: float, warmup_s: float,
+             max_id: int, seed_value: int = 0) -> dict:
+    """Drive the API from `clients` threads; returns per-endpoint samples"""
+    endpoints, weights = list(mix), list(mix.values())
+    samples = {endpoint: [] for endpoint in endpoints}
+    errors = {endpoint: 0 for endpoint in endpoints}
+    sizes = {endpoint: 0 for endpoint in endpoints}
+    lock = threading.Lock()
+    start_at = time.perf_counter() + warmup_s
+    stop_at = start_at + duration_s
+
+    def client_loop(index: int):
+        rng = random.Random(seed_value * 1000 + index)
+        client = make_client()
+        local = {endpoint: [] for endpoint in endpoints}
+        local_errors = dict.fromkeys(endpoints, 0)
+        local_sizes = dict.fromkeys(endpoints, 0)
+        while True:
+            endpoint = rng.choices(endpoints, weights)[0]
+            begin = time.perf_counter()
+            if begin >= stop_at:
+                break
+            try:
+                status, size = _call(client, endpoint, rng, max_id)
+            except Exception:
+                status, size = 599, 0
+            elapsed = time.perf_counter() - begin
+            if begin < start_at:
+                continue  # warm-up: connections, caches, first schema check
+            local[endpoint].append(elapsed)
+            local_sizes[endpoint] += size
+            # A detail miss (404) is a valid answer, not an error
+            if status >= 500 or (status >= 400 and not (endpoint == "detail" and status == 404)):
+                local_errors[endpoint] += 1
+        with lock:
+            for endpoint in endpoints:
+                samples[endpoint].extend(local[endpoint])
+                errors[endpoint] += local_errors[endpoint]
+                sizes[endpoint] += local_sizes[endpoint]
+
+    threads = [threading.Thread(target=client_loop, args=(i,), daemon=True) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {"samples": samples, "errors": errors, "bytes": sizes}
+
+
+def summarize(samples: list[float], errors: int, size: int, duration_s: float) -> dict:
+    ordered = sorted(samples)
+    count = len(ordered)
+    return {
+        "requests": count,
+        "errors": errors,
+        "throughput_rps": round(count / duration_s, 2),
+        "mean_ms": round(1000 * sum(ordered) / count, 3) if count else 0.0,
+        "p50_ms": round(1000 * percentile(ordered, 50), 3),
+        "p95_ms": round(1000 * percentile(ordered, 95), 3),
+        "p99_ms": round(1000 * percentile(ordered, 99), 3),
+        "max_ms": round(1000 * ordered[-1], 3) if count else 0.0,
+        "mean_response_bytes": round(size / count) if count else 0,
+    }
+
+
+def compare(current: dict, baseline: dict) -> dict:
+    """Relative change (current / baseline - 1) of throughput and latencies per endpoint"""
+    deltas = {}
+    for endpoint, now in current["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(endpoint)
+        if not before:
+            continue
+        deltas[endpoint] = {
+            key: round(now[key] / before[key] - 1, 4) if before[key] else None
+            for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms")
+        }
+    return deltas
+
+
+def benchmark(database_url: str, posts: int = 10000, images: dict = None, mix: dict = None,
+              clients: int = 8, duration_s: float = 30.0, warmup_s: float = 2.0,
+              url: Optional[str] = None, reset: bool = False, skip_seed: bool = False,
+              seed_value: int = 0) -> dict:
+    images = images or parse_weights(DEFAULT_IMAGES, int)
+    mix = mix or parse_weights(DEFAULT_MIX)
+    unknown = set(mix) - set(ENDPOINTS)
+    if unknown:
+        raise ValueError(f"Unknown endpoints in mix: {', '.join(sorted(unknown))}")
+
+    rng = random.Random(seed_value)
+    engine = create_engine(database_url)
+    try:
+        seed_start = time.perf_counter()
+        if skip_seed:
+            Base.metadata.create_all(engine)
+            with engine.begin() as conn:
+                total = conn.execute(select(func.count()).select_from(Post)).scalar()
+        else:
+            total = seed(engine, posts, images, rng, reset=reset)
+        seed_s = time.perf_counter() - seed_start
+        with engine.begin() as conn:
+            max_id = conn.execute(select(func.max(Post.id))).scalar() or 0
+    finally:
+        engine.dispose()
+
+    if url:
+        make_client = lambda: _HttpClient(url)
+    else:
+        from app import create_app
+        app = create_app({"TESTING": True, "DATABASE": database_url})
+        make_client = lambda: _InProcessClient(app)
+
+    result = run_load(make_client, mix, clients, duration_s, warmup_s, max_id, seed_value)
+    endpoints = {
+        endpoint: summarize(result["samples"][endpoint], result["errors"][endpoint],
+                            result["bytes"][endpoint], duration_s)
+        for endpoint in mix
+    }
+    all_samples = [s for samples in result["samples"].values() for s in samples]
+    return {
+        "config": {
+            "target": url or "in-process",
+            "posts": total,
+            "seeded": 0 if skip_seed else posts,
+            "seed_seconds": round(seed_s, 2),
+            "images": {str(size): share for size, share in images.items()},
+            "mix": mix,
+            "clients": clients,
+            "duration_s": duration_s,
+            "warmup_s": warmup_s,
+            "seed": seed_value,
+        },
+        "overall": summarize(all_samples, sum(result["errors"].values()),
+                             sum(result["bytes"].values()), duration_s),
+        "endpoints": endpoints,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="REST API load and latency benchmark")
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"))
+    parser.add_argument("--posts", type=int, default=10000, help="synthetic posts to insert")
+    parser.add_argument("--images", default=DEFAULT_IMAGES, help="image bytes=share of posts (0 = no image)")
+    parser.add_argument("--reset", action="store_true", help="empty the posts table before seeding")
+    parser.add_argument("--skip-seed", action="store_true", help="reuse the posts already in the database")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"endpoint=weight, of {', '.join(ENDPOINTS)}")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent client threads")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds first")
+    parser.add_argument("--url", help="drive a running API (e.g. http://localhost:5001) instead")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for data and request mix")
+    parser.add_argument("--output", help="also write the JSON result to this file")
+    parser.add_argument("--compare", help="earlier result file to report relative changes against")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        parser.error("--database-url or DATABASE_URL is required")
+
+    result = benchmark(
+        args.database_url,
+        posts=args.posts,
+        images=parse_weights(args.images, int),
+        mix=parse_weights(args.mix),
+        clients=args.clients,
+        duration_s=args.duration,
+        warmup_s=args.warmup,
+        url=args.url,
+        reset=args.reset,
+        skip_seed=args.skip_seed,
+        seed_value=args.seed,
+    )
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            result["compared_to"] = {"file": args.compare, "change": compare(result, json.load(f))}
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
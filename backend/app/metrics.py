@@ -0,0 +1,217 @@
+"""
+Prometheus-style metrics for the API, served at /api/metrics
+
+Recorded per request (by route template, so ids in URLs don't multiply
+the series): latency by method/route/status, requests in flight, response
+size, and how many SQL statements ran and how long they took. Also
+connection-pool checkout wait and event publish latency (app.messaging).
+
+Everything lives in one in-process registry guarded by a lock; with
+several gunicorn workers each process reports its own numbers. SQL is
+only recorded on the app's own engine (see instrument_engine), not on
+other engines in the process.
+"""
+import bisect
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+LATENCY_BUCKETS_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS_BYTES = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Counters, gauges and histograms keyed by name and label values"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._values = {}
+
+    def _declare(self, name, kind, help_text, labels=(), bounds=None):
+        self._meta[name] = (kind, help_text, tuple(labels), bounds)
+        self._values[name] = {}
+
+    def counter(self, name, help_text, labels=()):
+        self._declare(name, "counter", help_text, labels)
+
+    def gauge(self, name, help_text, labels=()):
+        self._declare(name, "gauge", help_text, labels)
+
+    def histogram(self, name, help_text, bounds, labels=()):
+        self._declare(name, "histogram", help_text, labels, bounds)
+
+    def inc(self, name, amount: float = 1.0, *labels) -> None:
+        with self._lock:
+            series = self._values[name]
+            series[labels] = series.get(labels, 0.0) + amount
+
+    def observe(self, name, value: float, *labels) -> None:
+        with self._lock:
+            series = self._values[name]
+            if labels not in series:
+                series[labels] = _Histogram(self._meta[name][3])
+            series[labels].observe(value)
+
+    def value(self, name, *labels):
+        """Current value of a counter/gauge, or a histogram's (count, sum)"""
+        with self._lock:
+            found = self._values[name].get(labels)
+            if isinstance(found, _Histogram):
+                return found.count, found.sum
+            return found
+
+    def render(self) -> str:
+        """The text exposition format Prometheus scrapes"""
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, label_names, bounds) in self._meta.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(self._values[name].items()):
+                    pairs = [f'{key}="{_escape(val)}"' for key, val in zip(label_names, labels)]
+                    if kind != "histogram":
+                        lines.append(f"{name}{_labels(pairs)} {_number(value)}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(list(bounds) + ["+Inf"], value.counts):
+                        cumulative += count
+                        le = 'le="{}"'.format(bound if bound == "+Inf" else _number(bound))
+                        lines.append(f"{name}_bucket{_labels(pairs + [le])} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(pairs)} {_number(value.sum)}")
+                    lines.append(f"{name}_count{_labels(pairs)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(pairs) -> str:
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+registry = Registry()
+registry.histogram("api_request_duration_seconds", "Request latency",
+                   LATENCY_BUCKETS_S, ("method", "route", "status"))
+registry.gauge("api_requests_in_flight", "Requests being handled")
+registry.histogram("api_response_size_bytes", "Response body size",
+                   SIZE_BUCKETS_BYTES, ("route",))
+registry.histogram("api_request_db_queries", "SQL statements run per request",
+                   QUERY_COUNT_BUCKETS, ("route",))
+registry.histogram("api_request_db_seconds", "Time spent in SQL per request",
+                   LATENCY_BUCKETS_S, ("route",))
+registry.counter("api_db_queries_total", "SQL statements run by the API process")
+registry.histogram("api_db_pool_checkout_wait_seconds", "Time to get a pooled connection",
+                   LATENCY_BUCKETS_S)
+registry.histogram("api_publish_duration_seconds", "Time to publish a RabbitMQ event",
+                   LATENCY_BUCKETS_S, ("queue", "outcome"))
+
+
+def _route() -> str:
+    rule = request.url_rule
+    return rule.rule if rule is not None else "unmatched"
+
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+    g.db_queries = 0
+    g.db_seconds = 0.0
+    registry.inc("api_requests_in_flight", 1)
+
+
+def _after_request(response):
+    g.metrics_status = response.status_code
+    size = response.calculate_content_length()
+    if size is not None:
+        registry.observe("api_response_size_bytes", size, _route())
+    return response
+
+
+def _teardown_request(error=None):
+    start = g.pop("metrics_start", None)
+    if start is None:
+        return
+    registry.inc("api_requests_in_flight", -1)
+    route = _route()
+    status = str(g.pop("metrics_status", 500))
+    registry.observe("api_request_duration_seconds", time.perf_counter() - start,
+                     request.method, route, status)
+    registry.observe("api_request_db_queries", g.pop("db_queries", 0), route)
+    registry.observe("api_request_db_seconds", g.pop("db_seconds", 0.0), route)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    registry.inc("api_db_queries_total", 1)
+    if has_request_context() and "db_queries" in g:
+        g.db_queries += 1
+        g.db_seconds += elapsed
+
+
+def _handle_error(context):
+    # A failed statement never reaches after_cursor_execute
+    if context.connection is not None and context.statement is not None:
+        starts = context.connection.info.get("query_start")
+        if starts:
+            starts.pop()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited"""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            registry.observe("api_db_pool_checkout_wait_seconds", time.perf_counter() - start)
+
+
+def observe_publish(queue: str, seconds: float, ok: bool) -> None:
+    registry.observe("api_publish_duration_seconds", seconds, queue, "ok" if ok else "error")
+
+
+def instrument_engine(engine) -> None:
+    """Count and time the SQL statements run on `engine`"""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+
+def init_app(app) -> None:
+    """Record every request of `app`; its engine is hooked in by get_db()"""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
@@ -51,7 +51,7 @@ class PostResponse:
     image: Optional[str]        # full-size base64
     thumbnail: Optional[str]    # NEW: thumbnail base64
     sentiment_label: Optional[str] = None
-    sentiment_score: Optional[str] = None
+    sentiment_score: Optional[float] = None
     created_at: str = ''
 
     @classmethod
@@ -103,7 +103,7 @@ class PostListResponse:
     has_thumbnail: bool = False
     thumbnail: Optional[str] = None
     sentiment_label: Optional[str] = None
-    sentiment_score: Optional[str] = None
+    sentiment_score: Optional[float] = None
 
     @classmethod
     def from_db(cls, post_data: dict) -> 'PostListResponse':
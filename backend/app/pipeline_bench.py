@@ -0,0 +1,288 @@
+"""
+End-to-end create -> enrich benchmark in one process
+
+Runs the API (create_post and its event publishing), the image-resizer
+handler and the sentiment handler together on the in-process broker
+(MESSAGE_TRANSPORT=memory, see worker_runtime/transport.py): no RabbitMQ,
+no containers, just a Postgres. Posts are created through the API by
+concurrent clients, each worker consumes from the broker with the real
+Worker loop, and the run ends once every post is enriched.
+
+Reports, as JSON: create latency, and per service the enrichment
+throughput and the latency from post creation to the completion time the
+worker stored on the post (p50/p95/p99), plus the workers' stage timings.
+
+--sentiment stub replaces inference with a constant result, to measure
+the pipeline itself; --sentiment model runs the real model (it must be
+downloaded or cached already). Writes to DATABASE_URL; --reset empties the
+posts table first.
+
+Usage:
+    python -m app.pipeline_bench --posts 500 --reset
+    python -m app.pipeline_bench --posts 2000 --clients 8 --image-share 0.5 --resizer-concurrency 4
+    python -m app.pipeline_bench --sentiment model --sentiment-batch 16
+"""
+import argparse
+import base64
+import contextlib
+import importlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+import types
+from io import BytesIO
+
+from sqlalchemy import create_engine, text
+
+from worker_runtime.metrics import WorkerMetrics, percentile
+from worker_runtime.tracing import init_trace_table
+from worker_runtime.transport import get_transport
+from worker_runtime.worker import Worker
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = "love great awful coffee rain sunny launch bug happy tired team game news".split()
+
+
+def load_service(directory: str):
+    """
+    Import a worker service's app.consumer next to the backend's own `app`
+
+    Every service calls its package `app`. Its modules are imported with
+    `app` bound to the service's package, then the backend's `app` modules
+    are put back; the consumer keeps references to what it imported.
+    """
+    backend_modules = {name: module for name, module in sys.modules.items()
+                       if name == "app" or name.startswith("app.")}
+    for name in backend_modules:
+        del sys.modules[name]
+    package = types.ModuleType("app")
+    package.__path__ = [os.path.join(directory, "app")]
+    sys.modules["app"] = package
+    try:
+        return importlib.import_module("app.consumer")
+    finally:
+        for name in [name for name in sys.modules if name == "app" or name.startswith("app.")]:
+            del sys.modules[name]
+        sys.modules.update(backend_modules)
+
+
+def _image(rng: random.Random, width: int) -> bytes:
+    from PIL import Image
+
+    img = Image.new("RGB", (width, width * 3 // 4), tuple(rng.randrange(256) for _ in range(3)))
+    out = BytesIO()
+    img.save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+def _stub_analyze(texts: list[str]) -> list[tuple[str, float]]:
+    return [("POSITIVE", 0.99) for _ in texts]
+
+
+def _create_posts(app, posts: int, clients: int, image_share: float, image: bytes, rng_seed: int) -> list[float]:
+    """Create `posts` posts from `clients` threads; returns each request's seconds"""
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(posts))
+    image_b64 = base64.b64encode(image).decode("utf-8")
+
+    def client_loop(index: int):
+        rng = random.Random(rng_seed * 1000 + index)
+        client = app.test_client()
+        local = []
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                break
+            payload = {"user": f"bench{index}", "text": " ".join(rng.choice(WORDS) for _ in range(12))}
+            if rng.random() < image_share:
+                payload["image"] = image_b64
+            start = time.perf_counter()
+            resp = client.post("/api/posts", json=payload)
+            local.append(time.perf_counter() - start)
+            if resp.status_code != 201:
+                raise RuntimeError(f"create_post failed: {resp.status_code} {resp.get_data(as_text=True)}")
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client_loop, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+def _latency_ms(values: list[float]) -> dict:
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "p50_ms": round(1000 * percentile(ordered, 50), 3),
+        "p95_ms": round(1000 * percentile(ordered, 95), 3),
+        "p99_ms": round(1000 * percentile(ordered, 99), 3),
+        "max_ms": round(1000 * ordered[-1], 3) if ordered else 0.0,
+    }
+
+
+def _enrichment(engine, column: str, first_id: int, where: str = "TRUE") -> dict:
+    """Throughput and creation-to-completion latency of one service's posts"""
+    with engine.begin() as conn:
+        rows = conn.execute(text(f"""
+            SELECT EXTRACT(EPOCH FROM ({column} - created_at)),
+                   EXTRACT(EPOCH FROM {column})
+            FROM posts
+            WHERE id >= :first_id AND {column} IS NOT NULL AND {where}
+        """), {"first_id": first_id}).fetchall()
+        started = conn.execute(text(
+            "SELECT EXTRACT(EPOCH FROM MIN(created_at)) FROM posts WHERE id >= :first_id"
+        ), {"first_id": first_id}).scalar()
+    if not rows:
+        return {"posts": 0}
+    span = max(float(row[1]) for row in rows) - float(started)
+    return {
+        "posts": len(rows),
+        "throughput_per_s": round(len(rows) / span, 2) if span > 0 else None,
+        "latency": _latency_ms([float(row[0]) for row in rows]),
+    }
+
+
+def _pending(engine, first_id: int) -> int:
+    with engine.begin() as conn:
+        return conn.execute(text("""
+            SELECT COUNT(*) FROM posts
+            WHERE id >= :first_id
+              AND (sentiment_completed_at IS NULL
+                   OR (image IS NOT NULL AND thumb_completed_at IS NULL))
+        """), {"first_id": first_id}).scalar()
+
+
+def benchmark(database_url: str, posts: int = 500, clients: int = 4, image_share: float = 0.5,
+              image_width: int = 1600, sentiment: str = "stub", sentiment_batch: int = 16,
+              resizer_concurrency: int = 1, timeout_s: float = 300.0, reset: bool = False,
+              seed: int = 0) -> dict:
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["MESSAGE_TRANSPORT"] = "memory"
+    transport = get_transport("memory")
+
+    from app import create_app
+    app = create_app({"DATABASE": database_url})
+
+    resizer = load_service(os.path.join(BACKEND_DIR, "image-resizer"))
+    analyzer = load_service(os.path.join(BACKEND_DIR, "sentiment-analyzer"))
+    if sentiment == "stub":
+        analyzer.analyze_with_cache = _stub_analyze
+
+    engine = create_engine(database_url)
+    with app.app_context():
+        from app.routes import get_db
+        get_db()  # creates/upgrades the schema
+    if reset:
+        with engine.begin() as conn:
+            conn.execute(text("TRUNCATE TABLE posts RESTART IDENTITY CASCADE"))
+            conn.execute(text("TRUNCATE TABLE sentiment_rollup"))
+    analyzer.init_sentiment_tables()
+    init_trace_table("thumb_completed_at")
+    with engine.begin() as conn:
+        first_id = (conn.execute(text("SELECT MAX(id) FROM posts")).scalar() or 0) + 1
+
+    workers = [
+        Worker("resizer", "image_resize", resizer.handle_message, concurrency=resizer_concurrency,
+               transport=transport, metrics=WorkerMetrics(log_every_s=0)),
+        Worker("sentiment", "sentiment_analysis", analyzer.handle_message, analyzer.handle_batch,
+               batch_size=sentiment_batch, transport=transport, metrics=WorkerMetrics(log_every_s=0)),
+    ]
+    threads = [threading.Thread(target=worker.run, daemon=True) for worker in workers]
+    rng = random.Random(seed)
+    image = _image(rng, image_width)
+
+    # The handlers log or print every post; keep stdout for the JSON result
+    with contextlib.redirect_stdout(sys.stderr):
+        for thread in threads:
+            thread.start()
+        start = time.perf_counter()
+        create_latencies = _create_posts(app, posts, clients, image_share, image, seed)
+        created_s = time.perf_counter() - start
+
+        deadline = time.monotonic() + timeout_s
+        while (left := _pending(engine, first_id)) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        total_s = time.perf_counter() - start
+
+        for worker in workers:
+            worker.stop()
+        for thread in threads:
+            thread.join(timeout=30)
+
+    result = {
+        "config": {
+            "posts": posts,
+            "clients": clients,
+            "image_share": image_share,
+            "image_bytes": len(image),
+            "sentiment": sentiment,
+            "sentiment_batch": sentiment_batch,
+            "resizer_concurrency": resizer_concurrency,
+            "transport": "memory",
+        },
+        "create": {
+            "throughput_per_s": round(posts / created_s, 2),
+            "latency": _latency_ms(create_latencies),
+        },
+        "enrichment": {
+            "resizer": _enrichment(engine, "thumb_completed_at", first_id, "image IS NOT NULL"),
+            "sentiment": _enrichment(engine, "sentiment_completed_at", first_id),
+        },
+        "wall_seconds": round(total_s, 3),
+        "unfinished_posts": left,
+        "stages": {worker.name: worker.metrics.snapshot() for worker in workers},
+    }
+    engine.dispose()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process create -> enrich pipeline benchmark")
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"))
+    parser.add_argument("--posts", type=int, default=500)
+    parser.add_argument("--clients", type=int, default=4, help="concurrent API clients")
+    parser.add_argument("--image-share", type=float, default=0.5, help="share of posts with an image")
+    parser.add_argument("--image-width", type=int, default=1600, help="width of the JPEG sent (pixels)")
+    parser.add_argument("--sentiment", choices=["stub", "model"], default="stub")
+    parser.add_argument("--sentiment-batch", type=int, default=16)
+    parser.add_argument("--resizer-concurrency", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=300.0, help="seconds to wait for enrichment")
+    parser.add_argument("--reset", action="store_true", help="empty the posts table first")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the JSON result to this file")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        parser.error("--database-url or DATABASE_URL is required")
+
+    result = benchmark(
+        args.database_url,
+        posts=args.posts,
+        clients=args.clients,
+        image_share=args.image_share,
+        image_width=args.image_width,
+        sentiment=args.sentiment,
+        sentiment_batch=args.sentiment_batch,
+        resizer_concurrency=args.resizer_concurrency,
+        timeout_s=args.timeout,
+        reset=args.reset,
+        seed=args.seed,
+    )
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
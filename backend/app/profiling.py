@@ -0,0 +1,280 @@
+"""
+Opt-in profiling of individual API requests
+
+Off unless API_PROFILE_SECRET is set (or PROFILE_SECRET in the app
+config); then nothing is hooked into the app at all. When on, a request is
+profiled with cProfile if it carries a valid signed header
+
+    X-Profile: <expires>.<hmac-sha256(secret, expires)>
+
+(print one with `python -m app.profiling sign`), or if it falls in the
+sampled fraction API_PROFILE_SAMPLE_RATE, which admins can change at
+runtime through PUT /api/admin/profiling. The admin routes take their own
+token, API_PROFILE_ADMIN_TOKEN, in X-Admin-Token (unset = admin routes
+off), so a leaked admin token cannot sign X-Profile headers.
+
+Each profile is stored in API_PROFILE_DIR as <id>.pstats (open it with
+pstats, snakeviz or flameprof) next to <id>.json: the route, status and
+duration, the SQL statements that ran with their timings, and the
+functions with the highest cumulative time. The newest API_PROFILE_KEEP
+profiles are kept; they are listed and downloaded under /api/admin/profiles.
+A profile that cannot be stored is logged and dropped; the response is
+unchanged.
+
+cProfile can only run once at a time per process, so a request arriving
+while another is being profiled is served unprofiled.
+"""
+import argparse
+import cProfile
+import hashlib
+import hmac
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Optional
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+PROFILE_SECRET = os.getenv("API_PROFILE_SECRET", "")
+PROFILE_ADMIN_TOKEN = os.getenv("API_PROFILE_ADMIN_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("API_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("API_PROFILE_DIR", "/tmp/api-profiles")
+PROFILE_KEEP = int(os.getenv("API_PROFILE_KEEP", "200"))
+
+PROFILE_HEADER = "X-Profile"
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+PROFILE_ID_RE = re.compile(r"^\d+-[0-9a-f]{8}$")
+# Functions listed in a profile's summary
+TOP_FUNCTIONS = 25
+
+
+def sign(secret: str, ttl_s: int = 600, now: Optional[float] = None) -> str:
+    """A PROFILE_HEADER value valid for `ttl_s` seconds"""
+    expires = str(int((time.time() if now is None else now) + ttl_s))
+    digest = hmac.new(secret.encode("utf-8"), expires.encode("utf-8"), hashlib.sha256).hexdigest()
+    return f"{expires}.{digest}"
+
+
+def verify(secret: str, value: str, now: Optional[float] = None) -> bool:
+    expires, _, digest = value.partition(".")
+    if not expires.isdigit() or int(expires) < (time.time() if now is None else now):
+        return False
+    expected = hmac.new(secret.encode("utf-8"), expires.encode("utf-8"), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, digest)
+
+
+class Profiler:
+    """Profiling settings and stored profiles of one app"""
+
+    def __init__(self, secret: str, directory: str = PROFILE_DIR,
+                 sample_rate: float = PROFILE_SAMPLE_RATE, keep: int = PROFILE_KEEP,
+                 admin_token: str = PROFILE_ADMIN_TOKEN):
+        if admin_token and hmac.compare_digest(admin_token, secret):
+            logging.warning("[profiling] The admin token equals the signing secret; admin routes are off")
+            admin_token = ""
+        self.secret = secret
+        self.admin_token = admin_token
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.keep = keep
+        self._busy = threading.Lock()
+
+    def is_admin(self, token: Optional[str]) -> bool:
+        return bool(self.admin_token) and bool(token) and hmac.compare_digest(token, self.admin_token)
+
+    def trigger(self) -> Optional[str]:
+        """Why the current request should be profiled, or None"""
+        header = request.headers.get(PROFILE_HEADER)
+        if header and verify(self.secret, header):
+            return "header"
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sample"
+        return None
+
+    # --------------------------------------------------
+    # Request hooks
+    # --------------------------------------------------
+    def before_request(self):
+        trigger = self.trigger()
+        if trigger is None or not self._busy.acquire(blocking=False):
+            return
+        profile = cProfile.Profile()
+        g.profile = {"profiler": profile, "trigger": trigger, "sql": [], "start": time.perf_counter()}
+        profile.enable()
+
+    def after_request(self, response):
+        state = self._finish()
+        if state is not None:
+            # Profiling must never change the response
+            try:
+                profile_id = self.save(state, response.status_code)
+            except Exception as e:
+                logging.warning(f"[profiling] Could not store the profile of {request.path}: {e}")
+            else:
+                response.headers["X-Profile-Id"] = profile_id
+        return response
+
+    def teardown_request(self, error=None):
+        # The request failed before after_request ran
+        self._finish()
+
+    def _finish(self) -> Optional[dict]:
+        state = g.pop("profile", None)
+        if state is None:
+            return None
+        state["profiler"].disable()
+        state["duration_ms"] = 1000 * (time.perf_counter() - state["start"])
+        self._busy.release()
+        return state
+
+    # --------------------------------------------------
+    # Storage
+    # --------------------------------------------------
+    def save(self, state: dict, status: int) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        profile_id = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+        state["profiler"].dump_stats(self._path(profile_id, "pstats"))
+
+        stats = pstats.Stats(state["profiler"]).stats
+        top = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_FUNCTIONS]
+        meta = {
+            "id": profile_id,
+            "method": request.method,
+            "path": request.path,
+            "route": request.url_rule.rule if request.url_rule is not None else None,
+            "status": status,
+            "trigger": state["trigger"],
+            "duration_ms": round(state["duration_ms"], 3),
+            "sql_count": len(state["sql"]),
+            "sql_ms": round(sum(ms for _, ms in state["sql"]), 3),
+            "sql": [{"statement": statement, "ms": round(ms, 3)} for statement, ms in state["sql"]],
+            "top": [
+                {
+                    "function": f"{filename}:{line}({name})",
+                    "calls": calls,
+                    "own_ms": round(1000 * own_s, 3),
+                    "cumulative_ms": round(1000 * cumulative_s, 3),
+                }
+                for (filename, line, name), (_, calls, own_s, cumulative_s, _) in top
+            ],
+        }
+        with open(self._path(profile_id, "json"), "w") as f:
+            json.dump(meta, f)
+        self._prune()
+        return profile_id
+
+    def _path(self, profile_id: str, extension: str) -> str:
+        return os.path.join(self.directory, f"{profile_id}.{extension}")
+
+    def _ids(self) -> list[str]:
+        """Stored profile ids, oldest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        names = (name[:-5] for name in os.listdir(self.directory) if name.endswith(".json"))
+        return sorted((name for name in names if PROFILE_ID_RE.match(name)),
+                      key=lambda name: int(name.split("-")[0]))
+
+    def _prune(self) -> None:
+        ids = self._ids()
+        for profile_id in ids[:max(0, len(ids) - self.keep)]:
+            for extension in ("json", "pstats"):
+                try:
+                    os.remove(self._path(profile_id, extension))
+                except FileNotFoundError:
+                    pass
+
+    def profiles(self) -> list[dict]:
+        """Stored profiles, newest first, without their SQL and function lists"""
+        summaries = []
+        for profile_id in reversed(self._ids()):
+            meta = self.get(profile_id)
+            if meta is not None:
+                summaries.append({k: v for k, v in meta.items() if k not in ("sql", "top")})
+        return summaries
+
+    def get(self, profile_id: str) -> Optional[dict]:
+        if not PROFILE_ID_RE.match(profile_id):
+            return None
+        try:
+            with open(self._path(profile_id, "json")) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def pstats_path(self, profile_id: str) -> Optional[str]:
+        if not PROFILE_ID_RE.match(profile_id):
+            return None
+        path = self._path(profile_id, "pstats")
+        return path if os.path.isfile(path) else None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "profile" in g:
+        conn.info.setdefault("profile_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("profile_query_start")
+    if starts and has_request_context() and "profile" in g:
+        g.profile["sql"].append((statement, 1000 * (time.perf_counter() - starts.pop())))
+
+
+def _handle_error(context):
+    if context.connection is not None and context.statement is not None:
+        starts = context.connection.info.get("profile_query_start")
+        if starts and has_request_context() and "profile" in g:
+            starts.pop()
+
+
+def instrument_engine(engine) -> None:
+    """Record the SQL that profiled requests run on `engine`"""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+
+def init_app(app) -> None:
+    """
+    Hook profiling into `app` if a secret is configured; otherwise do nothing
+
+    get_db() hooks the app's engine in when the profiler is on.
+    """
+    secret = app.config.get("PROFILE_SECRET", PROFILE_SECRET)
+    if not secret:
+        return
+
+    profiler = Profiler(
+        secret,
+        directory=app.config.get("PROFILE_DIR", PROFILE_DIR),
+        sample_rate=app.config.get("PROFILE_SAMPLE_RATE", PROFILE_SAMPLE_RATE),
+        keep=app.config.get("PROFILE_KEEP", PROFILE_KEEP),
+        admin_token=app.config.get("PROFILE_ADMIN_TOKEN", PROFILE_ADMIN_TOKEN),
+    )
+    app.extensions["profiler"] = profiler
+    app.before_request(profiler.before_request)
+    app.after_request(profiler.after_request)
+    app.teardown_request(profiler.teardown_request)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API request profiling helpers")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sign_parser = sub.add_parser("sign", help=f"print a {PROFILE_HEADER} header value")
+    sign_parser.add_argument("--ttl", type=int, default=600, help="seconds the value stays valid")
+    args = parser.parse_args()
+
+    if not PROFILE_SECRET:
+        parser.error("API_PROFILE_SECRET is not set")
+    print(f"{PROFILE_HEADER}: {sign(PROFILE_SECRET, args.ttl)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,47 @@
 """REST API routes for social media application"""
 
-from flask import Blueprint, request, jsonify, current_app
-from app.database import SocialMediaDB
+import json
+import re
+import uuid
+from datetime import datetime
+from flask import Blueprint, Response, request, jsonify, current_app, send_file, stream_with_context
+from app.database import SocialMediaDB, ANALYTICS_BUCKETS
+from app.profiling import ADMIN_TOKEN_HEADER, instrument_engine as instrument_profiled_engine
+from app.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, instrument_engine, registry as metrics_registry
 from app.models import PostCreate, PostResponse, PostListResponse
 from app.messaging import (
     publish_image_resize_event,
     publish_sentiment_analysis_event,
     publish_text_generation_event,  # Only uses prompt now!
 )
+from worker_runtime.lanes import LIVE, PRIORITIES
 
 # --- Import microservice logic at the top for clarity ---
-from text_generator.app.generator import generate_text as ai_generate_text
-from text_generator.app.db import save_generated_text, get_latest_generated_text
+from text_generator.app.generator import MAX_NEW_TOKENS, generate_text as ai_generate_text
+from text_generator.app.db import (
+    save_generated_text,
+    get_latest_generated_text,
+    listen_generation_chunks,
+    StreamLimitReached,
+)
 
 api_bp = Blueprint('api', __name__)
 
 def get_db():
-    """Get database instance with current app configuration"""
-    return SocialMediaDB(current_app.config['DATABASE_URL'])
+    """
+    Database instance of the current app, created on first use
+
+    One instance (and connection pool) per app, instead of a new engine
+    and schema check on every request.
+    """
+    db = current_app.extensions.get('social_media_db')
+    if db is None:
+        db = SocialMediaDB(current_app.config['DATABASE_URL'])
+        instrument_engine(db.engine)
+        if 'profiler' in current_app.extensions:
+            instrument_profiled_engine(db.engine)
+        current_app.extensions['social_media_db'] = db
+    return db
 
 # -------------------------------------------------------------------
 # Health Check
@@ -29,6 +53,13 @@ def health_check():
         'message': 'Social Media API is running'
     }), 200
 
+# -------------------------------------------------------------------
+# Metrics (Prometheus text format)
+# -------------------------------------------------------------------
+@api_bp.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
+
 # -------------------------------------------------------------------
 # Create Post
 # -------------------------------------------------------------------
@@ -49,6 +80,11 @@ def create_post():
         if not is_valid:
             return jsonify({'error': error_msg}), 400
 
+        # Imports and re-processing send "bulk" so they don't delay live posts
+        priority = data.get('priority', LIVE)
+        if priority not in PRIORITIES:
+            return jsonify({'error': f"priority must be one of: {', '.join(PRIORITIES)}"}), 400
+
         db = get_db()
         image_bytes = post.get_image_bytes()
         post_id = db.add_post_with_image_data(
@@ -59,9 +95,9 @@ def create_post():
 
         # Publish events to microservices
         if image_bytes and not current_app.config.get("TESTING", False):
-            publish_image_resize_event(post_id)
+            publish_image_resize_event(post_id, priority)
         if not current_app.config.get("TESTING", False):
-            publish_sentiment_analysis_event(post_id)
+            publish_sentiment_analysis_event(post_id, priority)
             # Text generation NOT tied to creating a post anymore!
 
         created_post = db.get_post_by_id(post_id)
@@ -150,6 +186,11 @@ def generate_text_route():
     POST /posts/generate
     - Publishes prompt to RabbitMQ (async, AI microservice saves to text_suggestions)
     - No post_id, no posts table coupling
+    - Optional "seed" (int) or "do_sample": false make the result reproducible,
+      so repeated prompts are served from the generation cache
+    - Optional "max_new_tokens" (1 to TEXTGEN_MAX_NEW_TOKENS, the worker's own
+      limit) caps the length of the continuation
+    - Returns a job_id; tokens can be followed live at stream_url
     """
     try:
         data = request.get_json()
@@ -160,10 +201,28 @@ def generate_text_route():
         if not prompt:
             return jsonify({'error': 'Prompt is required'}), 400
 
+        seed = data.get('seed')
+        if seed is not None and (isinstance(seed, bool) or not isinstance(seed, int)):
+            return jsonify({'error': 'Seed must be an integer'}), 400
+        do_sample = data.get('do_sample', True)
+        if not isinstance(do_sample, bool):
+            return jsonify({'error': 'do_sample must be a boolean'}), 400
+        max_new_tokens = data.get('max_new_tokens')
+        if max_new_tokens is not None and (
+            isinstance(max_new_tokens, bool) or not isinstance(max_new_tokens, int)
+            or not 1 <= max_new_tokens <= MAX_NEW_TOKENS
+        ):
+            return jsonify({'error': f'max_new_tokens must be an integer between 1 and {MAX_NEW_TOKENS}'}), 400
+
         # Publish prompt to RabbitMQ text_generation queue
-        publish_text_generation_event(prompt)
+        job_id = uuid.uuid4().hex
+        publish_text_generation_event(
+            prompt, seed=seed, do_sample=do_sample, job_id=job_id, max_new_tokens=max_new_tokens
+        )
         return jsonify({
             'prompt': prompt,
+            'job_id': job_id,
+            'stream_url': f'/api/posts/generate/{job_id}/stream',
             'status': 'processing',
             'message': 'Text generation started'
         }), 202
@@ -171,6 +230,57 @@ def generate_text_route():
     except Exception as e:
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
+# -------------------------------------------------------------------
+# Stream Generated Tokens (Server-Sent Events)
+# -------------------------------------------------------------------
+JOB_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+MAX_STREAM_TIMEOUT = 300
+
+@api_bp.route('/posts/generate/<job_id>/stream', methods=['GET'])
+def stream_generated_text_route(job_id):
+    """
+    GET /posts/generate/<job_id>/stream
+    - text/event-stream of {"seq", "text", "done"} events as the worker decodes
+    - The last event has done=true and the full "generated_text"
+    - Optional ?timeout=<seconds> (default 120); ends with a "timeout" event
+    - 503 when the process already serves TEXTGEN_MAX_STREAMS streams
+    """
+    try:
+        if not JOB_ID_RE.match(job_id):
+            return jsonify({'error': 'Invalid job_id'}), 400
+
+        timeout = request.args.get('timeout', 120, type=int)
+        if timeout <= 0 or timeout > MAX_STREAM_TIMEOUT:
+            return jsonify({'error': f'timeout must be between 1 and {MAX_STREAM_TIMEOUT}'}), 400
+
+        try:
+            stream = listen_generation_chunks(job_id, timeout=timeout)
+        except StreamLimitReached:
+            return jsonify({'error': 'Too many open streams, try again later'}), 503
+
+        def events():
+            for chunk in stream:
+                if chunk is None:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f'data: {json.dumps(chunk)}\n\n'
+                if chunk.get('done'):
+                    return
+            # Not finished in time; the result can still be fetched later
+            yield f'event: timeout\ndata: {json.dumps({"job_id": job_id})}\n\n'
+
+        response = Response(
+            stream_with_context(events()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+        # Frees the stream slot even if the body is never iterated
+        response.call_on_close(stream.close)
+        return response
+
+    except Exception as e:
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
 # -------------------------------------------------------------------
 # Get Latest Generated Text (AI Suggestion, no post_id)
 # -------------------------------------------------------------------
@@ -185,6 +295,138 @@ def get_latest_generated_text_route():
     except Exception as e:
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
+# -------------------------------------------------------------------
+# Sentiment Analytics (served from the sentiment_rollup table)
+# -------------------------------------------------------------------
+MAX_USER_LIMIT = 500
+
+@api_bp.route('/analytics/sentiment', methods=['GET'])
+def sentiment_analytics():
+    """
+    GET /analytics/sentiment?bucket=day&since=...&until=...&user=...&user_limit=50
+    - Counts and mean scores per time bucket and per user
+    - since/until are rounded down to the hour; user_limit is 1..500 users
+    """
+    try:
+        bucket = request.args.get('bucket', 'day')
+        if bucket not in ANALYTICS_BUCKETS:
+            return jsonify({'error': f'bucket must be one of: {", ".join(ANALYTICS_BUCKETS)}'}), 400
+
+        try:
+            since = request.args.get('since')
+            until = request.args.get('until')
+            since = datetime.fromisoformat(since) if since else None
+            until = datetime.fromisoformat(until) if until else None
+        except ValueError:
+            return jsonify({'error': 'since/until must be ISO 8601 timestamps'}), 400
+
+        user = request.args.get('user') or None
+        user_limit = request.args.get('user_limit', 50, type=int)
+        if user_limit < 1 or user_limit > MAX_USER_LIMIT:
+            return jsonify({'error': f'user_limit must be between 1 and {MAX_USER_LIMIT}'}), 400
+
+        db = get_db()
+        analytics = db.get_sentiment_analytics(
+            bucket=bucket, since=since, until=until, user=user, user_limit=user_limit
+        )
+        return jsonify({
+            'bucket': bucket,
+            'since': since.isoformat() if since else None,
+            'until': until.isoformat() if until else None,
+            'buckets': [
+                {**row, 'bucket': row['bucket'].isoformat()} for row in analytics['buckets']
+            ],
+            'users': analytics['users']
+        }), 200
+    except Exception as e:
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+@api_bp.route('/analytics/enrichment-latency', methods=['GET'])
+def enrichment_latency():
+    """
+    GET /analytics/enrichment-latency?since=...&service=...
+    - Latency histograms and p50/p95/p99 per worker service and stage
+      (queue_wait, fetch, compute, write, total), from enrichment_traces
+    """
+    try:
+        try:
+            since = request.args.get('since')
+            since = datetime.fromisoformat(since) if since else None
+        except ValueError:
+            return jsonify({'error': 'since must be an ISO 8601 timestamp'}), 400
+
+        service = request.args.get('service') or None
+
+        db = get_db()
+        return jsonify({
+            'since': since.isoformat() if since else None,
+            'stages': db.get_enrichment_latency(since=since, service=service)
+        }), 200
+    except Exception as e:
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+# -------------------------------------------------------------------
+# Admin: request profiles (see app/profiling.py)
+# -------------------------------------------------------------------
+def get_profiler():
+    """
+    The app's profiler if profiling is on and the caller sent the admin
+    token; otherwise an error response
+    """
+    profiler = current_app.extensions.get('profiler')
+    if profiler is None:
+        return None, (jsonify({'error': 'Profiling is not enabled'}), 404)
+    if not profiler.is_admin(request.headers.get(ADMIN_TOKEN_HEADER)):
+        return None, (jsonify({'error': 'Forbidden'}), 403)
+    return profiler, None
+
+@api_bp.route('/admin/profiling', methods=['PUT'])
+def set_profiling():
+    """
+    PUT /admin/profiling {"sample_rate": 0.05}
+    - Fraction of requests this process profiles (0 = only signed ones)
+    """
+    profiler, error = get_profiler()
+    if error:
+        return error
+    data = request.get_json(silent=True) or {}
+    sample_rate = data.get('sample_rate')
+    if isinstance(sample_rate, bool) or not isinstance(sample_rate, (int, float)) or not 0 <= sample_rate <= 1:
+        return jsonify({'error': 'sample_rate must be a number between 0 and 1'}), 400
+    profiler.sample_rate = float(sample_rate)
+    return jsonify({'sample_rate': profiler.sample_rate}), 200
+
+@api_bp.route('/admin/profiles', methods=['GET'])
+def list_profiles():
+    profiler, error = get_profiler()
+    if error:
+        return error
+    profiles = profiler.profiles()
+    return jsonify({'sample_rate': profiler.sample_rate, 'count': len(profiles), 'profiles': profiles}), 200
+
+@api_bp.route('/admin/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    """Summary of one profile: timings, SQL statements and top functions"""
+    profiler, error = get_profiler()
+    if error:
+        return error
+    profile = profiler.get(profile_id)
+    if profile is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return jsonify(profile), 200
+
+@api_bp.route('/admin/profiles/<profile_id>/pstats', methods=['GET'])
+def download_profile(profile_id):
+    """The raw cProfile output, for pstats / snakeviz / flameprof"""
+    profiler, error = get_profiler()
+    if error:
+        return error
+    path = profiler.pstats_path(profile_id)
+    if path is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                     download_name=f'{profile_id}.pstats')
+
 # -------------------------------------------------------------------
 # Error Handlers
 # -------------------------------------------------------------------
@@ -0,0 +1 @@
+# Image resizer package
@@ -1,12 +1,8 @@
-import os
-from typing import Optional
+from typing import Optional, Tuple
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 
-
-def _get_engine():
-    db_url = os.environ["DATABASE_URL"]
-    return create_engine(db_url)
+from worker_runtime import get_engine as _get_engine
 
 
 def get_full_image(post_id: int) -> Optional[bytes]:
@@ -22,10 +18,37 @@ def get_full_image(post_id: int) -> Optional[bytes]:
     return row[0]
 
 
-def update_thumbnail(post_id: int, thumb_bytes: bytes) -> None:
+def get_image_to_resize(post_id: int) -> Tuple[bool, Optional[bytes]]:
+    """
+    (already_done, full_image) for a post in one query
+
+    The full image is only transferred when the post has no thumbnail yet.
+    """
+    engine = _get_engine()
+    with engine.begin() as conn:
+        row = conn.execute(
+            text("""
+                SELECT image_thumb IS NOT NULL,
+                       CASE WHEN image_thumb IS NULL THEN image END
+                FROM posts WHERE id = :id
+            """),
+            {"id": post_id}
+        ).fetchone()
+
+    if not row:
+        return False, None
+    return bool(row[0]), row[1]
+
+
+def update_thumbnail(post_id: int, thumb_bytes: bytes) -> bool:
+    """Store a thumbnail unless the post already has one; True if written"""
     engine = _get_engine()
     with engine.begin() as conn:
-        conn.execute(
-            text("UPDATE posts SET image_thumb = :thumb WHERE id = :id"),
+        result = conn.execute(
+            text("""
+                UPDATE posts SET image_thumb = :thumb, thumb_completed_at = now()
+                WHERE id = :id AND image_thumb IS NULL
+            """),
             {"thumb": thumb_bytes, "id": post_id}
-        )
\ No newline at end of file
+        )
+    return result.rowcount > 0
\ No newline at end of file
@@ -1,16 +1,28 @@
+from contextlib import nullcontext
 from io import BytesIO
 from PIL import Image
 
 
-def make_thumbnail(image_bytes: bytes, max_width: int = 600, quality: int = 70) -> bytes:
+def _untimed(name: str):
+    return nullcontext()
+
+
+def make_thumbnail(image_bytes: bytes, max_width: int = 600, quality: int = 70, stage=_untimed) -> bytes:
     """
     Create a reduced-size JPEG thumbnail while keeping aspect ratio.
     - max_width: target maximum width
     - quality: JPEG quality (smaller -> faster)
+    - stage: called with "image_decode", "convert", "resize" and "encode",
+      returns a context manager timing that step (e.g. Trace.stage)
     Returns: JPEG bytes
     """
-    with Image.open(BytesIO(image_bytes)) as img:
-        img = img.convert("RGB")  # ensure JPEG compatible
+    with stage("image_decode"):
+        img = Image.open(BytesIO(image_bytes))
+        img.load()  # open() only reads the header
+
+    with img:
+        with stage("convert"):
+            img = img.convert("RGB")  # ensure JPEG compatible
 
         w, h = img.size
         if w <= max_width:
@@ -20,8 +32,10 @@ def make_thumbnail(image_bytes: bytes, max_width: int = 600, quality: int = 70)
             new_w = max_width
             new_h = int(h * ratio)
 
-        resized = img.resize((new_w, new_h))
+        with stage("resize"):
+            resized = img.resize((new_w, new_h))
 
-        out = BytesIO()
-        resized.save(out, format="JPEG", quality=quality, optimize=True)
-        return out.getvalue()
\ No newline at end of file
+        with stage("encode"):
+            out = BytesIO()
+            resized.save(out, format="JPEG", quality=quality, optimize=True)
+            return out.getvalue()
@@ -0,0 +1,104 @@
+import importlib
+import importlib.util
+import json
+import os
+import sys
+import threading
+from io import BytesIO
+from types import SimpleNamespace
+
+from PIL import Image
+
+# --------------------------------------------------
+# Load the service package under its own name: "app" is the API's package
+# when these tests run with the backend ones
+# --------------------------------------------------
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "app"))
+
+spec = importlib.util.spec_from_file_location(
+    "resizer_app", os.path.join(APP_DIR, "__init__.py"), submodule_search_locations=[APP_DIR]
+)
+sys.modules["resizer_app"] = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(sys.modules["resizer_app"])
+
+consumer = importlib.import_module("resizer_app.consumer")
+
+
+class FakeChannel:
+    def __init__(self):
+        self.is_open = True
+        self.acked = []
+        self.nacked = []
+        self.published = []
+
+    def basic_ack(self, delivery_tag):
+        self.acked.append(delivery_tag)
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.published.append((routing_key, properties.headers))
+
+    def basic_nack(self, delivery_tag, requeue):
+        self.nacked.append(delivery_tag)
+
+
+def _message(tag, post_id):
+    body = json.dumps({"post_id": post_id}).encode("utf-8")
+    return SimpleNamespace(delivery_tag=tag), SimpleNamespace(headers=None), body
+
+
+def _png() -> bytes:
+    out = BytesIO()
+    Image.new("RGB", (800, 600)).save(out, format="PNG")
+    return out.getvalue()
+
+
+def _fresh_stats(monkeypatch):
+    monkeypatch.setattr(consumer, "stats", {"resized": 0, "skipped": 0, "duplicates": 0})
+    # No enrichment_traces table here
+    monkeypatch.setattr(consumer.Trace, "save", lambda self: None)
+
+
+def test_post_with_thumbnail_is_skipped_before_decoding(monkeypatch):
+    """Test that a redelivered message is acked without touching the image"""
+    _fresh_stats(monkeypatch)
+    monkeypatch.setattr(consumer, "get_image_to_resize", lambda post_id: (True, None))
+    monkeypatch.setattr(consumer, "make_thumbnail", lambda *args, **kwargs: 1 / 0)
+
+    ch = FakeChannel()
+    consumer.handle_message(ch, *_message(10, 1))
+
+    assert ch.acked == [10]
+    assert consumer.stats == {"resized": 0, "skipped": 1, "duplicates": 0}
+
+
+def test_thumbnail_written_meanwhile_is_discarded(monkeypatch):
+    """Test that losing the race to write counts as a duplicate and still acks"""
+    _fresh_stats(monkeypatch)
+    written = iter([1, 0])
+    monkeypatch.setattr(consumer, "get_image_to_resize", lambda post_id: (False, _png()))
+    monkeypatch.setattr(consumer, "update_thumbnail", lambda post_id, thumb: next(written))
+
+    ch = FakeChannel()
+    consumer.handle_message(ch, *_message(10, 1))
+    consumer.handle_message(ch, *_message(11, 1))
+
+    assert ch.acked == [10, 11]
+    assert ch.published == [] and ch.nacked == []
+    assert consumer.stats == {"resized": 1, "skipped": 0, "duplicates": 1}
+
+
+def test_stats_are_thread_safe(monkeypatch):
+    """Test that counts from concurrent handler threads are not lost"""
+    _fresh_stats(monkeypatch)
+
+    def count():
+        for _ in range(10000):
+            consumer._count(resized=1, duplicates=1)
+
+    threads = [threading.Thread(target=count) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert consumer.stats == {"resized": 40000, "skipped": 0, "duplicates": 40000}
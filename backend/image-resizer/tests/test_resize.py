@@ -44,4 +44,12 @@ def test_make_thumbnail_keeps_small_images_same_width():
     w, h = img.size
 
     assert w == 400
-    assert h == 300
\ No newline at end of file
+    assert h == 300
+
+def test_make_thumbnail_times_each_step():
+    from contextlib import nullcontext
+
+    steps = []
+    make_thumbnail(_make_test_png(1200, 800), stage=lambda name: steps.append(name) or nullcontext())
+
+    assert steps == ["image_decode", "convert", "resize", "encode"]
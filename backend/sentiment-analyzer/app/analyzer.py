@@ -1,53 +1,298 @@
 from transformers import pipeline
+import functools
 import logging
+import os
+import threading
+
+from worker_runtime.metrics import WorkerMetrics, metrics as worker_metrics
+
+from app.lexicon import score_texts
+from worker_runtime.model_cache import (
+    export_dir,
+    export_model,
+    is_cached,
+    load_cached_model,
+    load_cached_tokenizer,
+    startup_timer,
+)
+
+MODEL_NAME = "distilbert-base-uncased-finetuned-sst-2-english"
+
+# Inference backend: "pytorch" (full precision), "quantized" (dynamic int8)
+# or "onnx" (exported model run through ONNX Runtime, needs optimum)
+SENTIMENT_BACKEND = os.getenv("SENTIMENT_BACKEND", "pytorch")
+
+# Lexicon fast path: posts the lexicon scores at or above the threshold are
+# labelled directly, only the rest go through the model
+LEXICON_CASCADE = os.getenv("SENTIMENT_LEXICON_CASCADE", "0") == "1"
+LEXICON_THRESHOLD = float(os.getenv("SENTIMENT_LEXICON_THRESHOLD", "0.8"))
+
+# Identifies the model that produced a stored result; bump it (or change the
+# backend) to invalidate cached sentiment results
+MODEL_VERSION = os.getenv(
+    "SENTIMENT_MODEL_VERSION",
+    f"{MODEL_NAME}@{SENTIMENT_BACKEND}"
+    + (f"+lexicon@{LEXICON_THRESHOLD}" if LEXICON_CASCADE else "")
+)
+
+# Where the exported ONNX model is kept so it is only exported once
+ONNX_MODEL_DIR = os.getenv("SENTIMENT_ONNX_DIR", "/tmp/sentiment-onnx")
+ONNX_WEIGHTS_FILE = "model.onnx"
+
+# Local safetensors export of MODEL_NAME, loaded memory-mapped (see
+# worker_runtime.model_cache); written on the first start if missing. Empty = off
+MODEL_CACHE_DIR = os.getenv("SENTIMENT_MODEL_DIR", "")
 
 # Global variable to cache the model
 _sentiment_pipeline = None
 
+# How many posts the cascade labelled with the lexicon vs the model
+_cascade_counts = {"lexicon": 0, "model": 0}
+_cascade_lock = threading.Lock()
+
+# Model has a max token limit, so posts are truncated before inference
+MAX_TEXT_CHARS = 500
+
+
+def _load_model_and_tokenizer():
+    """MODEL_NAME from the local export when there is one, else from the hub"""
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    if MODEL_CACHE_DIR and not is_cached(MODEL_CACHE_DIR):
+        try:
+            with startup_timer.phase("export"):
+                logging.info(f"[sentiment] Exporting {MODEL_NAME} to {MODEL_CACHE_DIR}...")
+                export_model(
+                    AutoModelForSequenceClassification.from_pretrained(MODEL_NAME),
+                    AutoTokenizer.from_pretrained(MODEL_NAME),
+                    MODEL_CACHE_DIR
+                )
+        except Exception as e:
+            logging.warning(f"[sentiment] Could not export model to {MODEL_CACHE_DIR}: {e}")
+
+    if MODEL_CACHE_DIR and is_cached(MODEL_CACHE_DIR):
+        model = load_cached_model(AutoModelForSequenceClassification, MODEL_CACHE_DIR)
+        tokenizer = load_cached_tokenizer(MODEL_CACHE_DIR)
+        return model, tokenizer
+
+    with startup_timer.phase("weights"):
+        model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME)
+        model.eval()
+    with startup_timer.phase("tokenizer"):
+        tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    return model, tokenizer
+
+
+def _load_pytorch():
+    model, tokenizer = _load_model_and_tokenizer()
+    with startup_timer.phase("pipeline"):
+        return pipeline(
+            "sentiment-analysis",
+            model=model,
+            tokenizer=tokenizer,
+            device=-1  # Use CPU
+        )
+
+
+def _load_quantized():
+    import torch
+
+    model, tokenizer = _load_model_and_tokenizer()
+    with startup_timer.phase("quantize"):
+        # Linear layers hold nearly all of DistilBERT's weights and FLOPs
+        model = torch.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    with startup_timer.phase("pipeline"):
+        return pipeline(
+            "sentiment-analysis",
+            model=model,
+            tokenizer=tokenizer,
+            device=-1
+        )
+
+
+def _load_onnx():
+    try:
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+    except ImportError as e:
+        raise RuntimeError(
+            "SENTIMENT_BACKEND=onnx requires optimum[onnxruntime] (requirements-onnx.txt) to be installed"
+        ) from e
+    from transformers import AutoTokenizer
+
+    if not is_cached(ONNX_MODEL_DIR, ONNX_WEIGHTS_FILE):
+        # From the local export when there is one, so nothing is downloaded
+        source = MODEL_CACHE_DIR if is_cached(MODEL_CACHE_DIR) else MODEL_NAME
+        with startup_timer.phase("export"):
+            logging.info(f"[sentiment] Exporting {source} to ONNX ({ONNX_MODEL_DIR})...")
+            with export_dir(ONNX_MODEL_DIR, ONNX_WEIGHTS_FILE) as tmp_path:
+                ORTModelForSequenceClassification.from_pretrained(source, export=True).save_pretrained(tmp_path)
+                AutoTokenizer.from_pretrained(source).save_pretrained(tmp_path)
+
+    with startup_timer.phase("weights"):
+        model = ORTModelForSequenceClassification.from_pretrained(ONNX_MODEL_DIR)
+    with startup_timer.phase("tokenizer"):
+        tokenizer = AutoTokenizer.from_pretrained(ONNX_MODEL_DIR)
+    with startup_timer.phase("pipeline"):
+        return pipeline(
+            "sentiment-analysis",
+            model=model,
+            tokenizer=tokenizer
+        )
+
+
+BACKENDS = {
+    "pytorch": _load_pytorch,
+    "quantized": _load_quantized,
+    "onnx": _load_onnx,
+}
+
+
+def load_sentiment_pipeline(backend: str):
+    """Build a fresh sentiment pipeline for the given inference backend"""
+    if backend not in BACKENDS:
+        raise ValueError(
+            f"Unknown sentiment backend {backend!r} (expected one of {sorted(BACKENDS)})"
+        )
+    return BACKENDS[backend]()
+
+
+# Pipeline steps timed as worker stages: tokenization, the model call, and
+# turning logits into labels
+PIPELINE_STAGES = {"preprocess": "tokenize", "_forward": "infer", "postprocess": "postprocess"}
+
+
+def time_pipeline_stages(pipeline_obj, metrics: WorkerMetrics = worker_metrics):
+    """Wrap the pipeline's steps so each call is timed in `metrics`"""
+    for attr, stage in PIPELINE_STAGES.items():
+        step = getattr(pipeline_obj, attr, None)
+        if step is not None:
+            setattr(pipeline_obj, attr, _timed(step, stage, metrics))
+    return pipeline_obj
+
+
+def _timed(step, stage: str, metrics: WorkerMetrics):
+    @functools.wraps(step)
+    def timed(*args, **kwargs):
+        with metrics.time(stage):
+            return step(*args, **kwargs)
+    return timed
+
 
 def get_sentiment_pipeline():
     """Get or create sentiment analysis pipeline (with caching)"""
     global _sentiment_pipeline
     
     if _sentiment_pipeline is None:
-        logging.info("[sentiment] Loading sentiment analysis model...")
-        # Use a small, fast model
-        _sentiment_pipeline = pipeline(
-            "sentiment-analysis",
-            model="distilbert-base-uncased-finetuned-sst-2-english",
-            device=-1  # Use CPU
-        )
-        logging.info("[sentiment] Model loaded successfully")
+        logging.info(f"[sentiment] Loading sentiment analysis model (backend={SENTIMENT_BACKEND})...")
+        _sentiment_pipeline = time_pipeline_stages(load_sentiment_pipeline(SENTIMENT_BACKEND))
+        logging.info(f"[sentiment] Model loaded successfully ({startup_timer.summary()})")
     
     return _sentiment_pipeline
 
 
-def analyze_sentiment(text: str) -> tuple[str, str]:
+def analyze_sentiment(text: str) -> tuple[str, float]:
     """
     Analyze sentiment of text
+
+    A model error raises, like in analyze_sentiment_batch, so the message
+    is retried rather than stored as UNKNOWN.
     
     Returns:
-        tuple: (sentiment_label, sentiment_score_str)
-        Example: ("POSITIVE", "0.9998")
+        tuple: (sentiment_label, sentiment_score)
+        Example: ("POSITIVE", 0.9998)
     """
-    try:
-        pipeline_obj = get_sentiment_pipeline()
-        
-        # Truncate text if too long (model has max token limit)
-        max_chars = 500
-        if len(text) > max_chars:
-            text = text[:max_chars]
-        
-        result = pipeline_obj(text)[0]
-        
-        label = result['label']  # "POSITIVE" or "NEGATIVE"
-        score = result['score']  # confidence 0.0 to 1.0
-        
-        # Format score as string with 4 decimal places
-        score_str = f"{score:.4f}"
-        
-        return label, score_str
-        
-    except Exception as e:
-        logging.error(f"[sentiment] Error analyzing sentiment: {e}")
-        return "UNKNOWN", "0.0000"
+    pipeline_obj = get_sentiment_pipeline()
+    
+    # Truncate text if too long (model has max token limit)
+    if len(text) > MAX_TEXT_CHARS:
+        text = text[:MAX_TEXT_CHARS]
+    
+    result = pipeline_obj(text)[0]
+    
+    label = result['label']  # "POSITIVE" or "NEGATIVE"
+    score = result['score']  # confidence 0.0 to 1.0
+    
+    # Rounded to 4 decimal places
+    return label, round(score, 4)
+
+
+def analyze_sentiment_batch(texts: list[str], batch_size: int = 16) -> list[tuple[str, float]]:
+    """
+    Analyze sentiment of several texts with a single pipeline call
+
+    Texts are sorted by length before inference so each padded batch of
+    `batch_size` holds similarly sized inputs; results come back in input order.
+    A model error raises, so the whole batch is retried rather than stored
+    as UNKNOWN.
+
+    Returns:
+        list: [(sentiment_label, sentiment_score), ...]
+    """
+    if not texts:
+        return []
+
+    pipeline_obj = get_sentiment_pipeline()
+
+    truncated = [text[:MAX_TEXT_CHARS] for text in texts]
+    order = sorted(range(len(truncated)), key=lambda i: len(truncated[i]))
+
+    outputs = pipeline_obj(
+        [truncated[i] for i in order],
+        batch_size=min(batch_size, len(order))
+    )
+
+    results = [None] * len(texts)
+    for i, result in zip(order, outputs):
+        results[i] = (result['label'], round(result['score'], 4))
+    return results
+
+
+def analyze_sentiment_cascade(texts: list[str], threshold: float = LEXICON_THRESHOLD) -> list[tuple[str, float]]:
+    """
+    Label confident posts with the lexicon and send only the rest to the model
+
+    Lexicon scores are reported on the model's scale (0.5 = undecided).
+    """
+    if not texts:
+        return []
+
+    labels, confidence = score_texts(texts)
+    results = [None] * len(texts)
+    uncertain = []
+    for i, (label, conf) in enumerate(zip(labels, confidence)):
+        if conf >= threshold:
+            results[i] = (label, round(0.5 + conf / 2, 4))
+        else:
+            uncertain.append(i)
+
+    if uncertain:
+        for i, result in zip(uncertain, analyze_sentiment_batch([texts[i] for i in uncertain])):
+            results[i] = result
+
+    with _cascade_lock:
+        before = _cascade_counts["lexicon"] + _cascade_counts["model"]
+        _cascade_counts["lexicon"] += len(texts) - len(uncertain)
+        _cascade_counts["model"] += len(uncertain)
+    if before // 1000 != (before + len(texts)) // 1000:
+        logging.info(f"[sentiment] Lexicon cascade stats: {cascade_stats()}")
+
+    return results
+
+
+def cascade_stats() -> dict:
+    """Share of posts the cascade labelled without running the model"""
+    with _cascade_lock:
+        total = _cascade_counts["lexicon"] + _cascade_counts["model"]
+        return {
+            **_cascade_counts,
+            "skip_share": _cascade_counts["lexicon"] / total if total else 0.0,
+        }
+
+
+def analyze_texts(texts: list[str]) -> list[tuple[str, float]]:
+    """Analyze a batch with the configured strategy (lexicon cascade or model only)"""
+    if LEXICON_CASCADE:
+        return analyze_sentiment_cascade(texts)
+    return analyze_sentiment_batch(texts)
@@ -0,0 +1,135 @@
+"""
+Streaming sentiment backfill / re-scoring job
+
+Scores posts that have no sentiment yet, or were scored by an older model
+version, straight from the database (bypassing RabbitMQ): posts are streamed
+from a server-side cursor in id order, run through batched inference and
+written back with one bulk update per batch. Progress is checkpointed after
+each batch, so an interrupted run resumes where it stopped.
+
+Usage:
+    python -m app.backfill
+    python -m app.backfill --only-missing --batch-size 128
+    python -m app.backfill --checkpoint /data/backfill.json --restart
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+from app import db
+from app.analyzer import MODEL_VERSION
+from app.cache import analyze_with_cache
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+DEFAULT_CHECKPOINT = os.getenv("SENTIMENT_BACKFILL_CHECKPOINT", "/tmp/sentiment-backfill.json")
+
+
+def load_checkpoint(path: str, model_version: str) -> int:
+    """Last post id scored by a previous run for the same model version"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return 0
+
+    if state.get("model_version") != model_version:
+        return 0
+    return int(state.get("last_id", 0))
+
+
+def save_checkpoint(path: str, model_version: str, last_id: int, processed: int) -> None:
+    """Atomically record progress"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "model_version": model_version,
+            "last_id": last_id,
+            "processed": processed,
+            "updated_at": time.time(),
+        }, f)
+    os.replace(tmp_path, path)
+
+
+def run_backfill(only_missing: bool = False, batch_size: int = 128,
+                 checkpoint: Optional[str] = DEFAULT_CHECKPOINT,
+                 limit: Optional[int] = None) -> dict:
+    """Score every qualifying post; returns a summary of the run"""
+    after_id = load_checkpoint(checkpoint, MODEL_VERSION) if checkpoint else 0
+    logging.info(
+        f"[sentiment] Backfill starting after post_id={after_id} "
+        f"(model_version={MODEL_VERSION}, only_missing={only_missing}, batch_size={batch_size})"
+    )
+
+    processed = 0
+    start = time.perf_counter()
+
+    for batch in db.iter_posts_to_score(MODEL_VERSION, only_missing, after_id, batch_size):
+        if limit is not None:
+            batch = batch[:limit - processed]
+        if not batch:
+            break
+
+        results = analyze_with_cache([text or "" for _, text in batch])
+        db.update_sentiments([
+            (post_id, label, score)
+            for (post_id, _), (label, score) in zip(batch, results)
+        ], MODEL_VERSION)
+
+        processed += len(batch)
+        after_id = batch[-1][0]
+        if checkpoint:
+            save_checkpoint(checkpoint, MODEL_VERSION, after_id, processed)
+
+        elapsed = time.perf_counter() - start
+        logging.info(
+            f"[sentiment] Backfill scored {processed} posts up to post_id={after_id} "
+            f"({processed / elapsed:.1f} posts/s)"
+        )
+
+        if limit is not None and processed >= limit:
+            break
+
+    elapsed = time.perf_counter() - start
+    return {
+        "model_version": MODEL_VERSION,
+        "processed": processed,
+        "last_id": after_id,
+        "seconds": round(elapsed, 3),
+        "posts_per_second": processed / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score or re-score posts without going through RabbitMQ")
+    parser.add_argument("--only-missing", action="store_true",
+                        help="only posts without a label (skip re-scoring older model versions)")
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--limit", type=int, help="stop after this many posts")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT,
+                        help="progress file used to resume interrupted runs")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    args = parser.parse_args()
+
+    db.init_sentiment_tables()
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    summary = run_backfill(
+        only_missing=args.only_missing,
+        batch_size=args.batch_size,
+        checkpoint=args.checkpoint,
+        limit=args.limit,
+    )
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
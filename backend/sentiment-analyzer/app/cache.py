@@ -0,0 +1,179 @@
+"""
+Content-hash sentiment result cache
+
+Results are keyed by a hash of the normalized, truncated post text plus the
+model version, in two tiers:
+- an in-process LRU (per worker)
+- the `sentiment_cache` Postgres table (shared by all replicas)
+
+Usage:
+    python -m app.cache --stats
+    python -m app.cache --invalidate        # drop results of older model versions
+    python -m app.cache --invalidate --all  # drop everything
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from app import db
+from app.analyzer import MAX_TEXT_CHARS, MODEL_VERSION, analyze_texts
+
+CACHE_ENABLED = os.getenv("SENTIMENT_CACHE", "1") == "1"
+CACHE_PERSISTENT = os.getenv("SENTIMENT_CACHE_PERSISTENT", "1") == "1"
+CACHE_SIZE = int(os.getenv("SENTIMENT_CACHE_SIZE", "10000"))
+
+# Log hit-rate stats every N lookups
+STATS_LOG_EVERY = int(os.getenv("SENTIMENT_CACHE_STATS_EVERY", "1000"))
+
+
+def text_hash(text: str, model_version: str = MODEL_VERSION) -> str:
+    """Hash of the normalized, truncated text as the model would see it"""
+    # The model is uncased and the tokenizer collapses whitespace
+    normalized = " ".join(text[:MAX_TEXT_CHARS].split()).lower()
+    return hashlib.sha256(f"{model_version}\0{normalized}".encode("utf-8")).hexdigest()
+
+
+class SentimentCache:
+    """Thread-safe LRU of {text_hash: (label, score)} with hit-rate counters"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.lru_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def get_many(self, keys: list[str]) -> dict[str, tuple[str, float]]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._items:
+                    self._items.move_to_end(key)
+                    found[key] = self._items[key]
+        return found
+
+    def put_many(self, results: dict[str, tuple[str, float]]) -> None:
+        with self._lock:
+            for key, value in results.items():
+                self._items[key] = value
+                self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def record(self, lru_hits: int = 0, db_hits: int = 0, misses: int = 0) -> None:
+        with self._lock:
+            self.lru_hits += lru_hits
+            self.db_hits += db_hits
+            self.misses += misses
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict:
+        lookups = self.lru_hits + self.db_hits + self.misses
+        hits = self.lru_hits + self.db_hits
+        return {
+            "lookups": lookups,
+            "lru_hits": self.lru_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "lru_size": len(self._items),
+        }
+
+
+_cache = SentimentCache(CACHE_SIZE)
+_lookups_since_log = 0
+
+
+def get_cache() -> SentimentCache:
+    return _cache
+
+
+def analyze_with_cache(texts: list[str]) -> list[tuple[str, float]]:
+    """
+    Like analyze_texts, but serves repeated texts from the cache
+
+    Only cache misses reach the model. Failures of the persistent tier are
+    logged and treated as misses so they never block inference.
+    """
+    global _lookups_since_log
+
+    if not CACHE_ENABLED:
+        return analyze_texts(texts)
+
+    keys = [text_hash(text) for text in texts]
+    unique_keys = list(dict.fromkeys(keys))
+
+    found = _cache.get_many(unique_keys)
+    _cache.record(lru_hits=len(found))
+
+    missing = [key for key in unique_keys if key not in found]
+    if missing and CACHE_PERSISTENT:
+        try:
+            from_db = db.get_cached_sentiments(missing, MODEL_VERSION)
+        except Exception as e:
+            logging.warning(f"[sentiment] Cache lookup failed: {e}")
+            from_db = {}
+        _cache.record(db_hits=len(from_db))
+        _cache.put_many(from_db)
+        found.update(from_db)
+        missing = [key for key in missing if key not in from_db]
+
+    if missing:
+        _cache.record(misses=len(missing))
+        first_text = {}
+        for key, text in zip(keys, texts):
+            first_text.setdefault(key, text)
+
+        # Inference failures raise, so only real results get here
+        computed = dict(zip(
+            missing,
+            analyze_texts([first_text[key] for key in missing])
+        ))
+        found.update(computed)
+
+        _cache.put_many(computed)
+        if CACHE_PERSISTENT:
+            try:
+                db.save_cached_sentiments(computed, MODEL_VERSION)
+            except Exception as e:
+                logging.warning(f"[sentiment] Cache store failed: {e}")
+
+    _lookups_since_log += len(unique_keys)
+    if STATS_LOG_EVERY and _lookups_since_log >= STATS_LOG_EVERY:
+        _lookups_since_log = 0
+        logging.info(f"[sentiment] Cache stats: {_cache.stats()}")
+
+    return [found[key] for key in keys]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sentiment result cache maintenance")
+    parser.add_argument("--stats", action="store_true", help="show cached rows per model version")
+    parser.add_argument("--invalidate", action="store_true",
+                        help=f"delete results not produced by {MODEL_VERSION}")
+    parser.add_argument("--all", action="store_true", help="with --invalidate, delete every result")
+    args = parser.parse_args()
+
+    db.init_sentiment_tables()
+
+    if args.invalidate:
+        deleted = db.delete_cached_sentiments(None if args.all else MODEL_VERSION)
+        print(json.dumps({"deleted": deleted, "model_version": MODEL_VERSION}))
+
+    if args.stats or not args.invalidate:
+        print(json.dumps({
+            "current_version": MODEL_VERSION,
+            "rows_per_version": db.count_cached_sentiments(),
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
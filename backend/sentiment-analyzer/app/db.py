@@ -1,11 +1,7 @@
-import os
-from typing import Optional
-from sqlalchemy import create_engine, text
+from typing import Iterator, Optional
+from sqlalchemy import text
 
-
-def _get_engine():
-    db_url = os.environ["DATABASE_URL"]
-    return create_engine(db_url)
+from worker_runtime import get_engine as _get_engine
 
 
 def get_post_text(post_id: int) -> Optional[str]:
@@ -22,11 +18,215 @@ def get_post_text(post_id: int) -> Optional[str]:
     return row[0]
 
 
-def update_sentiment(post_id: int, sentiment_label: str, sentiment_score: str) -> None:
-    """Update post with sentiment analysis results"""
+def get_post_texts(post_ids: list[int]) -> dict[int, str]:
+    """Get texts for several posts in one query (missing posts are omitted)"""
+    if not post_ids:
+        return {}
+
+    engine = _get_engine()
+    with engine.begin() as conn:
+        rows = conn.execute(
+            text("SELECT id, text FROM posts WHERE id = ANY(:ids)"),
+            {"ids": list(post_ids)}
+        ).fetchall()
+
+    return {row[0]: row[1] for row in rows if row[1] is not None}
+
+
+def get_posts_to_score(post_ids: list[int], model_version: str) -> tuple[dict[int, str], set[int]]:
+    """
+    Split posts into ({post_id: text} still to be scored by `model_version`,
+    {post_id} already scored by it) in one query
+
+    Text of posts that are already done is not fetched; missing posts and
+    posts without text are in neither.
+    """
+    if not post_ids:
+        return {}, set()
+
+    engine = _get_engine()
+    with engine.begin() as conn:
+        rows = conn.execute(
+            text("""
+                SELECT id,
+                       sentiment_version IS NOT DISTINCT FROM :version AS done,
+                       CASE WHEN sentiment_version IS NOT DISTINCT FROM :version THEN NULL ELSE text END
+                FROM posts
+                WHERE id = ANY(:ids)
+            """),
+            {"ids": list(post_ids), "version": model_version}
+        ).fetchall()
+
+    pending = {row[0]: row[2] for row in rows if not row[1] and row[2] is not None}
+    done = {row[0] for row in rows if row[1]}
+    return pending, done
+
+
+# Conditional: never rewrites a result the same model version already stored
+# (a redelivered or duplicate message racing the first copy)
+_UPDATE_SENTIMENT = text("""
+    UPDATE posts
+    SET sentiment_label = :label, sentiment_score = :score, sentiment_version = :version,
+        sentiment_completed_at = now()
+    WHERE id = :id
+      AND (CAST(:version AS VARCHAR) IS NULL OR sentiment_version IS DISTINCT FROM CAST(:version AS VARCHAR))
+""")
+
+
+def update_sentiment(post_id: int, sentiment_label: str, sentiment_score: float,
+                     model_version: Optional[str] = None) -> int:
+    """Update post with sentiment analysis results; returns rows written (0 or 1)"""
+    engine = _get_engine()
+    with engine.begin() as conn:
+        result = conn.execute(
+            _UPDATE_SENTIMENT,
+            {"label": sentiment_label, "score": sentiment_score, "version": model_version, "id": post_id}
+        )
+    return result.rowcount
+
+
+def update_sentiments(results: list[tuple[int, str, float]], model_version: Optional[str] = None) -> int:
+    """
+    Update several posts in one transaction: [(post_id, label, score), ...]
+
+    Returns the number of posts written; posts already holding a result of
+    `model_version` are left alone.
+    """
+    if not results:
+        return 0
+
+    engine = _get_engine()
+    with engine.begin() as conn:
+        result = conn.execute(
+            _UPDATE_SENTIMENT,
+            [
+                {"label": label, "score": score, "version": model_version, "id": post_id}
+                for post_id, label, score in results
+            ]
+        )
+    return result.rowcount
+
+
+def iter_posts_to_score(model_version: str, only_missing: bool = False,
+                        after_id: int = 0, batch_size: int = 256) -> Iterator[list[tuple[int, str]]]:
+    """
+    Stream [(post_id, text), ...] batches of posts needing (re-)scoring, by id
+
+    Uses a server-side cursor so memory stays flat however large the table is.
+    Posts qualify when they have no label or (unless `only_missing`) were
+    scored by a different model version.
+    """
+    condition = "sentiment_label IS NULL"
+    if not only_missing:
+        condition += " OR sentiment_version IS DISTINCT FROM :version"
+
+    engine = _get_engine()
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=batch_size).execute(
+            text(f"""
+                SELECT id, text FROM posts
+                WHERE id > :after AND ({condition})
+                ORDER BY id
+            """),
+            {"after": after_id, "version": model_version}
+        )
+        for rows in result.partitions(batch_size):
+            yield [(row[0], row[1]) for row in rows]
+
+
+def init_sentiment_tables() -> None:
+    """
+    Create the persistent sentiment result cache shared by all replicas and
+    the columns recording which model version scored each post and when
+    """
+    engine = _get_engine()
+    with engine.begin() as conn:
+        # DDL only when missing: ALTER TABLE locks the table even when it is a no-op
+        columns = dict(conn.execute(text("""
+            SELECT table_name || '.' || column_name, data_type FROM information_schema.columns
+            WHERE table_name IN ('posts', 'sentiment_cache') AND table_schema = current_schema()
+        """)).all())
+        for column in ("sentiment_version VARCHAR(200)", "sentiment_completed_at TIMESTAMP"):
+            if f"posts.{column.split()[0]}" not in columns:
+                conn.execute(text(f"ALTER TABLE posts ADD COLUMN IF NOT EXISTS {column}"))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS sentiment_cache (
+                text_hash CHAR(64) NOT NULL,
+                model_version VARCHAR(200) NOT NULL,
+                sentiment_label VARCHAR(20) NOT NULL,
+                sentiment_score DOUBLE PRECISION NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (text_hash, model_version)
+            )
+        """))
+        # Caches created before scores were typed store them as text
+        if columns.get("sentiment_cache.sentiment_score", "double precision") != "double precision":
+            conn.execute(text("""
+                ALTER TABLE sentiment_cache ALTER COLUMN sentiment_score TYPE DOUBLE PRECISION
+                USING sentiment_score::double precision
+            """))
+
+
+def get_cached_sentiments(text_hashes: list[str], model_version: str) -> dict[str, tuple[str, float]]:
+    """Look up cached results by text hash: {text_hash: (label, score)}"""
+    if not text_hashes:
+        return {}
+
+    engine = _get_engine()
+    with engine.begin() as conn:
+        rows = conn.execute(
+            text("""
+                SELECT text_hash, sentiment_label, sentiment_score
+                FROM sentiment_cache
+                WHERE model_version = :version AND text_hash = ANY(:hashes)
+            """),
+            {"version": model_version, "hashes": list(text_hashes)}
+        ).fetchall()
+
+    return {row[0]: (row[1], row[2]) for row in rows}
+
+
+def save_cached_sentiments(results: dict[str, tuple[str, float]], model_version: str) -> None:
+    """Store results in the cache: {text_hash: (label, score)}"""
+    if not results:
+        return
+
     engine = _get_engine()
     with engine.begin() as conn:
         conn.execute(
-            text("UPDATE posts SET sentiment_label = :label, sentiment_score = :score WHERE id = :id"),
-            {"label": sentiment_label, "score": sentiment_score, "id": post_id}
+            text("""
+                INSERT INTO sentiment_cache (text_hash, model_version, sentiment_label, sentiment_score)
+                VALUES (:hash, :version, :label, :score)
+                ON CONFLICT (text_hash, model_version) DO NOTHING
+            """),
+            [
+                {"hash": text_hash, "version": model_version, "label": label, "score": score}
+                for text_hash, (label, score) in results.items()
+            ]
         )
+
+
+def delete_cached_sentiments(keep_version: Optional[str] = None) -> int:
+    """Drop cached results, keeping only `keep_version` if given. Returns rows deleted"""
+    engine = _get_engine()
+    with engine.begin() as conn:
+        if keep_version is None:
+            result = conn.execute(text("DELETE FROM sentiment_cache"))
+        else:
+            result = conn.execute(
+                text("DELETE FROM sentiment_cache WHERE model_version <> :version"),
+                {"version": keep_version}
+            )
+    return result.rowcount
+
+
+def count_cached_sentiments() -> dict[str, int]:
+    """Number of cached results per model version"""
+    engine = _get_engine()
+    with engine.begin() as conn:
+        rows = conn.execute(text("""
+            SELECT model_version, COUNT(*)
+            FROM sentiment_cache
+            GROUP BY model_version
+        """)).fetchall()
+    return {row[0]: row[1] for row in rows}
@@ -0,0 +1,190 @@
+"""
+Lexicon/rule sentiment scorer used as a fast path in front of the model
+
+Scoring is vectorized over a batch: tokens are mapped to word weights in
+one numpy gather, negations ("not good") flip the sign of the next few
+tokens, intensifiers ("really good") boost the next token, and per-post
+sums come from a single bincount.
+
+Usage (agreement report against the model):
+    python -m app.lexicon
+    python -m app.lexicon --texts posts.txt --thresholds 0.6,0.7,0.8,0.9
+"""
+import argparse
+import json
+import re
+import time
+
+import numpy as np
+
+POSITIVE_WORDS = {
+    "good": 1.0, "great": 1.5, "nice": 1.0, "love": 1.5, "loved": 1.5, "loving": 1.0,
+    "like": 0.5, "liked": 0.5, "awesome": 1.5, "amazing": 1.5, "wonderful": 1.5,
+    "excellent": 1.5, "fantastic": 1.5, "perfect": 1.5, "best": 1.5, "happy": 1.0,
+    "glad": 1.0, "enjoy": 1.0, "enjoyed": 1.0, "beautiful": 1.5, "brilliant": 1.5,
+    "fun": 1.0, "cool": 0.5, "thanks": 1.0, "thank": 1.0, "proud": 1.0,
+    "recommend": 1.0, "incredible": 1.5, "delicious": 1.5, "lovely": 1.5,
+    "excited": 1.0, "exciting": 1.0, "win": 1.0, "won": 1.0, "yay": 1.5,
+    "favorite": 1.0, "fabulous": 1.5, "superb": 1.5, "pleased": 1.0, "cute": 1.0,
+}
+
+NEGATIVE_WORDS = {
+    "bad": 1.0, "terrible": 1.5, "awful": 1.5, "horrible": 1.5, "hate": 1.5,
+    "hated": 1.5, "worst": 1.5, "sad": 1.0, "angry": 1.0, "annoying": 1.0,
+    "annoyed": 1.0, "boring": 1.0, "poor": 1.0, "disappointed": 1.5,
+    "disappointing": 1.5, "broken": 1.0, "ugly": 1.0, "sucks": 1.5, "fail": 1.0,
+    "failed": 1.0, "wrong": 1.0, "tired": 0.5, "sick": 1.0, "slow": 0.5,
+    "cold": 0.5, "cancelled": 1.0, "lost": 1.0, "stupid": 1.5, "useless": 1.5,
+    "waste": 1.5, "disgusting": 1.5, "rude": 1.0, "pathetic": 1.5, "sorry": 0.5,
+    "worse": 1.5, "mess": 1.0, "painful": 1.0, "upset": 1.0, "ridiculous": 1.0,
+}
+
+NEGATORS = {
+    "not", "no", "never", "nothing", "nobody", "neither", "nor", "without",
+    "dont", "don't", "doesnt", "doesn't", "didnt", "didn't", "isnt", "isn't",
+    "wasnt", "wasn't", "cant", "can't", "cannot", "wont", "won't", "aint", "ain't",
+}
+
+INTENSIFIERS = {"very", "so", "really", "extremely", "super", "totally", "absolutely", "too"}
+
+# Contrast or questions make a post's overall polarity hard to call by words
+HEDGES = {"but", "however", "although", "though", "?"}
+
+# Negators affect the next NEGATION_WINDOW tokens
+NEGATION_WINDOW = 3
+
+# Smoothing for confidence: one strong word alone is not enough evidence
+CONFIDENCE_ALPHA = 0.5
+
+_TOKEN_RE = re.compile(r"[a-z']+|[?]")
+
+# Vocabulary id 0 is "unknown word"
+_VOCAB = {}
+for _word in (
+    list(POSITIVE_WORDS) + list(NEGATIVE_WORDS) + sorted(NEGATORS)
+    + sorted(INTENSIFIERS) + sorted(HEDGES)
+):
+    _VOCAB.setdefault(_word, len(_VOCAB) + 1)
+
+_WEIGHTS = np.zeros(len(_VOCAB) + 1)
+_IS_NEGATOR = np.zeros(len(_VOCAB) + 1, dtype=np.int64)
+_IS_INTENSIFIER = np.zeros(len(_VOCAB) + 1, dtype=bool)
+_IS_HEDGE = np.zeros(len(_VOCAB) + 1, dtype=bool)
+for _word, _weight in POSITIVE_WORDS.items():
+    _WEIGHTS[_VOCAB[_word]] = _weight
+for _word, _weight in NEGATIVE_WORDS.items():
+    _WEIGHTS[_VOCAB[_word]] = -_weight
+for _word in NEGATORS:
+    _IS_NEGATOR[_VOCAB[_word]] = 1
+for _word in INTENSIFIERS:
+    _IS_INTENSIFIER[_VOCAB[_word]] = True
+for _word in HEDGES:
+    _IS_HEDGE[_VOCAB[_word]] = True
+
+
+def score_texts(texts: list[str]) -> tuple[list[str], np.ndarray]:
+    """
+    Score a batch of texts with the lexicon
+
+    Returns:
+        tuple: (labels, confidences) where labels are "POSITIVE"/"NEGATIVE"
+        and confidences are in [0, 1) (0 means no evidence either way)
+    """
+    n = len(texts)
+    if n == 0:
+        return [], np.zeros(0)
+
+    token_ids = []
+    lengths = np.zeros(n, dtype=np.int64)
+    for i, text in enumerate(texts):
+        tokens = _TOKEN_RE.findall(text.lower())
+        lengths[i] = len(tokens)
+        token_ids.extend(_VOCAB.get(token, 0) for token in tokens)
+
+    ids = np.asarray(token_ids, dtype=np.int64)
+    post_index = np.repeat(np.arange(n), lengths)
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    positions = np.arange(len(ids))
+
+    # Number of negators among the previous NEGATION_WINDOW tokens of the same post
+    negator_cumsum = np.concatenate(([0], np.cumsum(_IS_NEGATOR[ids])))
+    window_start = np.maximum(positions - NEGATION_WINDOW, starts)
+    negations = negator_cumsum[positions] - negator_cumsum[window_start]
+
+    boost = np.ones(len(ids))
+    if len(ids) > 1:
+        after_intensifier = _IS_INTENSIFIER[ids[:-1]] & (post_index[1:] == post_index[:-1])
+        boost[1:][after_intensifier] = 1.5
+
+    weights = _WEIGHTS[ids] * boost * np.where(negations % 2 == 1, -1.0, 1.0)
+
+    positive = np.bincount(post_index, weights=np.maximum(weights, 0), minlength=n)
+    negative = np.bincount(post_index, weights=np.maximum(-weights, 0), minlength=n)
+    hedged = np.bincount(post_index, weights=_IS_HEDGE[ids], minlength=n) > 0
+
+    net = positive - negative
+    confidence = np.abs(net) / (positive + negative + CONFIDENCE_ALPHA)
+    confidence = np.where(hedged, confidence * 0.5, confidence)
+
+    labels = ["POSITIVE" if value > 0 else "NEGATIVE" for value in net]
+    return labels, confidence
+
+
+def report(texts: list[str], thresholds: list[float]) -> dict:
+    """
+    Compare the lexicon against the model on the same texts
+
+    For each threshold: the share of posts that would skip the model and how
+    often the lexicon label agrees with the model on those posts.
+    """
+    from app.analyzer import analyze_sentiment_batch
+
+    start = time.perf_counter()
+    labels, confidence = score_texts(texts)
+    lexicon_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    model_results = analyze_sentiment_batch(texts)
+    model_s = time.perf_counter() - start
+
+    agrees = np.array([label == result[0] for label, result in zip(labels, model_results)])
+
+    rows = []
+    for threshold in thresholds:
+        confident = confidence >= threshold
+        skipped = int(confident.sum())
+        rows.append({
+            "threshold": threshold,
+            "skip_share": skipped / len(texts),
+            "agreement_on_skipped": float(agrees[confident].mean()) if skipped else None,
+            # Agreement with model-only labelling over all posts when cascading
+            "cascade_agreement": 1.0 - int((confident & ~agrees).sum()) / len(texts),
+        })
+
+    return {
+        "samples": len(texts),
+        "lexicon_ms_per_post": 1000 * lexicon_s / len(texts),
+        "model_ms_per_post": 1000 * model_s / len(texts),
+        "thresholds": rows,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lexicon fast-path agreement report")
+    parser.add_argument("--texts", help="file with one text per line (default: built-in samples)")
+    parser.add_argument("--thresholds", default="0.5,0.6,0.7,0.8,0.9")
+    args = parser.parse_args()
+
+    if args.texts:
+        with open(args.texts, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+    else:
+        from app.parity import SAMPLE_TEXTS
+        texts = SAMPLE_TEXTS
+
+    thresholds = [float(t) for t in args.thresholds.split(",")]
+    print(json.dumps(report(texts, thresholds), indent=2))
+
+
+if __name__ == "__main__":
+    main()
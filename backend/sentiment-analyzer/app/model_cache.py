@@ -0,0 +1,19 @@
+"""
+Export the sentiment model for memory-mapped loading (see worker_runtime.model_cache)
+
+Usage (pre-convert, e.g. at image build time or into a shared volume):
+    python -m app.model_cache --export /models/sentiment
+"""
+from worker_runtime.model_cache import export_cli
+
+
+def main():
+    from transformers import AutoModelForSequenceClassification
+
+    from app.analyzer import MODEL_NAME
+
+    export_cli(AutoModelForSequenceClassification, MODEL_NAME, "sentiment", "Export the sentiment model for memory-mapped loading")
+
+
+if __name__ == "__main__":
+    main()
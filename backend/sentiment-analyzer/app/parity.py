@@ -0,0 +1,97 @@
+"""
+Accuracy-parity check between sentiment inference backends
+
+Usage:
+    python -m app.parity --backend quantized
+    python -m app.parity --backend onnx --texts posts.txt --min-agreement 0.98
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+
+from app.analyzer import BACKENDS, MAX_TEXT_CHARS, load_sentiment_pipeline
+
+SAMPLE_TEXTS = [
+    "This is absolutely wonderful and amazing!",
+    "This is terrible and awful, I hate it!",
+    "Just had the best coffee of my life this morning.",
+    "My flight got cancelled again, worst airline ever.",
+    "The new update is okay I guess, nothing special.",
+    "Can't believe how beautiful the sunset was tonight!",
+    "I'm so tired of waiting for this package to arrive.",
+    "Thanks everyone for the birthday wishes, you made my day!",
+    "The service was slow and the food was cold.",
+    "Not bad at all, would recommend to friends.",
+    "I don't think this movie was worth the hype.",
+    "Finally finished the marathon, proud of myself!",
+]
+
+
+def _run(pipeline_obj, texts: list[str]) -> tuple[list[dict], float]:
+    start = time.perf_counter()
+    results = [pipeline_obj(text)[0] for text in texts]
+    return results, time.perf_counter() - start
+
+
+def check_parity(backend: str, texts: list[str], baseline: str = "pytorch") -> dict:
+    """
+    Compare `backend` against `baseline` on the same texts
+
+    Returns a report with label agreement, score drift and per-post latency.
+    """
+    for name in (baseline, backend):
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown sentiment backend {name!r}")
+
+    texts = [text[:MAX_TEXT_CHARS] for text in texts]
+
+    base_results, base_time = _run(load_sentiment_pipeline(baseline), texts)
+    cand_results, cand_time = _run(load_sentiment_pipeline(backend), texts)
+
+    agree = sum(
+        1 for b, c in zip(base_results, cand_results) if b['label'] == c['label']
+    )
+    score_diffs = [
+        abs(b['score'] - c['score']) for b, c in zip(base_results, cand_results)
+    ]
+
+    return {
+        "baseline": baseline,
+        "backend": backend,
+        "samples": len(texts),
+        "label_agreement": agree / len(texts),
+        "max_score_diff": max(score_diffs),
+        "mean_score_diff": sum(score_diffs) / len(score_diffs),
+        "baseline_ms_per_post": 1000 * base_time / len(texts),
+        "backend_ms_per_post": 1000 * cand_time / len(texts),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sentiment backend parity check")
+    parser.add_argument("--backend", required=True, help="backend to check (quantized, onnx)")
+    parser.add_argument("--baseline", default="pytorch")
+    parser.add_argument("--texts", help="file with one text per line (default: built-in samples)")
+    parser.add_argument("--min-agreement", type=float, default=0.95)
+    args = parser.parse_args()
+
+    texts = SAMPLE_TEXTS
+    if args.texts:
+        with open(args.texts, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+
+    report = check_parity(args.backend, texts, baseline=args.baseline)
+    print(json.dumps(report, indent=2))
+
+    if report["label_agreement"] < args.min_agreement:
+        logging.error(
+            f"[sentiment] {args.backend} label agreement "
+            f"{report['label_agreement']:.3f} < {args.min_agreement}"
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# worker_runtime lives next to the service in the repo (the image copies it
+# into /app, which is on the path already)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
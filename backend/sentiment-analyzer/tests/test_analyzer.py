@@ -1,5 +1,6 @@
 import pytest
-from app.analyzer import analyze_sentiment
+from app import analyzer
+from app.analyzer import analyze_sentiment, analyze_sentiment_batch
 
 
 def test_positive_sentiment():
@@ -27,3 +28,54 @@ def test_truncate_long_text():
     
     assert label in ["POSITIVE", "NEGATIVE"]
     assert 0.0 <= float(score) <= 1.0
+
+
+def test_batch_matches_single():
+    """Test that batched inference agrees with per-post inference"""
+    texts = [
+        "This is absolutely wonderful and amazing!",
+        "This is terrible and awful, I hate it!",
+        "Great! " * 200,
+    ]
+    results = analyze_sentiment_batch(texts)
+
+    assert len(results) == len(texts)
+    for text, (label, score) in zip(texts, results):
+        single_label, single_score = analyze_sentiment(text)
+        assert label == single_label
+        assert abs(float(score) - float(single_score)) < 1e-3
+
+
+def test_batch_keeps_input_order(monkeypatch):
+    """Test that length-sorting for inference does not reorder results"""
+    seen = []
+
+    def fake_pipeline(texts, batch_size):
+        seen.extend(texts)
+        return [{'label': 'POSITIVE', 'score': len(t) / 1000} for t in texts]
+
+    monkeypatch.setattr(analyzer, "get_sentiment_pipeline", lambda: fake_pipeline)
+    results = analyze_sentiment_batch(["ccc", "a", "bb"])
+
+    assert seen == ["a", "bb", "ccc"]
+    assert [score for _, score in results] == [0.003, 0.001, 0.002]
+
+
+def test_batch_errors_propagate(monkeypatch):
+    """Test that a model error fails the batch instead of labelling it UNKNOWN"""
+    def fake_pipeline(texts, batch_size):
+        raise RuntimeError("out of memory")
+
+    monkeypatch.setattr(analyzer, "get_sentiment_pipeline", lambda: fake_pipeline)
+    with pytest.raises(RuntimeError):
+        analyze_sentiment_batch(["a", "b"])
+
+
+def test_single_errors_propagate(monkeypatch):
+    """Test that a model error raises for one text too"""
+    def fake_pipeline(text):
+        raise RuntimeError("out of memory")
+
+    monkeypatch.setattr(analyzer, "get_sentiment_pipeline", lambda: fake_pipeline)
+    with pytest.raises(RuntimeError):
+        analyze_sentiment("a")
@@ -0,0 +1,50 @@
+from app import backfill
+
+
+def _fake_db(monkeypatch, posts):
+    written = []
+
+    def iter_posts(version, only_missing, after_id, batch_size):
+        pending = [p for p in posts if p[0] > after_id]
+        for i in range(0, len(pending), batch_size):
+            yield pending[i:i + batch_size]
+
+    monkeypatch.setattr(backfill.db, "iter_posts_to_score", iter_posts)
+    monkeypatch.setattr(backfill.db, "update_sentiments",
+                        lambda results, version: written.extend(results))
+    monkeypatch.setattr(backfill, "analyze_with_cache",
+                        lambda texts: [("POSITIVE", 0.9)] * len(texts))
+    return written
+
+
+def test_backfill_scores_in_batches_and_checkpoints(monkeypatch, tmp_path):
+    """Test that every post is written and progress is recorded"""
+    posts = [(i, f"post {i}") for i in range(1, 8)]
+    written = _fake_db(monkeypatch, posts)
+    checkpoint = str(tmp_path / "backfill.json")
+
+    summary = backfill.run_backfill(batch_size=3, checkpoint=checkpoint)
+
+    assert summary["processed"] == 7
+    assert [post_id for post_id, _, _ in written] == list(range(1, 8))
+    assert backfill.load_checkpoint(checkpoint, backfill.MODEL_VERSION) == 7
+
+
+def test_backfill_resumes_from_checkpoint(monkeypatch, tmp_path):
+    """Test that an interrupted run continues after the last scored post"""
+    posts = [(i, f"post {i}") for i in range(1, 8)]
+    written = _fake_db(monkeypatch, posts)
+    checkpoint = str(tmp_path / "backfill.json")
+
+    backfill.run_backfill(batch_size=2, checkpoint=checkpoint, limit=4)
+    backfill.run_backfill(batch_size=2, checkpoint=checkpoint)
+
+    assert [post_id for post_id, _, _ in written] == list(range(1, 8))
+
+
+def test_checkpoint_ignored_for_other_model_version(tmp_path):
+    """Test that a new model version re-scores from the start"""
+    checkpoint = str(tmp_path / "backfill.json")
+    backfill.save_checkpoint(checkpoint, "old-model", 42, 42)
+
+    assert backfill.load_checkpoint(checkpoint, "new-model") == 0
@@ -0,0 +1,63 @@
+import pytest
+from app import cache
+
+
+@pytest.fixture
+def fresh_cache(monkeypatch):
+    """Empty LRU, in-memory stand-in for the sentiment_cache table"""
+    table = {}
+    calls = []
+
+    def fake_batch(texts):
+        calls.append(list(texts))
+        if any("good" not in t.lower() for t in texts):
+            raise RuntimeError("inference failed")
+        return [("POSITIVE", 0.9) for t in texts]
+
+    monkeypatch.setattr(cache, "_cache", cache.SentimentCache(100))
+    monkeypatch.setattr(cache, "analyze_texts", fake_batch)
+    monkeypatch.setattr(cache.db, "get_cached_sentiments",
+                        lambda hashes, version: {h: table[h] for h in hashes if h in table})
+    monkeypatch.setattr(cache.db, "save_cached_sentiments",
+                        lambda results, version: table.update(results))
+    return table, calls
+
+
+def test_duplicates_skip_inference(fresh_cache):
+    """Test that reposts and whitespace/case variants hit the cache"""
+    table, calls = fresh_cache
+
+    first = cache.analyze_with_cache(["Good morning!", "good   MORNING!"])
+    second = cache.analyze_with_cache(["Good morning!"])
+
+    assert first == second * 2
+    assert calls == [["Good morning!"]]
+    assert cache.get_cache().stats()["lru_hits"] == 1
+
+
+def test_persistent_tier_shared_across_workers(fresh_cache):
+    """Test that a result stored by one worker is reused from Postgres"""
+    table, calls = fresh_cache
+    cache.analyze_with_cache(["good news"])
+
+    cache.get_cache().clear()
+    cache.analyze_with_cache(["good news"])
+
+    assert len(calls) == 1
+    assert cache.get_cache().stats()["db_hits"] == 1
+
+
+def test_failures_are_not_cached(fresh_cache):
+    """Test that a failed inference raises and is retried on the next lookup"""
+    table, calls = fresh_cache
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            cache.analyze_with_cache(["meh"])
+
+    assert len(calls) == 2
+    assert table == {}
+
+
+def test_model_version_changes_key():
+    """Test that a new model version never sees old results"""
+    assert cache.text_hash("hello", "model@v1") != cache.text_hash("hello", "model@v2")
@@ -0,0 +1,166 @@
+import json
+from types import SimpleNamespace
+
+from worker_runtime import Trace
+from worker_runtime.metrics import WorkerMetrics
+
+from app import consumer
+from app.analyzer import time_pipeline_stages
+
+
+class FakeChannel:
+    def __init__(self):
+        self.is_open = True
+        self.acked = []
+        self.nacked = []
+        self.published = []
+
+    def basic_ack(self, delivery_tag):
+        self.acked.append(delivery_tag)
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.published.append((routing_key, properties.headers))
+
+    def basic_nack(self, delivery_tag, requeue):
+        self.nacked.append(delivery_tag)
+
+
+def _message(tag, post_id, headers=None):
+    body = json.dumps({"post_id": post_id}).encode("utf-8")
+    return SimpleNamespace(delivery_tag=tag), SimpleNamespace(headers=headers), body
+
+
+def test_handle_batch_writes_in_bulk_then_acks(monkeypatch):
+    """Test that a batch is analyzed in one call and every message is acked"""
+    written = []
+    monkeypatch.setattr(consumer, "get_posts_to_score", lambda ids, version: ({1: "good", 2: "bad"}, set()))
+    monkeypatch.setattr(
+        consumer, "analyze_with_cache",
+        lambda texts: [("POSITIVE", 0.9) if t == "good" else ("NEGATIVE", 0.8) for t in texts]
+    )
+    monkeypatch.setattr(consumer, "update_sentiments",
+                        lambda results, version: written.extend(results) or len(results))
+
+    ch = FakeChannel()
+    consumer.handle_batch(ch, [_message(10, 1), _message(11, 2), _message(12, 3)])
+
+    assert written == [(1, "POSITIVE", 0.9), (2, "NEGATIVE", 0.8)]
+    assert sorted(ch.acked) == [10, 11, 12]
+    assert ch.nacked == []
+
+
+def test_handle_batch_retries_on_write_failure(monkeypatch):
+    """Test that messages go to a delay queue when the bulk write fails"""
+    def fail(results, version):
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(consumer, "get_posts_to_score", lambda ids, version: ({1: "good", 2: "bad"}, set()))
+    monkeypatch.setattr(consumer, "analyze_with_cache", lambda texts: [("POSITIVE", 0.9)] * len(texts))
+    monkeypatch.setattr(consumer, "update_sentiments", fail)
+
+    ch = FakeChannel()
+    consumer.handle_batch(ch, [_message(10, 1), _message(11, 2, {"x-attempt": 4})])
+
+    # The first failure is delayed; the message out of attempts is dead-lettered
+    assert ch.published == [
+        ("sentiment_analysis.retry.1", {"x-attempt": 1}),
+        ("sentiment_analysis.dlq", ch.published[1][1]),
+    ]
+    assert ch.published[1][1]["x-attempt"] == 5
+    assert ch.published[1][1]["x-error"] == "db down"
+    assert sorted(ch.acked) == [10, 11]
+    assert ch.nacked == []
+
+
+def test_handle_batch_skips_scored_posts_and_duplicates(monkeypatch):
+    """Test that only new work reaches the model"""
+    analyzed = []
+    monkeypatch.setattr(consumer, "work_stats", {"scored": 0, "skipped": 0, "duplicates": 0})
+    monkeypatch.setattr(consumer, "get_posts_to_score", lambda ids, version: ({1: "good", 3: "bad"}, {2}))
+    monkeypatch.setattr(consumer, "analyze_with_cache",
+                        lambda texts: analyzed.extend(texts) or [("POSITIVE", 0.9)] * len(texts))
+    # Post 3 was written by a concurrent copy of its message in the meantime
+    monkeypatch.setattr(consumer, "update_sentiments", lambda results, version: 1)
+
+    ch = FakeChannel()
+    consumer.handle_batch(ch, [_message(10, 1), _message(11, 2), _message(12, 1), _message(13, 3)])
+
+    assert analyzed == ["good", "bad"]
+    assert sorted(ch.acked) == [10, 11, 12, 13]
+    assert consumer.work_stats == {"scored": 1, "skipped": 1, "duplicates": 2}
+
+
+def test_invalid_message_is_dead_lettered():
+    """Test that an unparseable message is parked instead of retried"""
+    ch = FakeChannel()
+    consumer.handle_batch(ch, [(SimpleNamespace(delivery_tag=5), SimpleNamespace(headers=None), b"not json")])
+
+    assert [queue for queue, _ in ch.published] == ["sentiment_analysis.dlq"]
+    assert ch.acked == [5]
+
+
+def test_torch_threads_split_between_workers(monkeypatch):
+    """Test that forked workers share the cores instead of each taking all"""
+    monkeypatch.setattr(consumer, "TORCH_THREADS", 0)
+    assert consumer._torch_threads_per_worker(4, 8) == 2
+    assert consumer._torch_threads_per_worker(8, 4) == 1
+
+    monkeypatch.setattr(consumer, "TORCH_THREADS", 3)
+    assert consumer._torch_threads_per_worker(4, 8) == 3
+
+
+def test_handle_message_times_every_stage(monkeypatch):
+    """Test that decode, fetch, compute, write and ack are timed, with the text size"""
+    metrics = WorkerMetrics(log_every_s=0)
+    monkeypatch.setattr(consumer, "Trace", lambda service: Trace(service, metrics=metrics))
+    monkeypatch.setattr(consumer, "get_posts_to_score", lambda ids, version: ({1: "good"}, set()))
+    monkeypatch.setattr(consumer, "analyze_with_cache", lambda texts: [("POSITIVE", 0.9)])
+    monkeypatch.setattr(consumer, "update_sentiment", lambda *args: 0)
+
+    ch = FakeChannel()
+    method, properties, body = _message(10, 1)
+    consumer.handle_message(ch, method, properties, body)
+
+    assert ch.acked == [10]
+    assert set(metrics.snapshot()) == {"decode", "fetch", "compute", "write", "ack"}
+    assert metrics.sizes_snapshot()["text"]["total_bytes"] == 4
+
+
+def test_pipeline_steps_are_timed():
+    """Test that tokenization, inference and postprocessing each feed a stage"""
+    class FakePipeline:
+        def preprocess(self, text):
+            return text
+
+        def _forward(self, inputs):
+            return inputs
+
+        def postprocess(self, outputs):
+            return outputs
+
+    metrics = WorkerMetrics(log_every_s=0)
+    pipe = time_pipeline_stages(FakePipeline(), metrics)
+    pipe.postprocess(pipe._forward(pipe.preprocess("good")))
+
+    assert {stage: s["count"] for stage, s in metrics.snapshot().items()} == {
+        "tokenize": 1, "infer": 1, "postprocess": 1
+    }
+
+
+def test_work_stats_are_thread_safe(monkeypatch):
+    """Test that counts from concurrent handler threads are not lost"""
+    import threading
+
+    monkeypatch.setattr(consumer, "work_stats", {"scored": 0, "skipped": 0, "duplicates": 0})
+
+    def count():
+        for _ in range(10000):
+            consumer._count(scored=1, skipped=1)
+
+    threads = [threading.Thread(target=count) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert consumer.work_stats == {"scored": 40000, "skipped": 40000, "duplicates": 0}
@@ -0,0 +1,40 @@
+from app import analyzer
+from app.lexicon import score_texts
+
+
+def test_clear_posts_are_confident():
+    """Test that obviously positive/negative posts score high"""
+    labels, confidence = score_texts([
+        "I love this, amazing!",
+        "This is terrible and awful, I hate it!",
+    ])
+
+    assert labels == ["POSITIVE", "NEGATIVE"]
+    assert (confidence >= 0.8).all()
+
+
+def test_negation_and_hedges():
+    """Test that negations flip polarity and contrast lowers confidence"""
+    labels, confidence = score_texts(["not good", "good but slow", "nothing here"])
+
+    assert labels[0] == "NEGATIVE"
+    assert confidence[1] < 0.5
+    assert confidence[2] == 0.0
+
+
+def test_cascade_sends_only_uncertain_posts_to_model(monkeypatch):
+    """Test that confident posts skip the model and results keep input order"""
+    sent_to_model = []
+
+    def fake_batch(texts):
+        sent_to_model.extend(texts)
+        return [("NEGATIVE", 0.6)] * len(texts)
+
+    monkeypatch.setattr(analyzer, "analyze_sentiment_batch", fake_batch)
+    results = analyzer.analyze_sentiment_cascade(
+        ["I love this, amazing!", "The update is okay I guess"], threshold=0.8
+    )
+
+    assert sent_to_model == ["The update is okay I guess"]
+    assert results[0][0] == "POSITIVE"
+    assert results[1] == ("NEGATIVE", 0.6)
@@ -0,0 +1,56 @@
+from pathlib import Path
+
+import torch
+from transformers import AutoModelForSequenceClassification, DistilBertConfig
+
+from worker_runtime.model_cache import StartupTimer, export_dir, export_model, is_cached, load_cached_model
+
+
+def test_export_roundtrip_is_memory_mapped(tmp_path):
+    """Test that an exported model loads with identical outputs and shared-file weights"""
+    config = DistilBertConfig(vocab_size=100, dim=32, hidden_dim=64, n_layers=1, n_heads=2)
+    model = AutoModelForSequenceClassification.from_config(config).eval()
+    path = str(tmp_path / "export")
+
+    export_model(model, None, path)
+    assert is_cached(path)
+
+    timer = StartupTimer()
+    loaded = load_cached_model(AutoModelForSequenceClassification, path, timer)
+
+    input_ids = torch.tensor([[1, 5, 7, 2]])
+    with torch.no_grad():
+        assert torch.allclose(model(input_ids).logits, loaded(input_ids).logits)
+
+    # Every parameter is a view into the one mapped weights file
+    storages = {param.untyped_storage().data_ptr() for param in loaded.parameters()}
+    assert len(storages) == 1
+    assert {"config", "build", "weights"} <= set(timer.phases)
+
+
+def test_export_dir_replaces_partial_exports_only(tmp_path):
+    """Test that a failed export leaves nothing and an interrupted one is replaced"""
+    path = tmp_path / "onnx"
+
+    try:
+        with export_dir(str(path), "model.onnx") as tmp:
+            (Path(tmp) / "config.json").write_text("{}")
+            raise RuntimeError("export failed")
+    except RuntimeError:
+        pass
+    assert not path.exists() and list(tmp_path.iterdir()) == []
+
+    # Left by an export that died halfway
+    path.mkdir()
+    (path / "config.json").write_text("{}")
+    with export_dir(str(path), "model.onnx") as tmp:
+        (Path(tmp) / "config.json").write_text("{}")
+        (Path(tmp) / "model.onnx").write_bytes(b"onnx")
+    assert is_cached(str(path), "model.onnx")
+
+    # A complete export that won the race is kept
+    with export_dir(str(path), "model.onnx") as tmp:
+        (Path(tmp) / "config.json").write_text("{}")
+        (Path(tmp) / "model.onnx").write_bytes(b"other")
+    assert (path / "model.onnx").read_bytes() == b"onnx"
+    assert [p.name for p in tmp_path.iterdir()] == ["onnx"]
@@ -0,0 +1,25 @@
+import pytest
+from app.parity import SAMPLE_TEXTS, check_parity
+
+
+def test_quantized_backend_parity():
+    """Test that int8 quantization keeps labels in line with full precision"""
+    report = check_parity("quantized", SAMPLE_TEXTS)
+
+    assert report["label_agreement"] >= 0.9
+    assert report["max_score_diff"] < 0.2
+
+
+def test_onnx_backend_parity():
+    """Test that the ONNX Runtime backend matches full precision"""
+    pytest.importorskip("optimum.onnxruntime")
+    report = check_parity("onnx", SAMPLE_TEXTS)
+
+    assert report["label_agreement"] == 1.0
+    assert report["max_score_diff"] < 1e-3
+
+
+def test_unknown_backend_rejected():
+    """Test that a misconfigured backend fails loudly"""
+    with pytest.raises(ValueError):
+        check_parity("tensorrt", SAMPLE_TEXTS[:1])
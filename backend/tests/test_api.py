@@ -5,10 +5,12 @@ import unittest
 import json
 import os
 import base64
+from datetime import datetime
 from sqlalchemy import create_engine, text
 
 from app import create_app
 from app.database import Base
+from text_generator.app.generator import MAX_NEW_TOKENS
 
 
 # ✅ dùng 1 database test duy nhất
@@ -34,6 +36,8 @@ class TestRestAPI(unittest.TestCase):
         # 🔹 reset DB trước mỗi test
         with self.engine.connect() as conn:
             conn.execute(text("TRUNCATE TABLE posts RESTART IDENTITY CASCADE;"))
+            conn.execute(text("TRUNCATE TABLE sentiment_rollup;"))
+            conn.execute(text("TRUNCATE TABLE enrichment_traces;"))
             conn.commit()
 
         # 🔹 tạo app test (RabbitMQ bị tắt vì TESTING=True)
@@ -117,6 +121,21 @@ class TestRestAPI(unittest.TestCase):
         )
         self.assertEqual(resp.status_code, 400)
 
+    def test_create_post_priority(self):
+        resp = self.client.post(
+            "/api/posts",
+            data=json.dumps({"user": "john", "text": "imported", "priority": "bulk"}),
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, 201)
+
+        resp = self.client.post(
+            "/api/posts",
+            data=json.dumps({"user": "john", "text": "hello", "priority": "urgent"}),
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, 400)
+
     def test_get_post_by_id_not_found(self):
         resp = self.client.get("/api/posts/99999")
         self.assertEqual(resp.status_code, 404)
@@ -175,6 +194,297 @@ class TestRestAPI(unittest.TestCase):
 
         self.assertEqual(data["count"], 0)
 
+    def test_sentiment_analytics(self):
+        from app.database import SocialMediaDB
+        db = SocialMediaDB(TEST_DATABASE_URL)
+        p1 = self.create_post("alice", "Love it")
+        p2 = self.create_post("alice", "Great day")
+        p3 = self.create_post("bob", "Awful")
+        db.update_post_sentiment(p1, "POSITIVE", 0.9)
+        db.update_post_sentiment(p2, "POSITIVE", 0.7)
+        db.update_post_sentiment(p3, "NEGATIVE", 0.8)
+        # Re-scoring replaces the earlier result in the rollup
+        db.update_post_sentiment(p3, "NEGATIVE", 0.6)
+
+        resp = self.client.get("/api/analytics/sentiment?bucket=day")
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 200)
+        by_label = {row["label"]: row for row in data["buckets"]}
+        self.assertEqual(by_label["POSITIVE"]["count"], 2)
+        self.assertAlmostEqual(by_label["POSITIVE"]["mean_score"], 0.8)
+        self.assertEqual(by_label["NEGATIVE"]["count"], 1)
+        self.assertAlmostEqual(by_label["NEGATIVE"]["mean_score"], 0.6)
+        self.assertEqual(data["users"][0], {
+            "user": "alice", "label": "POSITIVE", "count": 2, "mean_score": 0.8
+        })
+
+        resp = self.client.get("/api/analytics/sentiment?user=bob")
+        data = json.loads(resp.data)
+        self.assertEqual([row["user"] for row in data["users"]], ["bob"])
+
+        db.update_post_sentiment(p2, "NEGATIVE", 0.7)
+        # The limit counts users, not (user, label) rows
+        resp = self.client.get("/api/analytics/sentiment?user_limit=1")
+        data = json.loads(resp.data)
+        self.assertEqual([(row["user"], row["label"]) for row in data["users"]],
+                         [("alice", "POSITIVE"), ("alice", "NEGATIVE")])
+
+        # Both bounds are rounded down to the hour: within one hour, nothing
+        now = datetime.utcnow().isoformat()
+        resp = self.client.get(f"/api/analytics/sentiment?since={now}&until={now}")
+        data = json.loads(resp.data)
+        self.assertEqual((data["buckets"], data["users"]), ([], []))
+
+    def test_schema_upgrade_leaves_current_schema_alone(self):
+        from app import database
+
+        def trigger_oid():
+            with self.engine.connect() as conn:
+                return conn.execute(text(
+                    "SELECT oid FROM pg_trigger WHERE tgname = 'posts_sentiment_rollup'"
+                )).scalar()
+
+        before = trigger_oid()
+        self.assertIsNotNone(before)
+        database._upgraded_urls.clear()
+        database._upgrade_schema(self.engine)
+        # Not dropped and recreated on every start
+        self.assertEqual(trigger_oid(), before)
+
+    def test_trace_table_init_does_not_lock_posts(self):
+        import threading
+        from worker_runtime import init_trace_table
+
+        worker = threading.Thread(target=init_trace_table, args=("thumb_completed_at",))
+        with self.engine.connect() as conn:
+            # Conflicts with the ACCESS EXCLUSIVE lock an ALTER TABLE would take
+            conn.execute(text("LOCK TABLE posts IN ACCESS SHARE MODE"))
+            worker.start()
+            worker.join(timeout=5)
+            blocked = worker.is_alive()
+            conn.rollback()
+        worker.join()
+        self.assertFalse(blocked)
+
+    def test_sentiment_analytics_invalid_params(self):
+        resp = self.client.get("/api/analytics/sentiment?bucket=minute")
+        self.assertEqual(resp.status_code, 400)
+
+        resp = self.client.get("/api/analytics/sentiment?since=yesterday")
+        self.assertEqual(resp.status_code, 400)
+
+        for user_limit in (0, -1, 501):
+            resp = self.client.get(f"/api/analytics/sentiment?user_limit={user_limit}")
+            self.assertEqual(resp.status_code, 400)
+
+    def test_enrichment_latency(self):
+        with self.engine.begin() as conn:
+            for service, total_ms in (("resizer", 40.0), ("resizer", 400.0), ("sentiment", 3.0)):
+                conn.execute(text("""
+                    INSERT INTO enrichment_traces (service, post_id, completed_at, fetch_ms, total_ms)
+                    VALUES (:service, 1, now(), 2.0, :total)
+                """), {"service": service, "total": total_ms})
+
+        resp = self.client.get("/api/analytics/enrichment-latency?service=resizer")
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([(row["service"], row["stage"]) for row in data["stages"]],
+                         [("resizer", "fetch"), ("resizer", "total")])
+        total = data["stages"][1]
+        self.assertEqual(total["count"], 2)
+        self.assertAlmostEqual(total["max_ms"], 400.0)
+        counts = {bucket["upper_ms"]: bucket["count"] for bucket in total["histogram"]}
+        self.assertEqual(counts[50], 1)
+        self.assertEqual(counts[500], 1)
+        self.assertEqual(sum(counts.values()), 2)
+
+        resp = self.client.get("/api/analytics/enrichment-latency?since=yesterday")
+        self.assertEqual(resp.status_code, 400)
+
+    def test_generate_text_invalid_seed(self):
+        resp = self.client.post(
+            "/api/posts/generate",
+            data=json.dumps({"prompt": "Hello", "seed": "abc"}),
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, 400)
+
+        resp = self.client.post(
+            "/api/posts/generate",
+            data=json.dumps({"prompt": "Hello", "max_new_tokens": 0}),
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, 400)
+
+        # Above the worker's limit: rejected rather than silently cut
+        resp = self.client.post(
+            "/api/posts/generate",
+            data=json.dumps({"prompt": "Hello", "max_new_tokens": MAX_NEW_TOKENS + 1}),
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, 400)
+
+    def test_stream_generated_text_invalid_params(self):
+        resp = self.client.get("/api/posts/generate/not-a-job/stream")
+        self.assertEqual(resp.status_code, 400)
+
+        resp = self.client.get(f"/api/posts/generate/{'a' * 32}/stream?timeout=0")
+        self.assertEqual(resp.status_code, 400)
+
+    def test_stream_finished_generation(self):
+        from text_generator.app.db import init_text_suggestions_table, save_generated_text
+
+        init_text_suggestions_table()
+        job_id = "b" * 32
+        with self.engine.connect() as conn:
+            conn.execute(text("DELETE FROM text_suggestions WHERE job_id = :j"), {"j": job_id})
+            conn.commit()
+        save_generated_text("Hello world", job_id)
+
+        resp = self.client.get(f"/api/posts/generate/{job_id}/stream?timeout=1")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, "text/event-stream")
+
+        event = json.loads(resp.get_data(as_text=True).split("data: ", 1)[1])
+        self.assertTrue(event["done"])
+        self.assertEqual(event["generated_text"], "Hello world")
+
+    def test_stream_limit(self):
+        from text_generator.app import db as textgen_db
+
+        listener = textgen_db.ChunkListener(max_streams=0)
+        original = textgen_db._listener
+        textgen_db._listener = listener
+        try:
+            resp = self.client.get(f"/api/posts/generate/{'c' * 32}/stream?timeout=1")
+        finally:
+            textgen_db._listener = original
+        self.assertEqual(resp.status_code, 503)
+
+    def test_streams_share_one_listen_connection(self):
+        from text_generator.app.db import (
+            ChunkListener, StreamLimitReached, listen_generation_chunks, notify_generation_chunk
+        )
+        from worker_runtime import get_engine
+
+        listener = ChunkListener(max_streams=2, poll_s=0.05)
+        job_id = "d" * 32
+        pool = get_engine().pool
+        streams = [listen_generation_chunks(job_id, timeout=5, heartbeat=1, listener=listener) for _ in range(2)]
+        try:
+            # Open streams hold no pooled connection
+            self.assertEqual(pool.checkedout(), 0)
+            with self.assertRaises(StreamLimitReached):
+                listen_generation_chunks(job_id, timeout=5, listener=listener)
+
+            iterators = [iter(stream) for stream in streams]
+            notify_generation_chunk(job_id, 1, "Hello", True, "Hello")
+            for chunks in iterators:
+                self.assertEqual(next(chunks)["generated_text"], "Hello")
+        finally:
+            for stream in streams:
+                stream.close()
+        self.assertEqual(listener.streams, 0)
+
+    def test_metrics(self):
+        from app.metrics import registry
+        before = registry.value("api_request_duration_seconds", "GET", "/api/posts/<int:post_id>", "404")
+        self.client.get("/api/posts/99999")
+        self.client.get("/api/posts/99998")
+
+        count, _ = registry.value("api_request_duration_seconds", "GET", "/api/posts/<int:post_id>", "404")
+        self.assertEqual(count - (before[0] if before else 0), 2)
+
+        resp = self.client.get("/api/metrics")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+        body = resp.get_data(as_text=True)
+        self.assertIn("# TYPE api_request_duration_seconds histogram", body)
+        self.assertIn('api_request_db_queries_bucket{route="/api/posts/<int:post_id>",le="+Inf"}', body)
+        self.assertIn("api_requests_in_flight 1", body)  # the scrape itself
+
+    def test_metrics_only_time_the_app_engine(self):
+        from sqlalchemy.exc import ProgrammingError
+        from app.metrics import instrument_engine, registry
+
+        self.client.get("/api/posts/99999")  # creates the app's engine
+        before = registry.value("api_db_queries_total")
+        with self.engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        self.assertEqual(registry.value("api_db_queries_total"), before)
+
+        # A failed statement does not leave its start time behind
+        engine = create_engine(TEST_DATABASE_URL)
+        instrument_engine(engine)
+        with engine.connect() as conn:
+            with self.assertRaises(ProgrammingError):
+                conn.execute(text("SELECT * FROM no_such_table"))
+            self.assertEqual(conn.info.get("query_start"), [])
+        engine.dispose()
+
+    def test_request_profiling(self):
+        import tempfile
+        from app.profiling import sign
+
+        # Off by default: no profiler, no admin endpoints
+        self.assertEqual(self.client.get("/api/admin/profiles").status_code, 404)
+
+        with tempfile.TemporaryDirectory() as profile_dir:
+            app = create_app({
+                "TESTING": True,
+                "DATABASE": TEST_DATABASE_URL,
+                "PROFILE_SECRET": "s3cret",
+                "PROFILE_ADMIN_TOKEN": "adm1n",
+                "PROFILE_DIR": profile_dir,
+            })
+            client = app.test_client()
+            admin = {"X-Admin-Token": "adm1n"}
+
+            self.assertNotIn("X-Profile-Id", client.get("/api/posts").headers)
+            resp = client.get("/api/posts", headers={"X-Profile": "1.forged"})
+            self.assertNotIn("X-Profile-Id", resp.headers)
+
+            resp = client.get("/api/posts", headers={"X-Profile": sign("s3cret")})
+            profile_id = resp.headers["X-Profile-Id"]
+
+            self.assertEqual(client.get("/api/admin/profiles").status_code, 403)
+            # The signing secret is not an admin token
+            resp = client.get("/api/admin/profiles", headers={"X-Admin-Token": "s3cret"})
+            self.assertEqual(resp.status_code, 403)
+            listing = json.loads(client.get("/api/admin/profiles", headers=admin).data)
+            self.assertEqual([p["id"] for p in listing["profiles"]], [profile_id])
+
+            profile = json.loads(client.get(f"/api/admin/profiles/{profile_id}", headers=admin).data)
+            self.assertEqual(profile["route"], "/api/posts")
+            self.assertEqual(profile["trigger"], "header")
+            self.assertTrue(any("FROM posts" in q["statement"] for q in profile["sql"]))
+            self.assertTrue(profile["top"])
+
+            resp = client.get(f"/api/admin/profiles/{profile_id}/pstats", headers=admin)
+            self.assertEqual(resp.status_code, 200)
+            self.assertGreater(len(resp.data), 0)
+            resp.close()
+
+            resp = client.put("/api/admin/profiling", json={"sample_rate": 1}, headers=admin)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("X-Profile-Id", client.get("/api/posts/latest").headers)
+            resp = client.put("/api/admin/profiling", json={"sample_rate": 2}, headers=admin)
+            self.assertEqual(resp.status_code, 400)
+
+        # A profile that cannot be stored leaves the response alone
+        with tempfile.NamedTemporaryFile() as not_a_dir:
+            app = create_app({
+                "TESTING": True,
+                "DATABASE": TEST_DATABASE_URL,
+                "PROFILE_SECRET": "s3cret",
+                "PROFILE_DIR": not_a_dir.name,
+            })
+            resp = app.test_client().get("/api/posts", headers={"X-Profile": sign("s3cret")})
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotIn("X-Profile-Id", resp.headers)
+
     def test_invalid_endpoint(self):
         resp = self.client.get("/api/invalid")
         self.assertEqual(resp.status_code, 404)
@@ -0,0 +1,136 @@
+"""
+Benchmark of assisted (speculative) decoding against plain decoding
+
+Runs greedy decoding over a set of prompts once with the main model alone
+and once per lookahead value with a draft model assisting it, and reports
+tokens per second, the speedup and whether the outputs are token-for-token
+identical (they should be for greedy decoding).
+
+Usage:
+    python -m app.assisted_bench
+    python -m app.assisted_bench --draft distilgpt2 --lookahead 3,5,8 --max-new-tokens 64
+    python -m app.assisted_bench --prompts prompts.txt --schedule constant
+"""
+import argparse
+import json
+import time
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from app.generator import (
+    ASSISTANT_SCHEDULE,
+    DRAFT_MODEL_NAME,
+    MAX_PROMPT_CHARS,
+    MODEL_NAME,
+    load_draft_model,
+)
+
+SAMPLE_PROMPTS = [
+    "Once upon a time",
+    "The best thing about working from home is",
+    "Today I finally tried the new coffee place downtown and",
+    "Breaking news: scientists have discovered",
+    "My top three tips for learning to code are",
+    "The weather this weekend looks",
+    "I can't believe the game last night ended with",
+    "Here is a short story about a robot who",
+]
+
+
+def _run(model, tokenizer, prompts: list[str], max_new_tokens: int, assistant_model=None,
+         num_tokens: int = None) -> tuple[list[list[int]], float, int]:
+    """Greedy-decode each prompt; returns (new token ids, seconds, new tokens)"""
+    outputs = []
+    seconds = 0.0
+    new_tokens = 0
+    for prompt in prompts:
+        if assistant_model is not None:
+            # The heuristic schedule adapts the lookahead in place; start
+            # every prompt from the configured value
+            assistant_model.generation_config.num_assistant_tokens = num_tokens
+
+        inputs = tokenizer(prompt[:MAX_PROMPT_CHARS], return_tensors="pt")
+        start = time.perf_counter()
+        with torch.no_grad():
+            output = model.generate(
+                **inputs,
+                assistant_model=assistant_model,
+                max_new_tokens=max_new_tokens,
+                do_sample=False,
+                pad_token_id=tokenizer.eos_token_id,
+            )
+        seconds += time.perf_counter() - start
+
+        generated = output[0, inputs["input_ids"].shape[1]:].tolist()
+        new_tokens += len(generated)
+        outputs.append(generated)
+    return outputs, seconds, new_tokens
+
+
+def benchmark(model_name: str, draft_name: str, prompts: list[str], lookaheads: list[int],
+              max_new_tokens: int = 64, schedule: str = ASSISTANT_SCHEDULE) -> dict:
+    """Compare plain and assisted greedy decoding on the same prompts"""
+    torch.manual_seed(0)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForCausalLM.from_pretrained(model_name)
+    model.eval()
+
+    # Warm-up so one-time allocation cost is not counted
+    _run(model, tokenizer, prompts[:1], 4)
+    baseline, seconds, tokens = _run(model, tokenizer, prompts, max_new_tokens)
+    baseline_tps = tokens / seconds
+
+    rows = []
+    for lookahead in lookaheads:
+        draft = load_draft_model(draft_name, model, lookahead, schedule)
+        outputs, seconds, tokens = _run(model, tokenizer, prompts, max_new_tokens, draft, lookahead)
+        identical = sum(output == expected for output, expected in zip(outputs, baseline))
+        rows.append({
+            "lookahead": lookahead,
+            "tokens_per_second": tokens / seconds,
+            "speedup": (tokens / seconds) / baseline_tps,
+            "identical_outputs": identical,
+            "equivalent": identical == len(prompts),
+        })
+
+    return {
+        "model": model_name,
+        "draft": draft_name,
+        "schedule": schedule,
+        "prompts": len(prompts),
+        "max_new_tokens": max_new_tokens,
+        "baseline_tokens_per_second": baseline_tps,
+        "assisted": rows,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Assisted decoding throughput and equivalence benchmark")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--draft", default=DRAFT_MODEL_NAME or "distilgpt2")
+    parser.add_argument("--lookahead", default="3,5,8", help="comma-separated draft tokens per step")
+    parser.add_argument("--schedule", default=ASSISTANT_SCHEDULE, choices=["heuristic", "constant"])
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--prompts", help="file with one prompt per line (default: built-in samples)")
+    args = parser.parse_args()
+
+    if args.prompts:
+        with open(args.prompts, encoding="utf-8") as f:
+            prompts = [line.strip() for line in f if line.strip()]
+    else:
+        prompts = SAMPLE_PROMPTS
+
+    result = benchmark(
+        args.model,
+        args.draft,
+        prompts,
+        [int(n) for n in args.lookahead.split(",")],
+        max_new_tokens=args.max_new_tokens,
+        schedule=args.schedule,
+    )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Prompt-level cache for deterministic text generation
+
+Only used when decoding is reproducible (greedy, or sampling with a pinned
+seed); sampled output without a seed is never cached. Two tiers:
+- an in-process LRU
+- the `generation_cache` Postgres table (next to `text_suggestions`)
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app import db
+from app.generator import DRAFT_MODEL_NAME, MAX_PROMPT_CHARS, MODEL_NAME, TextCallback, generate_text
+
+CACHE_ENABLED = os.getenv("TEXTGEN_CACHE", "1") == "1"
+CACHE_SIZE = int(os.getenv("TEXTGEN_CACHE_SIZE", "1000"))
+
+# Log hit-rate stats every N lookups
+STATS_LOG_EVERY = int(os.getenv("TEXTGEN_CACHE_STATS_EVERY", "100"))
+
+
+def is_deterministic(do_sample: bool, seed: Optional[int]) -> bool:
+    """Whether the same prompt and parameters always give the same text"""
+    return not do_sample or seed is not None
+
+
+def cache_key(prompt: str, **params) -> str:
+    """Hash of the normalized prompt plus the models and every generation parameter"""
+    # GPT-2 is case-sensitive, so only whitespace is normalized
+    normalized = " ".join(prompt[:MAX_PROMPT_CHARS].split())
+    # Sampled text with a pinned seed depends on the draft model too
+    payload = json.dumps(
+        {"model": MODEL_NAME, "draft": DRAFT_MODEL_NAME, "prompt": normalized, **params},
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    """Thread-safe LRU of {cache_key: generated_text} with hit counters"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.lru_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.lru_hits += 1
+                return self._items[key]
+        return None
+
+    def put(self, key: str, value: str) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def record(self, db_hits: int = 0, misses: int = 0) -> None:
+        with self._lock:
+            self.db_hits += db_hits
+            self.misses += misses
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict:
+        lookups = self.lru_hits + self.db_hits + self.misses
+        return {
+            "lookups": lookups,
+            "lru_hits": self.lru_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": (self.lru_hits + self.db_hits) / lookups if lookups else 0.0,
+            "lru_size": len(self._items),
+        }
+
+
+_cache = GenerationCache(CACHE_SIZE)
+
+
+def get_cache() -> GenerationCache:
+    return _cache
+
+
+def generate_cached(prompt: str, max_length: int = 50, do_sample: bool = True,
+                    seed: Optional[int] = None, on_text: Optional[TextCallback] = None,
+                    max_new_tokens: Optional[int] = None, max_time: Optional[float] = None) -> str:
+    """
+    generate_text with the cache in front of it for deterministic requests
+
+    Failures of the persistent tier are logged and treated as misses. On a
+    hit, `on_text` gets the whole cached text as its final chunk. Text cut
+    short by `max_time` is returned but not cached.
+    """
+    params = dict(max_length=max_length, do_sample=do_sample, seed=seed, max_new_tokens=max_new_tokens)
+    if not CACHE_ENABLED or not is_deterministic(do_sample, seed):
+        return generate_text(prompt, on_text=on_text, max_time=max_time, **params)
+
+    key = cache_key(prompt, **params)
+
+    generated = _cache.get(key)
+    if generated is None:
+        try:
+            generated = db.get_cached_generation(key)
+        except Exception as e:
+            logging.warning(f"[text-gen] Cache lookup failed: {e}")
+        if generated is not None:
+            _cache.record(db_hits=1)
+            _cache.put(key, generated)
+
+    if generated is None:
+        _cache.record(misses=1)
+        start = time.monotonic()
+        generated = generate_text(prompt, on_text=on_text, max_time=max_time, **params)
+        timed_out = max_time is not None and time.monotonic() - start >= max_time
+        if not timed_out:
+            _cache.put(key, generated)
+            try:
+                db.save_cached_generation(key, generated)
+            except Exception as e:
+                logging.warning(f"[text-gen] Cache store failed: {e}")
+
+    elif on_text is not None:
+        on_text(generated, True)
+
+    stats = _cache.stats()
+    if STATS_LOG_EVERY and stats["lookups"] % STATS_LOG_EVERY == 0:
+        logging.info(f"[text-gen] Cache stats: {stats}")
+
+    return generated
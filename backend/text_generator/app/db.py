@@ -1,14 +1,14 @@
+import json
+import logging
 import os
-from typing import Optional
-from sqlalchemy import create_engine, text
+import queue
+import select
+import threading
+import time
+from typing import Iterator, Optional
+from sqlalchemy import text
 
-_engine = None
-
-def get_engine():
-    global _engine
-    if _engine is None:
-        _engine = create_engine(os.environ["DATABASE_URL"])
-    return _engine
+from worker_runtime import get_engine
 
 
 def init_text_suggestions_table():
@@ -21,17 +21,77 @@ def init_text_suggestions_table():
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """))
+        conn.execute(text(
+            "ALTER TABLE text_suggestions ADD COLUMN IF NOT EXISTS job_id VARCHAR(32)"
+        ))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_text_suggestions_job_id ON text_suggestions (job_id)"
+        ))
+
+
+def init_generation_cache_table():
+    engine = get_engine()
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS generation_cache (
+                cache_key CHAR(64) PRIMARY KEY,
+                generated_text TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """))
+
+
+def get_cached_generation(cache_key: str) -> Optional[str]:
+    engine = get_engine()
+    with engine.begin() as conn:
+        row = conn.execute(
+            text("SELECT generated_text FROM generation_cache WHERE cache_key = :key"),
+            {"key": cache_key}
+        ).fetchone()
+    return row[0] if row else None
+
+
+def save_cached_generation(cache_key: str, generated_text: str) -> None:
+    engine = get_engine()
+    with engine.begin() as conn:
+        conn.execute(
+            text("""
+                INSERT INTO generation_cache (cache_key, generated_text)
+                VALUES (:key, :text)
+                ON CONFLICT (cache_key) DO NOTHING
+            """),
+            {"key": cache_key, "text": generated_text}
+        )
+
+
+def save_generated_text(generated_text: str, job_id: Optional[str] = None) -> None:
+    engine = get_engine()
+    with engine.begin() as conn:
+        conn.execute(
+            text("""
+                INSERT INTO text_suggestions (generated_text, job_id)
+                VALUES (:text, :job_id)
+            """),
+            {"text": generated_text, "job_id": job_id}
+        )
 
 
-def save_generated_text(generated_text: str) -> None:
+def save_generated_texts(generated_texts: list[str], job_ids: Optional[list[Optional[str]]] = None) -> None:
+    """Insert several generated texts in one transaction"""
+    if not generated_texts:
+        return
+    job_ids = job_ids or [None] * len(generated_texts)
     engine = get_engine()
     with engine.begin() as conn:
         conn.execute(
             text("""
-                INSERT INTO text_suggestions (generated_text)
-                VALUES (:text)
+                INSERT INTO text_suggestions (generated_text, job_id)
+                VALUES (:text, :job_id)
             """),
-            {"text": generated_text}
+            [
+                {"text": generated, "job_id": job_id}
+                for generated, job_id in zip(generated_texts, job_ids)
+            ]
         )
 
 
@@ -45,4 +105,215 @@ def get_latest_generated_text() -> Optional[str]:
             LIMIT 1
         """)).fetchone()
 
-    return row[0] if row else None
\ No newline at end of file
+    return row[0] if row else None
+
+
+def get_generated_text_by_job_id(job_id: str) -> Optional[str]:
+    engine = get_engine()
+    with engine.begin() as conn:
+        row = conn.execute(
+            text("SELECT generated_text FROM text_suggestions WHERE job_id = :job_id LIMIT 1"),
+            {"job_id": job_id}
+        ).fetchone()
+    return row[0] if row else None
+
+
+# --------------------------------------------------
+# Token streaming (Postgres LISTEN/NOTIFY, one channel per job)
+# --------------------------------------------------
+def stream_channel(job_id: str) -> str:
+    """Notification channel of a generation job (job ids are uuid4 hex)"""
+    return f"textgen_{job_id}"
+
+
+def notify_generation_chunk(job_id: str, seq: int, chunk: str, done: bool,
+                            full_text: Optional[str] = None) -> None:
+    """Publish a chunk of generated text to listeners of the job"""
+    payload = {"job_id": job_id, "seq": seq, "text": chunk, "done": done}
+    if full_text is not None:
+        payload["generated_text"] = full_text
+
+    engine = get_engine()
+    with engine.begin() as conn:
+        conn.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": stream_channel(job_id), "payload": json.dumps(payload)}
+        )
+
+
+# Open token streams per process; each is a queue on the shared listener
+MAX_STREAMS = int(os.getenv("TEXTGEN_MAX_STREAMS", "100"))
+
+
+class StreamLimitReached(RuntimeError):
+    """MAX_STREAMS streams are already open in this process"""
+
+
+class ChunkListener:
+    """
+    One LISTEN connection per process, fanning notifications out to streams
+
+    The connection is opened directly rather than taken from the
+    worker_runtime pool, so open streams never hold pooled connections.
+    A background thread polls it and hands each notification to the queues
+    subscribed to its channel; if the connection drops it is reopened and
+    every channel listened to again.
+    """
+
+    def __init__(self, max_streams: int = MAX_STREAMS, poll_s: float = 1.0):
+        self.max_streams = max_streams
+        self.poll_s = poll_s
+        self._subscribers: dict[str, set] = {}  # channel -> queues
+        self._streams = 0
+        self._conn = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def streams(self) -> int:
+        return self._streams
+
+    def _connect(self):
+        engine = get_engine()
+        cargs, cparams = engine.dialect.create_connect_args(engine.url)
+        conn = engine.dialect.connect(*cargs, **cparams)
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            for channel in self._subscribers:
+                cursor.execute(f"LISTEN {channel}")
+        return conn
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def _execute(self, statement: str) -> None:
+        """Run on the listening connection; a broken one is left to the poller"""
+        if self._conn is None:
+            return
+        try:
+            with self._conn.cursor() as cursor:
+                cursor.execute(statement)
+        except Exception as e:
+            logging.warning(f"[text-gen] Stream listener: {statement} failed: {e}")
+
+    def subscribe(self, channel: str) -> queue.Queue:
+        """Queue receiving the decoded payloads notified on `channel`"""
+        with self._lock:
+            if self._streams >= self.max_streams:
+                raise StreamLimitReached(f"{self.max_streams} streams already open")
+            if self._thread is None:
+                self._conn = self._connect()
+                self._thread = threading.Thread(target=self._run, name="textgen-listener", daemon=True)
+                self._thread.start()
+            if channel not in self._subscribers:
+                self._subscribers[channel] = set()
+                self._execute(f"LISTEN {channel}")
+            chunks = queue.Queue()
+            self._subscribers[channel].add(chunks)
+            self._streams += 1
+        return chunks
+
+    def unsubscribe(self, channel: str, chunks: queue.Queue) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(channel)
+            if subscribers is None or chunks not in subscribers:
+                return
+            subscribers.discard(chunks)
+            self._streams -= 1
+            if not subscribers:
+                del self._subscribers[channel]
+                self._execute(f"UNLISTEN {channel}")
+
+    def _run(self) -> None:
+        while True:
+            try:
+                with self._lock:
+                    if self._conn is None:
+                        self._conn = self._connect()
+                    conn = self._conn
+                select.select([conn], [], [], self.poll_s)
+                with self._lock:
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        for chunks in self._subscribers.get(notify.channel, ()):
+                            chunks.put(json.loads(notify.payload))
+            except Exception as e:
+                logging.warning(f"[text-gen] Stream listener connection lost, reconnecting: {e}")
+                with self._lock:
+                    self._close()
+                time.sleep(self.poll_s)
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def get_chunk_listener() -> ChunkListener:
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            _listener = ChunkListener()
+    return _listener
+
+
+class GenerationStream:
+    """
+    Chunks published for a job, from subscription until it is done
+
+    Subscribes on creation (raising StreamLimitReached when the process is
+    at MAX_STREAMS); close() releases the slot and is safe to call twice.
+    """
+
+    def __init__(self, job_id: str, timeout: float, heartbeat: float, listener: ChunkListener):
+        self.job_id = job_id
+        self.timeout = timeout
+        self.heartbeat = heartbeat
+        self.listener = listener
+        self.channel = stream_channel(job_id)
+        self.chunks = listener.subscribe(self.channel)
+
+    def __iter__(self) -> Iterator[Optional[dict]]:
+        try:
+            # Subscribed first, so a job finishing now cannot slip through
+            finished = get_generated_text_by_job_id(self.job_id)
+            if finished is not None:
+                yield {"job_id": self.job_id, "seq": 0, "text": "", "done": True, "generated_text": finished}
+                return
+
+            deadline = time.monotonic() + self.timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    chunk = self.chunks.get(timeout=min(self.heartbeat, remaining))
+                except queue.Empty:
+                    yield None
+                    continue
+                yield chunk
+                if chunk.get("done"):
+                    return
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self.listener.unsubscribe(self.channel, self.chunks)
+
+
+def listen_generation_chunks(job_id: str, timeout: float = 120.0, heartbeat: float = 15.0,
+                             listener: Optional[ChunkListener] = None) -> GenerationStream:
+    """
+    Subscribe to the chunks published for a job
+
+    Iterating yields them until the job is done or `timeout` passes, and
+    None every `heartbeat` seconds without news, so callers can keep idle
+    connections alive. If the job already finished before listening
+    started, only its final chunk is yielded.
+    """
+    return GenerationStream(job_id, timeout, heartbeat, listener or get_chunk_listener())
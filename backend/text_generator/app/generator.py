@@ -1,38 +1,318 @@
-from transformers import pipeline
+from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline, set_seed
+from transformers.generation.streamers import BaseStreamer
+from contextlib import contextmanager
+from typing import Callable, Optional
 import logging
+import os
+import threading
+import time
+
+from worker_runtime.model_cache import (
+    export_model,
+    is_cached,
+    load_cached_model,
+    load_cached_tokenizer,
+    startup_timer,
+)
+
+MODEL_NAME = "gpt2"  # smallest version
+
+# Local safetensors export of MODEL_NAME, loaded memory-mapped so replicas
+# share its pages (see worker_runtime.model_cache); written on first start if missing
+MODEL_CACHE_DIR = os.getenv("TEXTGEN_MODEL_DIR", "")
+
+# Assisted (speculative) decoding: a smaller draft model with the same
+# tokenizer proposes tokens that MODEL_NAME verifies in one forward pass.
+# Off unless a draft model is set, e.g. TEXTGEN_DRAFT_MODEL=distilgpt2
+DRAFT_MODEL_NAME = os.getenv("TEXTGEN_DRAFT_MODEL", "")
+# Tokens the draft proposes per verification step
+ASSISTANT_TOKENS = int(os.getenv("TEXTGEN_ASSISTANT_TOKENS", "5"))
+# "heuristic" adapts the lookahead to how many proposals get accepted,
+# "constant" always proposes ASSISTANT_TOKENS
+ASSISTANT_SCHEDULE = os.getenv("TEXTGEN_ASSISTANT_SCHEDULE", "heuristic")
+# Fall back to plain decoding when the draft model can't be loaded;
+# with 0 the worker fails instead
+ASSISTED_FALLBACK = os.getenv("TEXTGEN_ASSISTED_FALLBACK", "1") == "1"
 
 # Global variable to cache the model
 _generator_pipeline = None
+_draft_model = None
+_draft_loaded = False
+
+# Prompts are truncated before generation (for safety)
+MAX_PROMPT_CHARS = 200
+
+# Tokens generated per job (prompt not included); a job may ask for fewer.
+# The API validates requests against the same limit.
+MAX_NEW_TOKENS = int(os.getenv("TEXTGEN_MAX_NEW_TOKENS", "60"))
+
+# Rough GPT-2 BPE ratio for English, used to estimate cost without tokenizing
+CHARS_PER_TOKEN = 4
+
+# set_seed() seeds torch's process-wide RNG (generate() takes no per-call
+# generator), so seeded generations run one at a time; otherwise one could
+# reseed the RNG in the middle of another. Unseeded calls don't wait.
+_seed_lock = threading.Lock()
+
+
+@contextmanager
+def _seeded(do_sample: bool, seed: Optional[int]):
+    """Seed the RNG and hold it for a seeded sampled generation"""
+    if not do_sample or seed is None:
+        yield
+        return
+    with _seed_lock:
+        set_seed(seed)
+        yield
+
+
+# Receives (text_chunk, done) as tokens are generated
+TextCallback = Callable[[str, bool], None]
+
+
+class BatchTextStreamer(BaseStreamer):
+    """
+    Streams each sequence's newly generated text to its own callback
+
+    Works for any batch size. Text is released up to the last space so a
+    word is never split across chunks; the rest is flushed at the end.
+    """
+
+    def __init__(self, tokenizer, callbacks: list[Optional[TextCallback]]):
+        self.tokenizer = tokenizer
+        self.callbacks = callbacks
+        self.tokens = [[] for _ in callbacks]
+        self.printed = [0] * len(callbacks)
+        self.prompt_seen = False
+
+    def _decode(self, i: int) -> str:
+        return self.tokenizer.decode(self.tokens[i], skip_special_tokens=True)
+
+    def put(self, value):
+        # The first call carries the (padded) prompts
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+
+        rows = value.reshape(len(self.callbacks), -1).tolist()
+        for i, new_tokens in enumerate(rows):
+            callback = self.callbacks[i]
+            if callback is None:
+                continue
+            self.tokens[i].extend(new_tokens)
+            text = self._decode(i)
+            end = len(text) if text.endswith("\n") else text.rfind(" ") + 1
+            if end > self.printed[i]:
+                callback(text[self.printed[i]:end], False)
+                self.printed[i] = end
+
+    def end(self):
+        for i, callback in enumerate(self.callbacks):
+            if callback is not None:
+                callback(self._decode(i)[self.printed[i]:], True)
+
+
+def _load_model_and_tokenizer():
+    """MODEL_NAME from the local export when there is one, else from the hub"""
+    if MODEL_CACHE_DIR and not is_cached(MODEL_CACHE_DIR):
+        try:
+            with startup_timer.phase("export"):
+                logging.info(f"[text-gen] Exporting {MODEL_NAME} to {MODEL_CACHE_DIR}...")
+                export_model(
+                    AutoModelForCausalLM.from_pretrained(MODEL_NAME),
+                    AutoTokenizer.from_pretrained(MODEL_NAME),
+                    MODEL_CACHE_DIR
+                )
+        except Exception as e:
+            logging.warning(f"[text-gen] Could not export model to {MODEL_CACHE_DIR}: {e}")
+
+    if MODEL_CACHE_DIR and is_cached(MODEL_CACHE_DIR):
+        return load_cached_model(AutoModelForCausalLM, MODEL_CACHE_DIR), \
+            load_cached_tokenizer(MODEL_CACHE_DIR)
+
+    with startup_timer.phase("weights"):
+        model = AutoModelForCausalLM.from_pretrained(MODEL_NAME)
+        model.eval()
+    with startup_timer.phase("tokenizer"):
+        tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    return model, tokenizer
+
 
 def get_generator_pipeline():
     """Get or create text generation pipeline (with caching)"""
     global _generator_pipeline
     if _generator_pipeline is None:
         logging.info("[text-gen] Loading GPT-2 model...")
-        _generator_pipeline = pipeline(
-            "text-generation",
-            model="gpt2",  # smallest version
-            device=-1      # Use CPU
-        )
-        logging.info("[text-gen] Model loaded successfully")
+        model, tokenizer = _load_model_and_tokenizer()
+        # Set once here, not per request: the tokenizer is shared by every
+        # handler thread. GPT-2 has no pad token; padding on the left keeps
+        # the last real token of every batched prompt adjacent to the first
+        # generated one.
+        tokenizer.padding_side = "left"
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        with startup_timer.phase("pipeline"):
+            _generator_pipeline = pipeline(
+                "text-generation",
+                model=model,
+                tokenizer=tokenizer,
+                device=-1      # Use CPU
+            )
+        logging.info(f"[text-gen] Model loaded successfully ({startup_timer.summary()})")
     return _generator_pipeline
 
-def generate_text(prompt: str, max_length: int = 50) -> str:
-    try:
-        pipeline_obj = get_generator_pipeline()
-        # Optional: truncate prompt if too long (for safety)
-        max_prompt_chars = 200
-        if len(prompt) > max_prompt_chars:
-            prompt = prompt[:max_prompt_chars]
-        result = pipeline_obj(prompt, max_length=max_length, num_return_sequences=1)
-        logging.info(f"[text-gen] Generation result: {result}")
-        generated_full = result[0]['generated_text']
-        if generated_full.startswith(prompt):
-            generated = generated_full[len(prompt):].strip()
-        else:
-            generated = generated_full
-        return generated
-    except Exception as e:
-        import traceback
-        logging.error(f"[text-gen] Error generating text: {e}\n{traceback.format_exc()}")
-        return "[generation failed]"
\ No newline at end of file
+def estimate_tokens(prompt: str) -> int:
+    """Approximate token count of a (truncated) prompt"""
+    return len(prompt[:MAX_PROMPT_CHARS]) // CHARS_PER_TOKEN + 1
+
+
+def _length_kwargs(max_length: int, max_new_tokens: Optional[int],
+                   max_time: Optional[float]) -> dict:
+    """generate() length limits: explicit new-token budget and wall-clock deadline"""
+    # max_length counts the prompt too; max_new_tokens takes precedence
+    kwargs = {"max_new_tokens": max_new_tokens} if max_new_tokens else {"max_length": max_length}
+    if max_time is not None:
+        # Adds a MaxTimeCriteria: decoding stops and returns what it has so far
+        kwargs["max_time"] = max_time
+    return kwargs
+
+
+def _log_deadline(start: float, max_time: Optional[float], n: int = 1) -> None:
+    if max_time is not None and time.monotonic() - start >= max_time:
+        logging.warning(f"[text-gen] Deadline of {max_time:.1f}s reached, returning partial text for {n} prompt(s)")
+
+
+def load_draft_model(name: str, main_model, num_tokens: int = ASSISTANT_TOKENS,
+                     schedule: str = ASSISTANT_SCHEDULE):
+    """Load a draft model for assisted decoding and check it fits `main_model`"""
+    draft = AutoModelForCausalLM.from_pretrained(name)
+    draft.eval()
+
+    # Proposals are token ids, so both models must share the vocabulary
+    if draft.config.vocab_size != main_model.config.vocab_size:
+        raise ValueError(
+            f"Draft model {name} has vocab size {draft.config.vocab_size}, "
+            f"expected {main_model.config.vocab_size}"
+        )
+
+    draft.generation_config.num_assistant_tokens = num_tokens
+    draft.generation_config.num_assistant_tokens_schedule = schedule
+    return draft
+
+
+def get_draft_model():
+    """Get the cached draft model, or None when assisted decoding is off"""
+    global _draft_model, _draft_loaded
+    if not _draft_loaded:
+        if DRAFT_MODEL_NAME:
+            try:
+                logging.info(f"[text-gen] Loading draft model {DRAFT_MODEL_NAME}...")
+                _draft_model = load_draft_model(DRAFT_MODEL_NAME, get_generator_pipeline().model)
+                logging.info(
+                    f"[text-gen] Assisted decoding on (draft={DRAFT_MODEL_NAME}, "
+                    f"lookahead={ASSISTANT_TOKENS}, schedule={ASSISTANT_SCHEDULE})"
+                )
+            except Exception as e:
+                if not ASSISTED_FALLBACK:
+                    raise
+                logging.warning(f"[text-gen] Draft model unavailable, using plain decoding: {e}")
+        _draft_loaded = True
+    return _draft_model
+
+
+def generate_text(prompt: str, max_length: int = 50, do_sample: bool = True,
+                  seed: Optional[int] = None, on_text: Optional[TextCallback] = None,
+                  max_new_tokens: Optional[int] = None, max_time: Optional[float] = None) -> str:
+    """
+    Generate a continuation of `prompt`
+
+    Output is reproducible when `do_sample` is False (greedy decoding) or a
+    `seed` is pinned; seeded calls run one at a time so their seeds
+    don't interfere. `on_text` receives the continuation chunk by chunk
+    while it is being generated. Uses assisted decoding when a draft model
+    is configured; greedy output is the same as without it.
+
+    `max_new_tokens` bounds the continuation regardless of prompt length
+    (otherwise `max_length` bounds prompt plus continuation); decoding
+    stops after `max_time` seconds and the partial text is returned.
+    Model errors propagate, so the caller can retry the job.
+    """
+    pipeline_obj = get_generator_pipeline()
+    # Optional: truncate prompt if too long (for safety)
+    if len(prompt) > MAX_PROMPT_CHARS:
+        prompt = prompt[:MAX_PROMPT_CHARS]
+    extra = {}
+    if on_text is not None:
+        extra["streamer"] = BatchTextStreamer(pipeline_obj.tokenizer, [on_text])
+    draft = get_draft_model()
+    if draft is not None:
+        extra["assistant_model"] = draft
+    start = time.monotonic()
+    with _seeded(do_sample, seed):
+        result = pipeline_obj(
+            prompt,
+            num_return_sequences=1,
+            do_sample=do_sample,
+            **_length_kwargs(max_length, max_new_tokens, max_time),
+            **extra
+        )
+    _log_deadline(start, max_time)
+    logging.info(f"[text-gen] Generation result: {result}")
+    generated_full = result[0]['generated_text']
+    if generated_full.startswith(prompt):
+        generated = generated_full[len(prompt):].strip()
+    else:
+        generated = generated_full
+    return generated
+
+
+def generate_texts(prompts: list[str], max_length: int = 50, do_sample: bool = True,
+                   on_texts: Optional[list[Optional[TextCallback]]] = None,
+                   max_new_tokens: Optional[int] = None, max_time: Optional[float] = None) -> list[str]:
+    """
+    Generate continuations for several prompts with one batched `generate` call
+
+    Prompts are left-padded so every sequence ends at the same position and
+    the whole batch decodes in lockstep over a single batched KV-cache.
+    Returns only the generated continuation of each prompt, in input order;
+    `on_texts` optionally streams each prompt's continuation as it grows.
+    Assisted decoding only supports one sequence, so it is used for
+    single-prompt batches only. `max_new_tokens` and `max_time` work as in
+    generate_text, for the whole batch.
+    """
+    if not prompts:
+        return []
+
+    pipeline_obj = get_generator_pipeline()
+    model = pipeline_obj.model
+    tokenizer = pipeline_obj.tokenizer  # left-padded, see get_generator_pipeline
+
+    prompts = [prompt[:MAX_PROMPT_CHARS] for prompt in prompts]
+    inputs = tokenizer(prompts, return_tensors="pt", padding=True)
+    prompt_len = inputs["input_ids"].shape[1]
+
+    streamer = None
+    if on_texts and any(callback is not None for callback in on_texts):
+        streamer = BatchTextStreamer(tokenizer, on_texts)
+
+    extra = {}
+    draft = get_draft_model()
+    if draft is not None and len(prompts) == 1:
+        extra["assistant_model"] = draft
+
+    start = time.monotonic()
+    outputs = model.generate(
+        **inputs,
+        **extra,
+        **_length_kwargs(max_length, max_new_tokens or max(1, max_length - prompt_len), max_time),
+        streamer=streamer,
+        do_sample=do_sample,
+        pad_token_id=tokenizer.pad_token_id,
+        num_return_sequences=1,
+    )
+    _log_deadline(start, max_time, len(prompts))
+
+    return [
+        tokenizer.decode(output[prompt_len:], skip_special_tokens=True).strip()
+        for output in outputs
+    ]
@@ -0,0 +1,19 @@
+"""
+Export the generation model for memory-mapped loading (see worker_runtime.model_cache)
+
+Usage (pre-convert, e.g. at image build time or into a shared volume):
+    python -m app.model_cache --export /models/gpt2
+"""
+from worker_runtime.model_cache import export_cli
+
+
+def main():
+    from transformers import AutoModelForCausalLM
+
+    from app.generator import MODEL_NAME
+
+    export_cli(AutoModelForCausalLM, MODEL_NAME, "text-gen", "Export the generation model for memory-mapped loading")
+
+
+if __name__ == "__main__":
+    main()
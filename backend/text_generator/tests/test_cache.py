@@ -0,0 +1,61 @@
+import pytest
+from app import cache
+
+
+@pytest.fixture
+def fresh_cache(monkeypatch):
+    """Empty LRU, in-memory stand-in for the generation_cache table"""
+    table = {}
+    calls = []
+
+    def fake_generate(prompt, **params):
+        calls.append(prompt)
+        return f"{prompt} ... and then"
+
+    monkeypatch.setattr(cache, "_cache", cache.GenerationCache(10))
+    monkeypatch.setattr(cache, "generate_text", fake_generate)
+    monkeypatch.setattr(cache.db, "get_cached_generation", table.get)
+    monkeypatch.setattr(cache.db, "save_cached_generation", table.__setitem__)
+    return table, calls
+
+
+def test_greedy_prompts_are_cached(fresh_cache):
+    """Test that repeated greedy prompts skip the model"""
+    table, calls = fresh_cache
+
+    first = cache.generate_cached("Once upon  a time", max_length=50, do_sample=False)
+    second = cache.generate_cached("Once upon a time", max_length=50, do_sample=False)
+
+    assert first == second
+    assert calls == ["Once upon  a time"]
+    assert len(table) == 1
+
+
+def test_parameters_are_part_of_the_key(fresh_cache):
+    """Test that different lengths or seeds are cached separately"""
+    table, calls = fresh_cache
+
+    cache.generate_cached("Hello", max_length=50, do_sample=True, seed=1)
+    cache.generate_cached("Hello", max_length=50, do_sample=True, seed=2)
+    cache.generate_cached("Hello", max_length=80, do_sample=True, seed=1)
+
+    assert len(calls) == 3
+
+
+def test_unseeded_sampling_is_never_cached(fresh_cache):
+    """Test that random output is not replayed"""
+    table, calls = fresh_cache
+
+    cache.generate_cached("Hello", do_sample=True)
+    cache.generate_cached("Hello", do_sample=True)
+
+    assert len(calls) == 2
+    assert table == {}
+
+
+def test_draft_model_is_part_of_the_key(monkeypatch):
+    """Test that switching the draft model does not replay the old text"""
+    plain = cache.cache_key("Hello", max_length=50, do_sample=True, seed=1)
+    monkeypatch.setattr(cache, "DRAFT_MODEL_NAME", "distilgpt2")
+
+    assert cache.cache_key("Hello", max_length=50, do_sample=True, seed=1) != plain
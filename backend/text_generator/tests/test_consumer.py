@@ -0,0 +1,161 @@
+import json
+from types import SimpleNamespace
+
+from app import consumer
+
+
+class FakeChannel:
+    def __init__(self):
+        self.is_open = True
+        self.acked = []
+        self.nacked = []
+        self.published = []
+
+    def basic_ack(self, delivery_tag):
+        self.acked.append(delivery_tag)
+
+    def basic_nack(self, delivery_tag, requeue):
+        self.nacked.append(delivery_tag)
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.published.append(routing_key)
+
+
+def _message(tag, prompt, **extra):
+    body = json.dumps({"prompt": prompt, **extra}).encode("utf-8")
+    return SimpleNamespace(delivery_tag=tag), SimpleNamespace(headers=None), body
+
+
+def test_handle_batch_generates_once_and_saves_each(monkeypatch):
+    """Test that prompts are decoded together and every result is stored"""
+    calls = []
+    saved = []
+    monkeypatch.setattr(consumer, "generate_texts",
+                        lambda prompts, **params: calls.append(prompts) or [p.upper() for p in prompts])
+    monkeypatch.setattr(consumer, "save_generated_texts", lambda texts, job_ids: saved.extend(texts))
+
+    ch = FakeChannel()
+    consumer.handle_batch(ch, [_message(1, "hi"), _message(2, ""), _message(3, "yo")])
+
+    assert calls == [["hi", "yo"]]
+    assert saved == ["HI", "YO"]
+    assert sorted(ch.acked) == [1, 2, 3]
+    # The empty prompt can never succeed
+    assert ch.published == ["text_generation.dlq"]
+    assert consumer.batch_stats["max_batch"] >= 2
+
+
+def test_handle_batch_routes_deterministic_jobs_through_cache(monkeypatch):
+    """Test that seeded/greedy prompts are not mixed into the sampled batch"""
+    batched = []
+    cached = []
+    monkeypatch.setattr(consumer, "generate_texts",
+                        lambda prompts, **params: batched.extend(prompts) or ["s"] * len(prompts))
+    monkeypatch.setattr(consumer, "generate_cached",
+                        lambda prompt, **params: cached.append(prompt) or "c")
+    saved = []
+    monkeypatch.setattr(consumer, "save_generated_texts", lambda texts, job_ids: saved.extend(texts))
+
+    seeded = _message(2, "b", seed=7)
+    ch = FakeChannel()
+    consumer.handle_batch(ch, [_message(1, "a"), seeded, _message(3, "c")])
+
+    assert batched == ["a", "c"]
+    assert cached == ["b"]
+    assert sorted(saved) == ["c", "s", "s"]
+
+
+def test_handle_batch_streams_jobs_with_job_id(monkeypatch):
+    """Test that chunks are published for streamed jobs and end with the stored text"""
+    def fake_generate(prompts, on_texts, **params):
+        for on_text in on_texts:
+            if on_text:
+                on_text("Hello ", False)
+                on_text("world", True)
+        return ["Hello world"] * len(prompts)
+
+    events = []
+    monkeypatch.setattr(consumer, "generate_texts", fake_generate)
+    monkeypatch.setattr(consumer, "save_generated_texts", lambda texts, job_ids: events.append(job_ids))
+    monkeypatch.setattr(consumer, "notify_generation_chunk",
+                        lambda *args: events.append(args))
+
+    streamed = _message(1, "a", job_id="j1")
+    ch = FakeChannel()
+    consumer.handle_batch(ch, [streamed, _message(2, "b")])
+
+    assert events == [
+        ("j1", 1, "Hello ", False, None),
+        ["j1", None],
+        ("j1", 2, "world", True, "Hello world"),
+    ]
+    assert sorted(ch.acked) == [1, 2]
+
+
+def test_handle_batch_runs_shortest_jobs_first(monkeypatch):
+    """Test that cheap prompts are generated and acked before expensive ones"""
+    order = []
+    budgets = []
+
+    def fake_cached(prompt, max_new_tokens, max_time, **params):
+        order.append(prompt)
+        budgets.append(max_time)
+        return prompt
+
+    monkeypatch.setattr(consumer, "generate_cached", fake_cached)
+    monkeypatch.setattr(consumer, "save_generated_texts", lambda texts, job_ids: None)
+
+    def greedy(tag, prompt, **extra):
+        return _message(tag, prompt, do_sample=False, **extra)
+
+    ch = FakeChannel()
+    consumer.handle_batch(ch, [
+        greedy(1, "a long prompt " * 10),
+        greedy(2, "short"),
+        greedy(3, "short", max_new_tokens=5),
+    ])
+
+    assert order == ["short", "short", ("a long prompt " * 10).strip()]
+    assert ch.acked == [3, 2, 1]
+    # Jobs scheduled last still get the whole budget
+    assert budgets == [consumer.JOB_TIMEOUT_S] * 3
+
+
+def test_parse_job_caps_token_budget():
+    """Test that a job can lower but not raise the token budget"""
+    assert consumer._parse_job(b'{"prompt": "a", "max_new_tokens": 5}').max_new_tokens == 5
+    assert consumer._parse_job(b'{"prompt": "a", "max_new_tokens": 100000}').max_new_tokens == consumer.MAX_NEW_TOKENS
+
+
+def test_failed_generation_is_retried_with_backoff(monkeypatch):
+    """Test that a failing unit goes to the first delay queue instead of being dropped"""
+    def fail(prompts, **params):
+        raise RuntimeError("out of memory")
+
+    monkeypatch.setattr(consumer, "generate_texts", fail)
+
+    ch = FakeChannel()
+    consumer.handle_batch(ch, [_message(1, "a")])
+
+    assert ch.published == ["text_generation.retry.1"]
+    assert ch.acked == [1]
+    assert ch.nacked == []
+
+
+def test_batch_stats_are_thread_safe(monkeypatch):
+    """Test that batches counted from concurrent handler threads are not lost"""
+    import threading
+
+    monkeypatch.setattr(consumer, "batch_stats", {"batches": 0, "prompts": 0, "max_batch": 0})
+
+    def count():
+        for _ in range(10000):
+            consumer._count_batch(2)
+
+    threads = [threading.Thread(target=count) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert consumer.batch_stats == {"batches": 40000, "prompts": 80000, "max_batch": 2}
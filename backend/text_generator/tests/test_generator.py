@@ -1,5 +1,8 @@
 import pytest
-from app.generator import generate_text
+from types import SimpleNamespace
+
+from app import generator
+from app.generator import generate_text, generate_texts
 
 
 def test_text_generation():
@@ -27,3 +30,89 @@ def test_long_prompt():
     
     # Should still generate something
     assert len(generated) > 0
+
+
+def test_batch_generation():
+    """Test that a batch of prompts gets one continuation each"""
+    prompts = ["Once upon a time", "Hello", "This is a very long prompt. " * 5]
+    generated = generate_texts(prompts, max_length=60)
+
+    assert len(generated) == len(prompts)
+    assert all(len(text) > 0 for text in generated)
+
+
+@pytest.fixture
+def unavailable_draft(monkeypatch):
+    def fail(name, main_model):
+        raise OSError(f"{name} not found")
+
+    monkeypatch.setattr(generator, "DRAFT_MODEL_NAME", "missing-draft")
+    monkeypatch.setattr(generator, "_draft_model", None)
+    monkeypatch.setattr(generator, "_draft_loaded", False)
+    monkeypatch.setattr(generator, "load_draft_model", fail)
+    monkeypatch.setattr(generator, "get_generator_pipeline", lambda: SimpleNamespace(model=None))
+
+
+def test_draft_model_falls_back_to_plain_decoding(unavailable_draft, monkeypatch):
+    """Test that a missing draft model disables assisted decoding"""
+    monkeypatch.setattr(generator, "ASSISTED_FALLBACK", True)
+    assert generator.get_draft_model() is None
+
+
+def test_draft_model_without_fallback_fails(unavailable_draft, monkeypatch):
+    """Test that a missing draft model is an error when fallback is off"""
+    monkeypatch.setattr(generator, "ASSISTED_FALLBACK", False)
+    with pytest.raises(OSError):
+        generator.get_draft_model()
+
+
+def test_generation_errors_propagate(monkeypatch):
+    """Test that a model error raises instead of returning a placeholder text"""
+    def fail(*args, **kwargs):
+        raise RuntimeError("out of memory")
+
+    monkeypatch.setattr(generator, "get_generator_pipeline", lambda: fail)
+    monkeypatch.setattr(generator, "get_draft_model", lambda: None)
+    with pytest.raises(RuntimeError):
+        generate_text("Hello")
+
+
+def test_seeded_sampling_is_reproducible_across_threads(monkeypatch):
+    """Test that concurrent seeded calls don't disturb each other's RNG"""
+    import threading
+    import time
+    import torch
+
+    def sample(prompt, **kwargs):
+        first = torch.rand(1).item()
+        time.sleep(0.01)  # room for another thread to reseed
+        return [{"generated_text": f"{prompt} {first:.6f} {torch.rand(1).item():.6f}"}]
+
+    monkeypatch.setattr(generator, "get_generator_pipeline", lambda: sample)
+    monkeypatch.setattr(generator, "get_draft_model", lambda: None)
+
+    results = {}
+
+    def run(i):
+        results[i] = generate_text("Hello", seed=i % 2)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({results[i] for i in range(0, 8, 2)}) == 1
+    assert len({results[i] for i in range(1, 8, 2)}) == 1
+    assert results[0] != results[1]
+
+
+def test_unseeded_sampling_does_not_wait_for_seeded(monkeypatch):
+    """Test that only seeded generations are serialized"""
+    monkeypatch.setattr(generator, "get_generator_pipeline",
+                        lambda: lambda prompt, **kwargs: [{"generated_text": f"{prompt} world"}])
+    monkeypatch.setattr(generator, "get_draft_model", lambda: None)
+
+    with generator._seed_lock:  # a seeded generation in progress
+        assert generate_text("Hello") == "world"
+        assert generate_text("Hello", do_sample=False) == "world"
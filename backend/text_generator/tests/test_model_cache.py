@@ -0,0 +1,23 @@
+import torch
+from transformers import AutoModelForCausalLM, GPT2Config
+
+from worker_runtime.model_cache import StartupTimer, export_model, is_cached, load_cached_model
+
+
+def test_export_roundtrip_keeps_tied_weights(tmp_path):
+    """Test that an exported model loads memory-mapped with identical greedy output"""
+    config = GPT2Config(vocab_size=100, n_positions=64, n_embd=32, n_layer=1, n_head=2)
+    model = AutoModelForCausalLM.from_config(config).eval()
+    path = str(tmp_path / "export")
+
+    export_model(model, None, path)
+    assert is_cached(path)
+
+    loaded = load_cached_model(AutoModelForCausalLM, path, StartupTimer())
+
+    # The output head is not stored; it must be tied back to the embeddings
+    assert loaded.lm_head.weight.data_ptr() == loaded.transformer.wte.weight.data_ptr()
+
+    input_ids = torch.tensor([[1, 5, 7]])
+    expected = model.generate(input_ids, max_new_tokens=5, do_sample=False, pad_token_id=0)
+    assert torch.equal(loaded.generate(input_ids, max_new_tokens=5, do_sample=False, pad_token_id=0), expected)
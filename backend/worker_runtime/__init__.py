@@ -0,0 +1,30 @@
+"""
+Runtime shared by the queue workers (image-resizer, sentiment-analyzer,
+text_generator): connection handling, message transports, consumer loop,
+pooled database engine, retries, timing metrics and latency tracing.
+Services plug in a handler.
+"""
+from .connection import ThreadSafeChannel, connect_with_retry
+from .db import dispose_engine, get_engine
+from .metrics import WorkerMetrics, metrics
+from .retry import dead_letter, declare_retry_queues, retry_or_dead_letter
+from .tracing import Trace, init_trace_table, trace_headers
+from .transport import get_transport
+from .worker import Worker
+
+__all__ = [
+    "ThreadSafeChannel",
+    "Trace",
+    "Worker",
+    "WorkerMetrics",
+    "connect_with_retry",
+    "dead_letter",
+    "declare_retry_queues",
+    "dispose_engine",
+    "get_engine",
+    "get_transport",
+    "init_trace_table",
+    "metrics",
+    "retry_or_dead_letter",
+    "trace_headers",
+]
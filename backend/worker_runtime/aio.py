@@ -0,0 +1,250 @@
+"""
+asyncio consumer mode (WORKER_MODE=asyncio)
+
+With pika's BlockingConnection, nothing on the connection moves while a
+handler runs inline: heartbeats and acks wait until the thumbnail or the
+inference is done, and long jobs get the connection dropped. In this mode
+the connection lives on an asyncio event loop (aio-pika) and never blocks:
+
+- delivery, heartbeats, acks and publishes run on the loop
+- handlers run on a thread pool of `concurrency` threads; the models and
+  Pillow release the GIL for the heavy lifting, and the database drivers
+  are synchronous, so the handler's DB calls stay on its thread too
+- up to `prefetch` messages are in flight, `concurrency` being handled
+- each priority lane has its own channel; live work is picked first
+
+Handlers keep their pika-style signature; the channel they get is an
+AsyncChannelBridge that runs each call on the loop and waits for it.
+"""
+import asyncio
+import functools
+import itertools
+import logging
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pika
+
+from .retry import retry_queue_arguments
+from .worker import DRAIN_TIMEOUT_S
+
+try:
+    import aio_pika
+except ImportError:  # only needed for WORKER_MODE=asyncio
+    aio_pika = None
+
+logger = logging.getLogger(__name__)
+
+# How long a handler thread waits for the loop to carry out an ack or publish
+BRIDGE_TIMEOUT_S = 30.0
+
+
+class AsyncChannelBridge:
+    """pika-style channel for handler threads, backed by an aio-pika channel"""
+
+    def __init__(self, loop, channel):
+        self._loop = loop
+        self._channel = channel
+        self._messages = {}
+        self._lock = threading.Lock()
+
+    def track(self, message) -> tuple:
+        """Remember a delivery and return it as a (method, properties, body) triple"""
+        with self._lock:
+            self._messages[message.delivery_tag] = message
+        method = pika.spec.Basic.Deliver(
+            consumer_tag=message.consumer_tag,
+            delivery_tag=message.delivery_tag,
+            redelivered=message.redelivered,
+            exchange=message.exchange,
+            routing_key=message.routing_key,
+        )
+        properties = pika.BasicProperties(
+            content_type=message.content_type,
+            headers=dict(message.headers or {}),
+            delivery_mode=int(message.delivery_mode) if message.delivery_mode else None,
+        )
+        return method, properties, message.body
+
+    @property
+    def is_open(self) -> bool:
+        return not self._channel.is_closed
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._call(self._message(delivery_tag, multiple).ack(multiple=multiple))
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self._call(self._message(delivery_tag, multiple).nack(multiple=multiple, requeue=requeue))
+
+    def basic_reject(self, delivery_tag=0, requeue=True):
+        self._call(self._message(delivery_tag, False).reject(requeue=requeue))
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        properties = properties or pika.BasicProperties()
+        message = aio_pika.Message(
+            body,
+            headers=properties.headers,
+            content_type=properties.content_type,
+            delivery_mode=properties.delivery_mode,
+        )
+        self._call(self._publish(exchange, routing_key, message, mandatory))
+
+    async def _publish(self, exchange, routing_key, message, mandatory):
+        target = self._channel.default_exchange if not exchange \
+            else await self._channel.get_exchange(exchange, ensure=False)
+        await target.publish(message, routing_key=routing_key, mandatory=mandatory)
+
+    def _message(self, delivery_tag, multiple):
+        """
+        The tracked message to settle; with `multiple` the broker also settles
+        every earlier delivery on the channel (all of them for tag 0, as in pika)
+        """
+        with self._lock:
+            if multiple:
+                if delivery_tag == 0:
+                    delivery_tag = max(self._messages)
+                for tag in [tag for tag in self._messages if tag < delivery_tag]:
+                    del self._messages[tag]
+            return self._messages.pop(delivery_tag)
+
+    def _call(self, coro):
+        asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout=BRIDGE_TIMEOUT_S)
+
+
+class AsyncRunner:
+    """Runs a Worker's handlers behind an aio-pika consumer"""
+
+    def __init__(self, worker):
+        self.worker = worker
+        self._stopping = None
+        self._inflight = set()
+        self._seq = itertools.count()
+
+    async def serve(self) -> None:
+        worker = self.worker
+        loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self._on_signal, signum)
+
+        pool = ThreadPoolExecutor(worker.concurrency, thread_name_prefix=f"{worker.name}-worker")
+        connection = await self._connect()
+        try:
+            # One channel per lane, so each has its own prefetch; all lanes
+            # feed one priority queue that hands out live work first
+            inbox = asyncio.PriorityQueue()
+            bridges = []
+            consumers = []
+            for index, name in enumerate(worker.lanes):
+                channel = await connection.channel()
+                await channel.set_qos(prefetch_count=worker.prefetch if index == 0 else worker.bulk_prefetch)
+                queue = await channel.declare_queue(name, durable=True)
+                for retry_name, arguments in retry_queue_arguments(name):
+                    await channel.declare_queue(retry_name, durable=True, arguments=arguments)
+                bridges.append(AsyncChannelBridge(loop, channel))
+                consumers.append((queue, await queue.consume(functools.partial(self._receive, inbox, index))))
+            logger.info(
+                f"{worker.prefix} Listening on {', '.join(worker.lanes)} (asyncio, "
+                f"prefetch={worker.prefetch}/{worker.bulk_prefetch}, "
+                f"concurrency={worker.concurrency}, batch_size={worker.batch_size})"
+            )
+
+            dispatcher = asyncio.create_task(self.dispatch(inbox, bridges, pool))
+            await self._stopping.wait()
+
+            # No new deliveries; what already arrived is still handled
+            for queue, consumer_tag in consumers:
+                await queue.cancel(consumer_tag)
+            await dispatcher
+            await self._drain()
+        finally:
+            await connection.close()
+            pool.shutdown(wait=False)
+            logger.info(f"{worker.prefix} Stopped ({worker.metrics.summary()})")
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    def _on_signal(self, signum):
+        logger.info(f"{self.worker.prefix} Got signal {signum}, draining...")
+        self.stop()
+
+    async def _connect(self):
+        # connect_robust reconnects (and re-consumes) on its own once connected
+        delay = 1.0
+        while True:
+            try:
+                return await aio_pika.connect_robust(self.worker.url)
+            except Exception as e:
+                logger.warning(f"{self.worker.prefix} RabbitMQ not ready yet: {e}. Retrying in {delay:.0f}s...")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+    async def _receive(self, inbox: asyncio.PriorityQueue, lane: int, message) -> None:
+        await inbox.put((lane, next(self._seq), message))
+
+    async def dispatch(self, inbox: asyncio.PriorityQueue, bridges: list, pool) -> None:
+        """
+        Group deliveries into single-lane batches and hand them to the pool,
+        `concurrency` at a time
+
+        A slot is taken before the next message is picked, so the pick
+        happens as late as possible and live work that arrived meanwhile
+        goes first.
+        """
+        worker = self.worker
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(worker.concurrency)
+        wait_s = worker.batch_wait_ms / 1000.0
+
+        while True:
+            await slots.acquire()
+            try:
+                lane, _, first = await asyncio.wait_for(inbox.get(), timeout=0.5)
+            except asyncio.TimeoutError:
+                slots.release()
+                if self._stopping.is_set() and inbox.empty():
+                    return
+                continue
+
+            batch = [first]
+            deadline = loop.time() + wait_s
+            while len(batch) < worker.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0 or self._stopping.is_set():
+                    break
+                try:
+                    item = await asyncio.wait_for(inbox.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                if item[0] != lane:
+                    # A batch is acked through its lane's channel; the other
+                    # lane's message waits for the next pick
+                    inbox.put_nowait(item)
+                    break
+                batch.append(item[2])
+
+            bridge = bridges[lane]
+            messages = [bridge.track(message) for message in batch]
+            task = loop.run_in_executor(pool, worker._handle, bridge, messages)
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+            task.add_done_callback(lambda _: slots.release())
+            worker.metrics.maybe_log(worker.prefix)
+
+    async def _drain(self) -> None:
+        if not self._inflight:
+            return
+        start = time.monotonic()
+        done, pending = await asyncio.wait(self._inflight, timeout=DRAIN_TIMEOUT_S)
+        if pending:
+            logger.warning(f"{self.worker.prefix} {len(pending)} handlers still running after "
+                           f"{time.monotonic() - start:.0f}s; their messages will be redelivered")
+
+
+def run_async(worker) -> None:
+    if aio_pika is None:
+        raise RuntimeError("WORKER_MODE=asyncio requires aio-pika to be installed")
+    asyncio.run(AsyncRunner(worker).serve())
@@ -0,0 +1,337 @@
+"""
+Queue-depth-driven autoscaler for worker processes on a single host
+
+Runs a service's consumer command as 1..N child processes and resizes the
+pool from the state of its queue, polled every AUTOSCALE_INTERVAL_S:
+
+- backlog: ready messages in both priority lanes. The pool aims for one
+  worker per AUTOSCALE_BACKLOG_PER_WORKER waiting messages, so a spike is
+  cleared in proportion to its size.
+- utilization: unacked messages / (consumers * prefetch), i.e. how many of
+  the consumers' prefetch slots are busy. Needs the RabbitMQ management
+  API (RABBITMQ_MANAGEMENT_URL); without it only the backlog is used.
+  The prefetch is worked out like the Worker does, from WORKER_PREFETCH or
+  WORKER_CONCURRENCY times the batch size in the service variable named by
+  --batch-size-env, so it follows the consumers' own settings.
+
+Hysteresis keeps the pool from flapping: growing needs AUTOSCALE_UP_POLLS
+polls in a row over the high mark, shrinking needs AUTOSCALE_DOWN_POLLS in
+a row under a lower mark, and nothing changes within AUTOSCALE_COOLDOWN_S
+of the last change. The pool grows straight to the size the backlog calls
+for but shrinks one worker at a time; retired workers get SIGTERM and
+drain their in-flight messages before exiting.
+
+Usage:
+    python -m worker_runtime.autoscaler --queue image_resize --min 1 --max 4 -- python -m app.consumer
+"""
+import argparse
+import base64
+import json
+import logging
+import math
+import os
+import signal
+import subprocess
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from dataclasses import dataclass
+from typing import Optional
+
+import pika
+
+from .connection import RABBITMQ_URL
+from .lanes import lanes
+from .worker import DRAIN_TIMEOUT_S, worker_prefetch
+
+logger = logging.getLogger(__name__)
+
+AUTOSCALE_MIN_WORKERS = int(os.getenv("AUTOSCALE_MIN_WORKERS", "1"))
+AUTOSCALE_MAX_WORKERS = int(os.getenv("AUTOSCALE_MAX_WORKERS", "4"))
+AUTOSCALE_INTERVAL_S = float(os.getenv("AUTOSCALE_INTERVAL_S", "5"))
+AUTOSCALE_BACKLOG_PER_WORKER = int(os.getenv("AUTOSCALE_BACKLOG_PER_WORKER", "50"))
+AUTOSCALE_UP_POLLS = int(os.getenv("AUTOSCALE_UP_POLLS", "2"))
+AUTOSCALE_DOWN_POLLS = int(os.getenv("AUTOSCALE_DOWN_POLLS", "12"))
+AUTOSCALE_COOLDOWN_S = float(os.getenv("AUTOSCALE_COOLDOWN_S", "30"))
+# Service variable holding the consumers' batch size, e.g. SENTIMENT_BATCH_SIZE
+AUTOSCALE_BATCH_SIZE_ENV = os.getenv("AUTOSCALE_BATCH_SIZE_ENV", "")
+# Prefetch of each worker, to turn unacked messages into utilization;
+# 0 = the Worker's own (WORKER_PREFETCH or batch size * WORKER_CONCURRENCY)
+AUTOSCALE_PREFETCH = int(os.getenv("AUTOSCALE_PREFETCH", "0"))
+
+RABBITMQ_MANAGEMENT_URL = os.getenv("RABBITMQ_MANAGEMENT_URL", "")
+
+
+def consumer_prefetch(batch_size_env: str = AUTOSCALE_BATCH_SIZE_ENV) -> int:
+    """Prefetch of each consumer, read from the env the consumers also see"""
+    if AUTOSCALE_PREFETCH:
+        return AUTOSCALE_PREFETCH
+    batch_size = int(os.getenv(batch_size_env, "1")) if batch_size_env else 1
+    return worker_prefetch(batch_size)
+
+
+@dataclass
+class QueueStats:
+    ready: int
+    consumers: int
+    unacked: Optional[int] = None  # None when the probe can't tell
+
+    def utilization(self, prefetch: int) -> Optional[float]:
+        """Share of the consumers' prefetch slots holding a message"""
+        if self.unacked is None or self.consumers == 0:
+            return None
+        return min(1.0, self.unacked / (self.consumers * max(1, prefetch)))
+
+
+# --------------------------------------------------
+# Scaling policy
+# --------------------------------------------------
+@dataclass
+class ScalePolicy:
+    min_workers: int = AUTOSCALE_MIN_WORKERS
+    max_workers: int = AUTOSCALE_MAX_WORKERS
+    backlog_per_worker: int = AUTOSCALE_BACKLOG_PER_WORKER
+    prefetch: int = 1
+    up_utilization: float = 0.9
+    down_utilization: float = 0.5
+    up_polls: int = AUTOSCALE_UP_POLLS
+    down_polls: int = AUTOSCALE_DOWN_POLLS
+    cooldown_s: float = AUTOSCALE_COOLDOWN_S
+
+
+class Scaler:
+    """Turns a series of queue polls into a pool size"""
+
+    def __init__(self, policy: ScalePolicy):
+        self.policy = policy
+        self.high_streak = 0
+        self.low_streak = 0
+        self.last_change = float("-inf")
+
+    def decide(self, stats: QueueStats, workers: int, now: float) -> int:
+        policy = self.policy
+        utilization = stats.utilization(policy.prefetch)
+        wanted = max(policy.min_workers, min(policy.max_workers,
+                                             math.ceil(stats.ready / policy.backlog_per_worker)))
+
+        high = stats.ready > workers * policy.backlog_per_worker or (
+            utilization is not None and utilization >= policy.up_utilization and stats.ready > 0
+        )
+        # Low water mark: the backlog would fit in half of one worker fewer
+        low = stats.ready <= (workers - 1) * policy.backlog_per_worker / 2 and (
+            utilization is None or utilization <= policy.down_utilization
+        )
+
+        self.high_streak = self.high_streak + 1 if high else 0
+        self.low_streak = self.low_streak + 1 if low and not high else 0
+
+        target = workers
+        if workers < policy.min_workers:
+            target = policy.min_workers
+        elif workers > policy.max_workers:
+            target = policy.max_workers
+        elif now - self.last_change < policy.cooldown_s:
+            return workers
+        elif self.high_streak >= policy.up_polls and workers < policy.max_workers:
+            target = max(workers + 1, wanted)
+        elif self.low_streak >= policy.down_polls and workers > policy.min_workers:
+            target = workers - 1
+
+        if target != workers:
+            self.last_change = now
+            self.high_streak = self.low_streak = 0
+        return target
+
+
+# --------------------------------------------------
+# Queue probes
+# --------------------------------------------------
+def _add(total: QueueStats, stats: QueueStats) -> QueueStats:
+    unacked = None if total.unacked is None or stats.unacked is None else total.unacked + stats.unacked
+    return QueueStats(total.ready + stats.ready, max(total.consumers, stats.consumers), unacked)
+
+
+class AmqpProbe:
+    """Ready messages and consumers of all lanes via passive queue declares"""
+
+    def __init__(self, queue: str, url: str = RABBITMQ_URL):
+        self.queues = lanes(queue)
+        self.url = url
+        self._connection = None
+        self._channel = None
+
+    def poll(self) -> QueueStats:
+        total = QueueStats(ready=0, consumers=0)
+        for queue in self.queues:
+            total = _add(total, self._poll_queue(queue))
+        return total
+
+    def _poll_queue(self, queue: str) -> QueueStats:
+        try:
+            if self._channel is None or not self._channel.is_open:
+                if self._connection is None or not self._connection.is_open:
+                    self._connection = pika.BlockingConnection(pika.URLParameters(self.url))
+                self._channel = self._connection.channel()
+            result = self._channel.queue_declare(queue=queue, passive=True)
+        except pika.exceptions.ChannelClosedByBroker as e:
+            self._channel = None
+            if e.reply_code == 404:  # lane not declared yet
+                return QueueStats(ready=0, consumers=0)
+            raise
+        except Exception:
+            self._channel = None
+            raise
+        return QueueStats(ready=result.method.message_count, consumers=result.method.consumer_count)
+
+
+class ManagementProbe:
+    """Ready, unacked and consumers of all lanes from the RabbitMQ management API"""
+
+    def __init__(self, queue: str, management_url: str = RABBITMQ_MANAGEMENT_URL, url: str = RABBITMQ_URL):
+        amqp = urllib.parse.urlparse(url)
+        vhost = urllib.parse.unquote(amqp.path[1:]) if len(amqp.path) > 1 else "/"
+        self.endpoints = [
+            f"{management_url.rstrip('/')}/api/queues/"
+            f"{urllib.parse.quote(vhost, safe='')}/{urllib.parse.quote(name, safe='')}"
+            for name in lanes(queue)
+        ]
+        credentials = f"{amqp.username or 'guest'}:{amqp.password or 'guest'}"
+        self.auth = "Basic " + base64.b64encode(credentials.encode()).decode()
+
+    def poll(self) -> QueueStats:
+        total = QueueStats(ready=0, consumers=0, unacked=0)
+        for endpoint in self.endpoints:
+            request = urllib.request.Request(endpoint, headers={"Authorization": self.auth})
+            try:
+                with urllib.request.urlopen(request, timeout=5) as response:
+                    data = json.load(response)
+            except urllib.error.HTTPError as e:
+                if e.code == 404:  # lane not declared yet
+                    continue
+                raise
+            total = _add(total, QueueStats(
+                ready=int(data.get("messages_ready", 0)),
+                consumers=int(data.get("consumers", 0)),
+                unacked=int(data.get("messages_unacknowledged", 0)),
+            ))
+        return total
+
+
+# --------------------------------------------------
+# Worker processes
+# --------------------------------------------------
+class WorkerPool:
+    """Child processes running the same consumer command"""
+
+    def __init__(self, command: list[str]):
+        self.command = command
+        self.workers = []
+        self.retiring = {}  # process -> deadline for SIGKILL
+
+    @property
+    def size(self) -> int:
+        return len(self.workers)
+
+    def scale_to(self, n: int) -> None:
+        while self.size < n:
+            process = subprocess.Popen(self.command)
+            self.workers.append(process)
+            logger.info(f"[autoscaler] Started worker pid={process.pid} ({self.size} running)")
+        while self.size > n:
+            self._retire(self.workers.pop())
+
+    def reap(self) -> None:
+        """Forget exited workers (the next scale_to replaces them)"""
+        for process in list(self.workers):
+            if process.poll() is not None:
+                self.workers.remove(process)
+                logger.warning(f"[autoscaler] Worker pid={process.pid} exited with {process.returncode}")
+        for process, deadline in list(self.retiring.items()):
+            if process.poll() is not None:
+                del self.retiring[process]
+            elif time.monotonic() > deadline:
+                logger.warning(f"[autoscaler] Worker pid={process.pid} did not drain in time, killing it")
+                process.kill()
+
+    def stop(self) -> None:
+        while self.workers:
+            self._retire(self.workers.pop())
+        while self.retiring:
+            self.reap()
+            time.sleep(0.1)
+
+    def _retire(self, process) -> None:
+        # The worker drains its in-flight messages on SIGTERM
+        process.terminate()
+        self.retiring[process] = time.monotonic() + DRAIN_TIMEOUT_S + 5
+        logger.info(f"[autoscaler] Retiring worker pid={process.pid} ({self.size} running)")
+
+
+def run(queue: str, command: list[str], policy: ScalePolicy, probe, interval_s: float = AUTOSCALE_INTERVAL_S) -> None:
+    """Keep resizing the pool until SIGTERM/SIGINT"""
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    pool = WorkerPool(command)
+    scaler = Scaler(policy)
+    pool.scale_to(policy.min_workers)
+    logger.info(f"[autoscaler] Scaling {queue} between {policy.min_workers} and {policy.max_workers} workers")
+
+    try:
+        while not stopping:
+            time.sleep(interval_s)
+            pool.reap()
+            try:
+                stats = probe.poll()
+            except Exception as e:
+                logger.warning(f"[autoscaler] Could not read the state of {queue}: {e}")
+                pool.scale_to(max(pool.size, policy.min_workers))
+                continue
+
+            target = scaler.decide(stats, pool.size, time.monotonic())
+            if target != pool.size:
+                logger.info(
+                    f"[autoscaler] {queue}: ready={stats.ready} consumers={stats.consumers} "
+                    f"utilization={stats.utilization(policy.prefetch)} -> {pool.size} to {target} workers"
+                )
+            pool.scale_to(target)
+    finally:
+        pool.stop()
+        logger.info("[autoscaler] Stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scale consumer processes with the depth of their queue")
+    parser.add_argument("--queue", required=True)
+    parser.add_argument("--min", type=int, default=AUTOSCALE_MIN_WORKERS)
+    parser.add_argument("--max", type=int, default=AUTOSCALE_MAX_WORKERS)
+    parser.add_argument("--prefetch", type=int, default=0,
+                        help="prefetch of each worker (for utilization); 0 = derive it like the Worker does")
+    parser.add_argument("--batch-size-env", default=AUTOSCALE_BATCH_SIZE_ENV,
+                        help="service variable holding the consumers' batch size")
+    parser.add_argument("--interval", type=float, default=AUTOSCALE_INTERVAL_S)
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="consumer command, after --")
+    args = parser.parse_args()
+
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command:
+        parser.error("missing consumer command")
+    if args.min < 0 or args.max < max(1, args.min):
+        parser.error("need 0 <= --min <= --max and --max >= 1")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    prefetch = args.prefetch or consumer_prefetch(args.batch_size_env)
+    policy = ScalePolicy(min_workers=args.min, max_workers=args.max, prefetch=prefetch)
+    probe = ManagementProbe(args.queue) if RABBITMQ_MANAGEMENT_URL else AmqpProbe(args.queue)
+    run(args.queue, command, policy, probe, args.interval)
+
+
+if __name__ == "__main__":
+    main()
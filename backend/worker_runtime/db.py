@@ -0,0 +1,38 @@
+"""
+One pooled SQLAlchemy engine per process
+
+Workers used to open a fresh engine (and with it a fresh Postgres
+connection) for every message. The shared engine keeps a small pool of
+connections alive, checks them before use so a restarted database is
+survived, and recycles them periodically.
+"""
+import os
+
+from sqlalchemy import create_engine
+
+DB_POOL_SIZE = int(os.getenv("WORKER_DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("WORKER_DB_MAX_OVERFLOW", "5"))
+DB_POOL_RECYCLE_S = int(os.getenv("WORKER_DB_POOL_RECYCLE_S", "1800"))
+
+_engine = None
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        _engine = create_engine(
+            os.environ["DATABASE_URL"],
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_pre_ping=True,
+            pool_recycle=DB_POOL_RECYCLE_S,
+        )
+    return _engine
+
+
+def dispose_engine() -> None:
+    """Drop pooled connections (e.g. before forking worker processes)"""
+    global _engine
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
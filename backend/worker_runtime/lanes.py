@@ -0,0 +1,29 @@
+"""
+Priority lanes
+
+Every work queue has two lanes: the live lane (the queue itself, fed by
+user actions such as creating a post) and the bulk lane `<queue>.bulk`
+(imports, backfills, re-processing). Workers consume both but always hand
+out live work first, so a backfill never delays the enrichment of a post
+a user just created.
+"""
+LIVE = "live"
+BULK = "bulk"
+PRIORITIES = (LIVE, BULK)
+
+
+def lane_queue(queue: str, priority: str = LIVE) -> str:
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority {priority!r} (expected one of {', '.join(PRIORITIES)})")
+    return queue if priority == LIVE else f"{queue}.{priority}"
+
+
+def lanes(queue: str) -> list[str]:
+    """Lanes of `queue`, highest priority first"""
+    return [lane_queue(queue, priority) for priority in PRIORITIES]
+
+
+def source_lane(method, queue: str) -> str:
+    """The lane of `queue` a delivery came from (retries go back to it)"""
+    routing_key = getattr(method, "routing_key", None)
+    return routing_key if routing_key in lanes(queue) else queue
@@ -0,0 +1,268 @@
+"""
+Timing, size and memory metrics of a worker process
+
+Every stage (e.g. "handle", "batch", or a handler's "fetch", "resize",
+"ack") keeps its call count, error count, total and worst time, and the
+most recent durations for percentiles. Payload sizes (message bodies,
+images, texts) are kept the same way per kind, and the process RSS and
+peak RSS are sampled after every handler call.
+
+The worker logs a summary every METRICS_LOG_S seconds. With
+WORKER_METRICS_PORT set it also serves them in the Prometheus text format
+on http://<host>:<port>/metrics (see serve()).
+"""
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+METRICS_LOG_S = float(os.getenv("WORKER_METRICS_LOG_S", "60"))
+# Durations kept per stage for percentiles
+METRICS_WINDOW = int(os.getenv("WORKER_METRICS_WINDOW", "1024"))
+# Port of the /metrics endpoint; 0 = not served
+METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "0"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(q / 100.0 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+class StageStats:
+    def __init__(self, window: int = METRICS_WINDOW):
+        self.count = 0
+        self.items = 0
+        self.errors = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds: float, items: int = 1, error: bool = False) -> None:
+        self.count += 1
+        self.items += items
+        self.errors += int(error)
+        self.total_s += seconds
+        self.max_s = max(self.max_s, seconds)
+        self.recent.append(seconds)
+
+    def snapshot(self) -> dict:
+        recent = sorted(self.recent)
+        return {
+            "count": self.count,
+            "items": self.items,
+            "errors": self.errors,
+            "mean_ms": 1000 * self.total_s / self.count if self.count else 0.0,
+            "p50_ms": 1000 * percentile(recent, 50),
+            "p95_ms": 1000 * percentile(recent, 95),
+            "max_ms": 1000 * self.max_s,
+        }
+
+
+class SizeStats:
+    def __init__(self, window: int = METRICS_WINDOW):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, nbytes: int) -> None:
+        self.count += 1
+        self.total += nbytes
+        self.max = max(self.max, nbytes)
+        self.recent.append(nbytes)
+
+    def snapshot(self) -> dict:
+        recent = sorted(self.recent)
+        return {
+            "count": self.count,
+            "total_bytes": self.total,
+            "mean_bytes": self.total / self.count if self.count else 0.0,
+            "p50_bytes": percentile(recent, 50),
+            "p95_bytes": percentile(recent, 95),
+            "max_bytes": self.max,
+        }
+
+
+def rss_bytes() -> Optional[int]:
+    """Resident set size of this process now (Linux only)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Highest resident set size this process reached"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+class WorkerMetrics:
+    """Per-stage timings and payload sizes, safe to update from handler threads"""
+
+    def __init__(self, log_every_s: float = METRICS_LOG_S):
+        self.log_every_s = log_every_s
+        self.stages = {}
+        self.sizes = {}
+        self.memory = {"rss_bytes": None, "peak_rss_bytes": None}
+        self._lock = threading.Lock()
+        self._last_log = time.monotonic()
+
+    def observe(self, stage: str, seconds: float, items: int = 1, error: bool = False) -> None:
+        with self._lock:
+            if stage not in self.stages:
+                self.stages[stage] = StageStats()
+            self.stages[stage].observe(seconds, items, error)
+
+    @contextmanager
+    def time(self, stage: str, items: int = 1):
+        """Time the block as one call of `stage`; exceptions count as errors"""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(stage, time.perf_counter() - start, items, error=True)
+            raise
+        self.observe(stage, time.perf_counter() - start, items)
+
+    def observe_bytes(self, kind: str, nbytes: int) -> None:
+        """Record the size of one payload of `kind` (e.g. "message", "image")"""
+        with self._lock:
+            if kind not in self.sizes:
+                self.sizes[kind] = SizeStats()
+            self.sizes[kind].observe(nbytes)
+
+    def sample_memory(self) -> None:
+        """Record the current and peak RSS of the process"""
+        rss, peak = rss_bytes(), peak_rss_bytes()
+        # ru_maxrss is only updated lazily, so it can trail the current RSS
+        if rss is not None and peak is not None:
+            peak = max(peak, rss)
+        with self._lock:
+            self.memory = {"rss_bytes": rss, "peak_rss_bytes": peak}
+        if rss is not None:
+            self.observe_bytes("rss", rss)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {stage: stats.snapshot() for stage, stats in self.stages.items()}
+
+    def sizes_snapshot(self) -> dict:
+        with self._lock:
+            return {kind: stats.snapshot() for kind, stats in self.sizes.items()}
+
+    def summary(self) -> str:
+        parts = []
+        for stage, s in self.snapshot().items():
+            parts.append(
+                f"{stage}: n={s['count']} items={s['items']} err={s['errors']} "
+                f"mean={s['mean_ms']:.1f}ms p50={s['p50_ms']:.1f}ms "
+                f"p95={s['p95_ms']:.1f}ms max={s['max_ms']:.1f}ms"
+            )
+        for kind, s in self.sizes_snapshot().items():
+            parts.append(
+                f"{kind}: n={s['count']} p50={s['p50_bytes'] / 1024:.1f}KiB "
+                f"p95={s['p95_bytes'] / 1024:.1f}KiB max={s['max_bytes'] / 1024:.1f}KiB"
+            )
+        peak = self.memory["peak_rss_bytes"]
+        if peak is not None:
+            parts.append(f"peak_rss={peak / 2**20:.1f}MiB")
+        return "; ".join(parts) or "no work yet"
+
+    def render(self, worker: str) -> str:
+        """The text exposition format Prometheus scrapes, labelled with `worker`"""
+        lines = []
+        with self._lock:
+            stages = {stage: (sorted(s.recent), s.total_s, s.count, s.errors)
+                      for stage, s in self.stages.items()}
+            sizes = {kind: (sorted(s.recent), s.total, s.count) for kind, s in self.sizes.items()}
+            memory = dict(self.memory)
+
+        lines.append("# HELP worker_stage_duration_seconds Time per stage call (quantiles over the recent window)")
+        lines.append("# TYPE worker_stage_duration_seconds summary")
+        for stage, (recent, total, count, _) in sorted(stages.items()):
+            labels = f'worker="{worker}",stage="{stage}"'
+            for q in QUANTILES:
+                lines.append(
+                    f'worker_stage_duration_seconds{{{labels},quantile="{q}"}} {percentile(recent, 100 * q)}'
+                )
+            lines.append(f"worker_stage_duration_seconds_sum{{{labels}}} {total}")
+            lines.append(f"worker_stage_duration_seconds_count{{{labels}}} {count}")
+        lines.append("# HELP worker_stage_errors_total Stage calls that raised")
+        lines.append("# TYPE worker_stage_errors_total counter")
+        for stage, (_, _, _, errors) in sorted(stages.items()):
+            lines.append(f'worker_stage_errors_total{{worker="{worker}",stage="{stage}"}} {errors}')
+
+        lines.append("# HELP worker_payload_bytes Payload sizes by kind (quantiles over the recent window)")
+        lines.append("# TYPE worker_payload_bytes summary")
+        for kind, (recent, total, count) in sorted(sizes.items()):
+            labels = f'worker="{worker}",kind="{kind}"'
+            for q in QUANTILES:
+                lines.append(f'worker_payload_bytes{{{labels},quantile="{q}"}} {percentile(recent, 100 * q)}')
+            lines.append(f"worker_payload_bytes_sum{{{labels}}} {total}")
+            lines.append(f"worker_payload_bytes_count{{{labels}}} {count}")
+
+        for name, help_text in (("rss_bytes", "Resident set size"),
+                                ("peak_rss_bytes", "Highest resident set size so far")):
+            if memory[name] is not None:
+                lines.append(f"# HELP worker_{name} {help_text}")
+                lines.append(f"# TYPE worker_{name} gauge")
+                lines.append(f'worker_{name}{{worker="{worker}"}} {memory[name]}')
+        return "\n".join(lines) + "\n"
+
+    def maybe_log(self, prefix: str) -> None:
+        """Log the summary if METRICS_LOG_S passed since the last one"""
+        now = time.monotonic()
+        if self.log_every_s <= 0 or now - self._last_log < self.log_every_s:
+            return
+        self._last_log = now
+        logger.info(f"{prefix} {self.summary()}")
+
+
+def serve(metrics: WorkerMetrics, worker: str, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve `metrics` at http://host:port/metrics from a daemon thread"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render(worker).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=f"{worker}-metrics", daemon=True).start()
+    return server
+
+
+metrics = WorkerMetrics()
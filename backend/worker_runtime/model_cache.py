@@ -0,0 +1,181 @@
+"""
+Local safetensors model cache with memory-mapped loading
+
+The model is exported once (config, tokenizer and a single
+`model.safetensors`) to a local directory. Later starts map the weights
+file into memory instead of reading and deserializing it: parameters are
+views into one read-only file mapping, so start-up does no copying, pages
+are read on first use, and every replica on the host shares the same
+page-cache pages. Nothing is fetched from the network.
+
+Shared by the services that run a transformers model; each one keeps a
+small `app.model_cache` whose only job is the export command line, which
+calls export_cli() with its model class and name.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import struct
+import tempfile
+import time
+from contextlib import contextmanager
+
+import torch
+from transformers import AutoConfig, AutoTokenizer
+from transformers.modeling_utils import no_init_weights
+
+WEIGHTS_FILE = "model.safetensors"
+
+_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+class StartupTimer:
+    """Wall-clock time of each start-up phase, in order"""
+
+    def __init__(self):
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def summary(self) -> str:
+        parts = [f"{name}={seconds:.2f}s" for name, seconds in self.phases.items()]
+        return " ".join(parts + [f"total={sum(self.phases.values()):.2f}s"])
+
+
+startup_timer = StartupTimer()
+
+
+def is_cached(path: str, weights_file: str = WEIGHTS_FILE) -> bool:
+    """Whether `path` holds a complete export"""
+    return bool(path) and os.path.isfile(os.path.join(path, weights_file)) \
+        and os.path.isfile(os.path.join(path, "config.json"))
+
+
+@contextmanager
+def export_dir(path: str, weights_file: str = WEIGHTS_FILE):
+    """
+    Temporary directory to write an export of `path` into
+
+    Renamed into place when the block ends, so replicas starting at the
+    same time never see a half-written export. An incomplete directory
+    already at `path` (left by an interrupted non-atomic export) is
+    replaced; losing the race to a complete one is not an error.
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix=".export-", dir=parent)
+    try:
+        yield tmp_path
+        if os.path.isdir(path) and not is_cached(path, weights_file):
+            shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not is_cached(path, weights_file):
+            raise
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def export_model(model, tokenizer, path: str) -> None:
+    """Save config, tokenizer and single-file safetensors weights to `path` (see export_dir)"""
+    with export_dir(path) as tmp_path:
+        # One shard, so the whole model is one mapping
+        model.save_pretrained(tmp_path, safe_serialization=True, max_shard_size="100GB")
+        if tokenizer is not None:
+            tokenizer.save_pretrained(tmp_path)
+
+
+def mmap_safetensors(filename: str) -> dict[str, torch.Tensor]:
+    """Tensors of a safetensors file as views into a private, read-only-in-practice mapping"""
+    with open(filename, "rb") as f:
+        header_len = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_len))
+    data_start = 8 + header_len
+
+    # MAP_PRIVATE: pages come from (and stay in) the shared page cache until written
+    storage = torch.UntypedStorage.from_file(filename, shared=False, nbytes=os.path.getsize(filename))
+
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = _DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        tensor = torch.empty(0, dtype=dtype)
+        tensor.set_(storage, (data_start + begin) // tensor.element_size(), info["shape"])
+        tensors[name] = tensor
+    return tensors
+
+
+def load_cached_model(model_cls, path: str, timer: StartupTimer = startup_timer):
+    """Instantiate `model_cls` from an export, with weights memory-mapped"""
+    with timer.phase("config"):
+        config = AutoConfig.from_pretrained(path, local_files_only=True)
+
+    with timer.phase("build"):
+        # Weights are replaced right away, so skip random initialization
+        with no_init_weights():
+            model = model_cls.from_config(config) if hasattr(model_cls, "from_config") \
+                else model_cls(config)
+
+    with timer.phase("weights"):
+        state = mmap_safetensors(os.path.join(path, WEIGHTS_FILE))
+        missing, unexpected = model.load_state_dict(state, strict=False, assign=True)
+        # Tied weights (e.g. output embeddings) are not stored separately
+        allowed = list(getattr(model, "_tied_weights_keys", None) or []) \
+            + list(getattr(model, "_keys_to_ignore_on_load_missing", None) or [])
+        missing = [key for key in missing if not any(re.search(pattern, key) for pattern in allowed)]
+        if missing or unexpected:
+            raise ValueError(f"Export in {path} does not match the model: missing={missing[:5]} "
+                             f"unexpected={unexpected[:5]}")
+        model.tie_weights()
+        model.eval()
+
+    return model
+
+
+def load_cached_tokenizer(path: str, timer: StartupTimer = startup_timer):
+    with timer.phase("tokenizer"):
+        return AutoTokenizer.from_pretrained(path, local_files_only=True)
+
+
+def export_cli(model_cls, model_name: str, service: str, description: str, argv=None) -> None:
+    """`--export DIR [--model NAME]`: export `model_name` loaded with `model_cls`"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--export", required=True, metavar="DIR", help="target directory")
+    parser.add_argument("--model", default=model_name)
+    args = parser.parse_args(argv)
+
+    if is_cached(args.export):
+        print(f"{args.export} already holds an export")
+        return
+
+    export_model(
+        model_cls.from_pretrained(args.model),
+        AutoTokenizer.from_pretrained(args.model),
+        args.export,
+    )
+    logging.info(f"[{service}] Exported {args.model} to {args.export}")
+    print(f"Exported {args.model} to {args.export}")
@@ -0,0 +1,196 @@
+"""
+Bounded retries with exponential backoff and a dead-letter queue
+
+A failed message is acked and republished to a delay queue instead of
+being requeued in place. Each delay queue has a fixed TTL and dead-letters
+expired messages back to the work queue, so attempt n waits
+RETRY_BASE_DELAY_MS * 2^(n-1) (capped at RETRY_MAX_DELAY_MS). The attempt
+count travels in the `x-attempt` header. After RETRY_MAX_ATTEMPTS attempts,
+or right away for a message that can't be parsed, the message goes to
+`<queue>.dlq` with the last error in its headers.
+
+Delay queues are declared with their TTL, so changing the delay settings
+means deleting the old `<queue>.retry.<n>` queues first.
+
+Usage:
+    python -m worker_runtime.retry --queue image_resize --inspect            # show dead letters (left in place)
+    python -m worker_runtime.retry --queue image_resize --replay --limit 10  # move them back to the work queue
+    python -m worker_runtime.retry --queue image_resize --purge
+"""
+import argparse
+import json
+import logging
+import os
+import time
+
+import pika
+
+from .connection import connect_with_retry
+from .lanes import source_lane
+
+logger = logging.getLogger(__name__)
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "5"))
+RETRY_BASE_DELAY_MS = int(os.getenv("RETRY_BASE_DELAY_MS", "1000"))
+RETRY_MAX_DELAY_MS = int(os.getenv("RETRY_MAX_DELAY_MS", "60000"))
+
+ATTEMPT_HEADER = "x-attempt"
+
+
+def retry_queue(queue: str, attempt: int) -> str:
+    return f"{queue}.retry.{attempt}"
+
+
+def dead_letter_queue(queue: str) -> str:
+    return f"{queue}.dlq"
+
+
+def retry_delay_ms(attempt: int) -> int:
+    """Wait before redelivering a message that failed `attempt` times"""
+    return min(RETRY_BASE_DELAY_MS * 2 ** (attempt - 1), RETRY_MAX_DELAY_MS)
+
+
+def retry_queue_arguments(queue: str) -> list[tuple[str, dict]]:
+    """(name, arguments) of the delay queues and dead-letter queue of `queue`"""
+    queues = [
+        (retry_queue(queue, attempt), {
+            "x-message-ttl": retry_delay_ms(attempt),
+            "x-dead-letter-exchange": "",
+            "x-dead-letter-routing-key": queue,
+        })
+        for attempt in range(1, RETRY_MAX_ATTEMPTS)
+    ]
+    return queues + [(dead_letter_queue(queue), None)]
+
+
+def declare_retry_queues(ch, queue: str) -> None:
+    """Declare the delay queues and dead-letter queue of `queue`"""
+    for name, arguments in retry_queue_arguments(queue):
+        ch.queue_declare(queue=name, durable=True, arguments=arguments)
+
+
+def attempts(properties) -> int:
+    """How many times the message has failed so far"""
+    headers = getattr(properties, "headers", None) or {}
+    return int(headers.get(ATTEMPT_HEADER, 0))
+
+
+def _republish(ch, routing_key: str, properties, body, headers: dict) -> None:
+    ch.basic_publish(
+        exchange="",
+        routing_key=routing_key,
+        body=body,
+        properties=pika.BasicProperties(
+            delivery_mode=2,
+            content_type=getattr(properties, "content_type", None),
+            headers={**(getattr(properties, "headers", None) or {}), **headers},
+        )
+    )
+
+
+def dead_letter(ch, method, properties, body, queue: str, error) -> None:
+    """Park a message in the dead-letter queue and ack the original"""
+    queue = source_lane(method, queue)
+    _republish(ch, dead_letter_queue(queue), properties, body, {
+        ATTEMPT_HEADER: attempts(properties) + 1,
+        "x-error": str(error)[:1000],
+        "x-failed-at": int(time.time()),
+    })
+    ch.basic_ack(delivery_tag=method.delivery_tag)
+    logger.error(f"Dead-lettered message from {queue}: {error}")
+
+
+def retry_or_dead_letter(ch, method, properties, body, queue: str, error) -> bool:
+    """
+    Schedule a delayed retry of a failed message, or dead-letter it once it
+    has used up its attempts. Returns True if it will be retried.
+
+    Messages from a lane of `queue` (see lanes.py) are retried on that lane.
+    """
+    queue = source_lane(method, queue)
+    attempt = attempts(properties) + 1
+    if attempt >= RETRY_MAX_ATTEMPTS:
+        dead_letter(ch, method, properties, body, queue, error)
+        return False
+
+    # Published before the ack: a crash in between redelivers, never loses
+    _republish(ch, retry_queue(queue, attempt), properties, body, {ATTEMPT_HEADER: attempt})
+    ch.basic_ack(delivery_tag=method.delivery_tag)
+    logger.warning(
+        f"Retrying message from {queue} in {retry_delay_ms(attempt)}ms "
+        f"(attempt {attempt}/{RETRY_MAX_ATTEMPTS}): {error}"
+    )
+    return True
+
+
+def inspect_dead_letters(ch, queue: str, limit: int) -> list[dict]:
+    """Dead letters of `queue`, left in the queue"""
+    found = []
+    last_tag = None
+    for _ in range(limit):
+        method, properties, body = ch.basic_get(dead_letter_queue(queue))
+        if method is None:
+            break
+        last_tag = method.delivery_tag
+        headers = properties.headers or {}
+        found.append({
+            "body": body.decode("utf-8", errors="replace"),
+            "attempts": headers.get(ATTEMPT_HEADER),
+            "error": headers.get("x-error"),
+            "failed_at": headers.get("x-failed-at"),
+        })
+    if last_tag is not None:
+        ch.basic_nack(delivery_tag=last_tag, multiple=True, requeue=True)
+    return found
+
+
+def replay_dead_letters(ch, queue: str, limit: int) -> int:
+    """Move up to `limit` dead letters back to `queue` with a fresh attempt budget"""
+    replayed = 0
+    while replayed < limit:
+        method, properties, body = ch.basic_get(dead_letter_queue(queue))
+        if method is None:
+            break
+        headers = {
+            key: value for key, value in (properties.headers or {}).items()
+            if key not in (ATTEMPT_HEADER, "x-error", "x-failed-at")
+        }
+        ch.basic_publish(
+            exchange="",
+            routing_key=queue,
+            body=body,
+            properties=pika.BasicProperties(delivery_mode=2, headers=headers)
+        )
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        replayed += 1
+    return replayed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or replay dead-lettered messages")
+    parser.add_argument("--queue", required=True, help="work queue, e.g. image_resize")
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--inspect", action="store_true")
+    action.add_argument("--replay", action="store_true")
+    action.add_argument("--purge", action="store_true")
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+
+    conn = connect_with_retry()
+    ch = conn.channel()
+    ch.queue_declare(queue=args.queue, durable=True)
+    declare_retry_queues(ch, args.queue)
+
+    if args.inspect:
+        print(json.dumps(inspect_dead_letters(ch, args.queue, args.limit), indent=2))
+    elif args.replay:
+        print(json.dumps({"replayed": replay_dead_letters(ch, args.queue, args.limit)}))
+    else:
+        result = ch.queue_purge(dead_letter_queue(args.queue))
+        print(json.dumps({"purged": result.method.message_count}))
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
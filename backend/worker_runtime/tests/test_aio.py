@@ -0,0 +1,145 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("aio_pika")
+
+from worker_runtime.aio import AsyncChannelBridge, AsyncRunner
+from worker_runtime.metrics import WorkerMetrics
+from worker_runtime.worker import Worker
+
+
+class FakeMessage:
+    consumer_tag = "ctag"
+    redelivered = False
+    exchange = ""
+    routing_key = "jobs"
+    content_type = "application/json"
+    delivery_mode = 2
+
+    def __init__(self, tag, events, headers=None):
+        self.delivery_tag = tag
+        self.headers = headers
+        self.body = json.dumps({"post_id": tag}).encode("utf-8")
+        self.events = events
+
+    async def ack(self, multiple=False):
+        self.events.append(("ack", self.delivery_tag) + (("multiple",) if multiple else ()))
+
+    async def nack(self, multiple=False, requeue=True):
+        self.events.append(("nack", self.delivery_tag))
+
+    async def reject(self, requeue=True):
+        self.events.append(("reject", self.delivery_tag))
+
+
+class FakeExchange:
+    def __init__(self, events):
+        self.events = events
+
+    async def publish(self, message, routing_key, mandatory=False):
+        self.events.append(("publish", routing_key, message.headers))
+
+
+class FakeChannel:
+    is_closed = False
+
+    def __init__(self, events):
+        self.default_exchange = FakeExchange(events)
+
+
+def _run(worker, messages, events, bulk=()):
+    """Feed live `messages` and `bulk` ones through AsyncRunner.dispatch and drain"""
+    async def main():
+        runner = AsyncRunner(worker)
+        runner._stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        bridges = [AsyncChannelBridge(loop, FakeChannel(events)) for _ in worker.lanes]
+        inbox = asyncio.PriorityQueue()
+        for message in bulk:
+            await runner._receive(inbox, 1, message)
+        for message in messages:
+            await runner._receive(inbox, 0, message)
+
+        with ThreadPoolExecutor(worker.concurrency) as pool:
+            dispatcher = asyncio.create_task(runner.dispatch(inbox, bridges, pool))
+            await asyncio.sleep(0.2)
+            runner.stop()
+            await dispatcher
+            await runner._drain()
+
+    asyncio.run(main())
+
+
+def test_batches_run_on_the_pool_and_ack_through_the_loop():
+    """Test that deliveries are batched and handler acks reach the messages"""
+    events = []
+    batches = []
+
+    def handle_batch(ch, messages):
+        batches.append([method.delivery_tag for method, _, _ in messages])
+        for method, _, _ in messages:
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    worker = Worker("test", "jobs", batch_handler=handle_batch, batch_size=2,
+                    batch_wait_ms=20, metrics=WorkerMetrics())
+    _run(worker, [FakeMessage(tag, events) for tag in (1, 2, 3)], events)
+
+    assert batches == [[1, 2], [3]]
+    assert events == [("ack", 1), ("ack", 2), ("ack", 3)]
+    assert worker.metrics.snapshot()["batch"]["items"] == 3
+
+
+def test_failed_handler_is_retried_through_the_bridge():
+    """Test that a retry is published before the original is acked"""
+    events = []
+
+    def handler(ch, method, properties, body):
+        raise RuntimeError("boom")
+
+    worker = Worker("test", "jobs", handler=handler, concurrency=2, metrics=WorkerMetrics())
+    _run(worker, [FakeMessage(5, events, headers={"x-trace": "abc"})], events)
+
+    assert events[0][0] == "publish"
+    assert events[0][1] == "jobs.retry.1"
+    assert events[0][2]["x-attempt"] == 1
+    assert events[0][2]["x-trace"] == "abc"
+    assert events[1] == ("ack", 5)
+
+
+def test_live_lane_is_handled_before_bulk():
+    """Test that live messages go first even when bulk ones arrived earlier"""
+    events = []
+    handled = []
+
+    def handle_batch(ch, messages):
+        handled.append([method.delivery_tag for method, _, _ in messages])
+        for method, _, _ in messages:
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    worker = Worker("test", "jobs", batch_handler=handle_batch, batch_size=2,
+                    batch_wait_ms=20, metrics=WorkerMetrics())
+    _run(worker, [FakeMessage(tag, events) for tag in (1, 2, 3)], events,
+         bulk=[FakeMessage(tag, events) for tag in (101, 102)])
+
+    # Batches never mix lanes
+    assert handled == [[1, 2], [3], [101, 102]]
+
+
+def test_multiple_ack_settles_earlier_deliveries():
+    """Test that multiple=True acks up to the tag, like the blocking Worker"""
+    events = []
+    handled = []
+
+    def handle_batch(ch, messages):
+        handled.append([method.delivery_tag for method, _, _ in messages])
+        ch.basic_ack(delivery_tag=messages[-1][0].delivery_tag, multiple=True)
+
+    worker = Worker("test", "jobs", batch_handler=handle_batch, batch_size=3,
+                    batch_wait_ms=20, metrics=WorkerMetrics())
+    _run(worker, [FakeMessage(tag, events) for tag in (1, 2, 3)], events)
+
+    assert handled == [[1, 2, 3]]
+    assert events == [("ack", 3, "multiple")]
@@ -0,0 +1,90 @@
+import sys
+import time
+
+from worker_runtime.autoscaler import QueueStats, ScalePolicy, Scaler, WorkerPool
+
+
+def _policy(**overrides):
+    settings = dict(min_workers=1, max_workers=4, backlog_per_worker=10, prefetch=1,
+                    up_polls=2, down_polls=3, cooldown_s=30)
+    settings.update(overrides)
+    return ScalePolicy(**settings)
+
+
+def test_scales_up_in_proportion_to_the_backlog():
+    """Test that a sustained spike grows the pool straight to what the backlog needs"""
+    scaler = Scaler(_policy())
+
+    assert scaler.decide(QueueStats(ready=35, consumers=1), 1, now=0) == 1  # one poll is not enough
+    assert scaler.decide(QueueStats(ready=35, consumers=1), 1, now=5) == 4
+    # Never past max
+    scaler = Scaler(_policy(max_workers=3))
+    scaler.decide(QueueStats(ready=500, consumers=1), 1, now=0)
+    assert scaler.decide(QueueStats(ready=500, consumers=1), 1, now=5) == 3
+
+
+def test_cooldown_and_slow_scale_down():
+    """Test that the pool holds after a change and then shrinks one worker at a time"""
+    scaler = Scaler(_policy())
+    scaler.decide(QueueStats(ready=40, consumers=1), 1, now=0)
+    assert scaler.decide(QueueStats(ready=40, consumers=1), 1, now=5) == 4
+
+    # Empty queue, but still within the cooldown
+    for now in (10, 15, 20, 25):
+        assert scaler.decide(QueueStats(ready=0, consumers=4), 4, now=now) == 4
+    # Cooldown over and low for down_polls polls in a row
+    assert scaler.decide(QueueStats(ready=0, consumers=4), 4, now=40) == 3
+    assert scaler.decide(QueueStats(ready=0, consumers=3), 3, now=45) == 3
+
+
+def test_hysteresis_band_keeps_the_size():
+    """Test that a backlog between the low and high marks changes nothing"""
+    scaler = Scaler(_policy(down_polls=1, up_polls=1, cooldown_s=0))
+    # 3 workers: high mark is > 30 ready, low mark is <= 10 ready
+    for now in range(10):
+        assert scaler.decide(QueueStats(ready=20, consumers=3), 3, now=now) == 3
+
+
+def test_busy_consumers_scale_up_without_a_backlog_spike():
+    """Test that saturated prefetch slots count as pressure"""
+    scaler = Scaler(_policy(up_polls=1, cooldown_s=0, prefetch=4))
+    stats = QueueStats(ready=5, consumers=2, unacked=8)
+
+    assert stats.utilization(4) == 1.0
+    assert scaler.decide(stats, 2, now=0) == 3
+    # Not scaled down while the consumers are busy, even with an empty queue
+    scaler = Scaler(_policy(down_polls=1, cooldown_s=0, prefetch=4))
+    assert scaler.decide(QueueStats(ready=0, consumers=2, unacked=7), 2, now=0) == 2
+
+
+def test_worker_pool_spawns_and_retires_processes():
+    """Test that retired workers are terminated and reaped"""
+    pool = WorkerPool([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        pool.scale_to(2)
+        assert pool.size == 2
+        pool.scale_to(1)
+        assert pool.size == 1
+
+        deadline = time.monotonic() + 5
+        while pool.retiring and time.monotonic() < deadline:
+            pool.reap()
+            time.sleep(0.05)
+        assert not pool.retiring
+    finally:
+        pool.stop()
+    assert pool.size == 0
+
+
+def test_prefetch_follows_the_worker_settings(monkeypatch):
+    """Test that the utilization prefetch is the one the consumers' Worker uses"""
+    from worker_runtime import autoscaler
+    from worker_runtime.worker import CONCURRENCY, PREFETCH
+
+    monkeypatch.setenv("TEST_BATCH_SIZE", "16")
+    expected = PREFETCH or 16 * CONCURRENCY
+    assert autoscaler.consumer_prefetch("TEST_BATCH_SIZE") == expected
+    assert autoscaler.consumer_prefetch("") == (PREFETCH or CONCURRENCY)
+
+    monkeypatch.setattr(autoscaler, "AUTOSCALE_PREFETCH", 5)
+    assert autoscaler.consumer_prefetch("TEST_BATCH_SIZE") == 5
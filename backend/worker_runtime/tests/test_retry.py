@@ -0,0 +1,25 @@
+from worker_runtime import retry
+
+
+def test_backoff_doubles_up_to_the_cap(monkeypatch):
+    """Test that retry delays grow exponentially and are bounded"""
+    monkeypatch.setattr(retry, "RETRY_BASE_DELAY_MS", 1000)
+    monkeypatch.setattr(retry, "RETRY_MAX_DELAY_MS", 5000)
+
+    assert [retry.retry_delay_ms(n) for n in range(1, 6)] == [1000, 2000, 4000, 5000, 5000]
+
+
+def test_delay_queues_route_back_to_the_work_queue(monkeypatch):
+    """Test that each delay queue expires into the work queue"""
+    declared = {}
+
+    class Channel:
+        def queue_declare(self, queue, durable, arguments=None):
+            declared[queue] = arguments
+
+    monkeypatch.setattr(retry, "RETRY_MAX_ATTEMPTS", 3)
+    retry.declare_retry_queues(Channel(), "jobs")
+
+    assert sorted(declared) == ["jobs.dlq", "jobs.retry.1", "jobs.retry.2"]
+    assert declared["jobs.retry.2"]["x-dead-letter-routing-key"] == "jobs"
+    assert declared["jobs.dlq"] is None
@@ -0,0 +1,83 @@
+import json
+import threading
+import time
+
+import pytest
+
+from worker_runtime.metrics import WorkerMetrics
+from worker_runtime.transport import MemoryBroker, MemoryTransport, get_transport
+from worker_runtime.worker import Worker
+
+
+def test_memory_channel_prefetch_and_requeue():
+    """Test that a channel holds at most prefetch unacked messages and nacks requeue"""
+    transport = MemoryTransport()
+    for n in range(3):
+        transport.publish("jobs", json.dumps({"n": n}))
+
+    connection = transport.connect()
+    ch = connection.channel()
+    ch.basic_qos(prefetch_count=2)
+    received = []
+    ch.basic_consume(queue="jobs", on_message_callback=lambda ch, m, p, b: received.append(m))
+
+    connection.process_data_events(time_limit=0)
+    assert [m.delivery_tag for m in received] == [1, 2]
+
+    ch.basic_nack(delivery_tag=1, requeue=True)
+    ch.basic_ack(delivery_tag=2)
+    connection.process_data_events(time_limit=0)
+    assert len(received) == 4
+    # The requeued message comes back first, flagged as redelivered
+    assert received[2].redelivered and not received[3].redelivered
+    assert ch.queue_declare("jobs").method.message_count == 0
+
+
+def test_delay_queues_dead_letter_back_after_their_ttl():
+    """Test the TTL + dead-letter routing the retry queues rely on"""
+    broker = MemoryBroker()
+    broker.declare("jobs.retry.1", {"x-message-ttl": 20, "x-dead-letter-routing-key": "jobs"})
+    broker.publish("jobs.retry.1", b"{}")
+
+    assert broker.get("jobs") is None
+    time.sleep(0.03)
+    assert broker.get("jobs")[1] == b"{}"
+
+
+def test_worker_consumes_from_the_memory_transport():
+    """Test the Worker loop end to end on the in-process broker, retries included"""
+    transport = MemoryTransport()
+    handled = []
+
+    def handler(ch, method, properties, body):
+        data = json.loads(body)
+        if data["n"] == 0 and not properties.headers:
+            raise RuntimeError("first attempt fails")
+        handled.append(data["n"])
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    worker = Worker("test", "jobs", handler=handler, concurrency=2, transport=transport,
+                    metrics=WorkerMetrics(log_every_s=0))
+    thread = threading.Thread(target=worker.run, daemon=True)
+    thread.start()
+    for n in range(4):
+        transport.publish("jobs", json.dumps({"n": n}))
+    transport.publish("jobs.bulk", json.dumps({"n": 4}))
+
+    deadline = time.monotonic() + 5
+    while len(handled) < 5 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    worker.stop()
+    thread.join(timeout=5)
+
+    assert sorted(handled) == [0, 1, 2, 3, 4]
+    assert not thread.is_alive()
+
+
+def test_get_transport():
+    assert get_transport("memory") is get_transport("memory")
+    assert get_transport("rabbitmq", url="amqp://x/").url == "amqp://x/"
+    with pytest.raises(ValueError):
+        get_transport("kafka")
+    with pytest.raises(ValueError):
+        Worker("test", "jobs", handler=lambda *args: None, mode="asyncio", transport=MemoryTransport())
@@ -0,0 +1,249 @@
+import json
+import urllib.request
+from types import SimpleNamespace
+
+import pytest
+
+from worker_runtime import worker as worker_module
+from worker_runtime.connection import ThreadSafeChannel
+from worker_runtime.metrics import WorkerMetrics, percentile, serve
+from worker_runtime.tracing import Trace, trace_headers
+from worker_runtime.worker import Worker, _Lane
+
+
+class FakeChannel:
+    def __init__(self):
+        self.acked = []
+        self.published = []
+        self.nacked = []
+        self.is_open = True
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.acked.append(delivery_tag)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self.nacked.append(delivery_tag)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self.published.append(routing_key)
+
+
+class FakeConnection:
+    is_open = True
+
+    def __init__(self):
+        self.callbacks = []
+
+    def add_callback_threadsafe(self, callback):
+        self.callbacks.append(callback)
+
+    def run_callbacks(self):
+        for callback in self.callbacks:
+            callback()
+        self.callbacks = []
+
+
+def _message(tag, post_id=1):
+    method = SimpleNamespace(delivery_tag=tag)
+    properties = SimpleNamespace(headers=None, content_type=None)
+    return method, properties, json.dumps({"post_id": post_id}).encode("utf-8")
+
+
+def _ack_all(ch, messages):
+    for method, _, _ in messages:
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+
+def test_worker_needs_a_handler():
+    """Test that a worker cannot be built without something to call"""
+    with pytest.raises(ValueError):
+        Worker("test", "jobs")
+    with pytest.raises(ValueError):
+        Worker("test", "jobs", handler=lambda *args: None, batch_size=4)
+
+
+def test_prefetch_defaults_to_batch_times_concurrency():
+    """Test that enough messages are prefetched to keep every slot busy"""
+    worker = Worker("test", "jobs", batch_handler=_ack_all, batch_size=8, concurrency=2, prefetch=0)
+    assert worker.prefetch == 16
+
+
+def test_live_lane_goes_first_and_batches_fill_up():
+    """Test lane priority and micro-batching of the blocking loop"""
+    batches = []
+    worker = Worker("test", "jobs", batch_handler=lambda ch, messages: batches.append((ch, messages)),
+                    batch_size=2, batch_wait_ms=10_000, metrics=WorkerMetrics())
+    live, bulk = _Lane("jobs", FakeChannel()), _Lane("jobs.bulk", FakeChannel())
+    lanes = [live, bulk]
+
+    for tag in (101, 102, 103):
+        bulk.add(bulk.channel, *_message(tag))
+    live.add(live.channel, *_message(1))
+
+    # The live lane is still filling its batch, so bulk work waits too
+    worker._dispatch_ready(lanes)
+    assert batches == []
+
+    live.add(live.channel, *_message(2))
+    worker._dispatch_ready(lanes)
+    worker._dispatch_ready(lanes)
+    assert [(ch, [m.delivery_tag for m, _, _ in messages]) for ch, messages in batches] == [
+        (live.channel, [1, 2]),
+        (bulk.channel, [101, 102]),
+    ]
+    assert worker.metrics.snapshot()["batch"]["items"] == 4
+
+    # A stopping worker gives back what it has not started
+    bulk.give_back()
+    assert bulk.channel.nacked == [103]
+    assert not bulk.pending
+
+
+def test_partial_batch_is_dispatched_after_the_wait():
+    """Test that a lane's batch goes out once its oldest message waited batch_wait_ms"""
+    worker = Worker("test", "jobs", batch_handler=_ack_all, batch_size=8, batch_wait_ms=50,
+                    metrics=WorkerMetrics())
+    lane = _Lane("jobs", FakeChannel())
+    lane.add(lane.channel, *_message(1))
+
+    assert 0 < worker._idle_s([lane]) <= 0.05
+    lane.since -= 1
+    assert worker._idle_s([lane]) == 0.0
+    worker._dispatch_ready([lane])
+    assert lane.channel.acked == [1]
+
+
+def test_retries_go_back_to_the_lane_of_the_message():
+    """Test that a failed bulk message is retried on the bulk lane"""
+    def handler(ch, method, properties, body):
+        raise RuntimeError("boom")
+
+    ch = FakeChannel()
+    worker = Worker("test", "jobs", handler=handler, metrics=WorkerMetrics())
+    method, properties, body = _message(9)
+    method.routing_key = "jobs.bulk"
+    worker._handle(ch, [(method, properties, body)])
+
+    assert ch.published == ["jobs.bulk.retry.1"]
+    assert worker.lanes == ["jobs", "jobs.bulk"]
+
+
+def test_failing_handler_sends_messages_to_retry():
+    """Test that an exception escaping the handler schedules retries"""
+    def handler(ch, method, properties, body):
+        raise RuntimeError("boom")
+
+    ch = FakeChannel()
+    worker = Worker("test", "jobs", handler=handler, metrics=WorkerMetrics())
+    worker._handle(ch, [_message(7)])
+
+    assert ch.published == ["jobs.retry.1"]
+    assert ch.acked == [7]
+    assert worker.metrics.snapshot()["handle"]["errors"] == 1
+
+
+def test_pool_threads_ack_through_the_connection_thread():
+    """Test that handlers on the pool never touch the channel directly"""
+    ch = FakeChannel()
+    connection = FakeConnection()
+    worker = Worker("test", "jobs", batch_handler=_ack_all, concurrency=2, metrics=WorkerMetrics())
+    worker._connection = connection
+    worker._pool = worker_module.ThreadPoolExecutor(2)
+
+    worker._dispatch(ch, [_message(1)])
+    worker._dispatch(ch, [_message(2)])
+    worker._pool.shutdown(wait=True)
+
+    assert ch.acked == []
+    connection.run_callbacks()
+    assert sorted(ch.acked) == [1, 2]
+    assert not worker._inflight
+
+
+def test_thread_safe_channel_keeps_call_order():
+    """Test that a retry's publish is still sent before its ack"""
+    ch = FakeChannel()
+    connection = FakeConnection()
+    proxy = ThreadSafeChannel(connection, ch)
+    calls = []
+    ch.basic_publish = lambda **kwargs: calls.append("publish")
+    ch.basic_ack = lambda **kwargs: calls.append("ack")
+
+    proxy.basic_publish(exchange="", routing_key="jobs.retry.1", body=b"{}")
+    proxy.basic_ack(delivery_tag=1)
+    connection.run_callbacks()
+
+    assert calls == ["publish", "ack"]
+
+
+def test_metrics_percentiles():
+    """Test nearest-rank percentiles and the per-stage snapshot"""
+    assert percentile([], 95) == 0.0
+    assert percentile([1, 2, 3, 4], 50) == 2
+    assert percentile(list(range(1, 101)), 95) == 95
+
+    metrics = WorkerMetrics()
+    for seconds in (0.01, 0.02, 0.03):
+        metrics.observe("handle", seconds)
+    with pytest.raises(KeyError):
+        with metrics.time("handle"):
+            raise KeyError("x")
+
+    snapshot = metrics.snapshot()["handle"]
+    assert snapshot["count"] == 4
+    assert snapshot["errors"] == 1
+    assert snapshot["max_ms"] == pytest.approx(30, abs=1)
+
+
+def test_trace_rows_and_queue_wait():
+    """Test that stamped messages report queue wait and per-stage timings"""
+    metrics = WorkerMetrics()
+    headers = trace_headers("t1")
+    properties = SimpleNamespace(headers=headers)
+    sent = headers["x-published-at"] / 1000.0
+
+    trace = Trace("test", metrics=metrics)
+    trace.add(1, properties)
+    trace.add(2, SimpleNamespace(headers=None))
+    with trace.stage("compute"):
+        pass
+
+    stamped, unstamped = trace.rows(completed_at=sent + 0.5)
+    assert stamped["trace_id"] == "t1"
+    assert stamped["total_ms"] == pytest.approx(500)
+    assert stamped["compute_ms"] >= 0 and stamped["fetch_ms"] is None
+    assert unstamped["queue_wait_ms"] is None and unstamped["total_ms"] is None
+    assert metrics.snapshot()["compute"]["items"] == 2
+
+    # The runtime records the queue wait of every stamped message it hands out
+    worker = Worker("test", "jobs", handler=lambda *args: None, metrics=metrics)
+    method, _, body = _message(1)
+    worker._handle(FakeChannel(), [(method, properties, body)])
+    assert metrics.snapshot()["queue_wait"]["count"] == 1
+
+
+def test_metrics_sizes_memory_and_scrape():
+    """Test payload sizes, RSS sampling and the Prometheus endpoint"""
+    metrics = WorkerMetrics(log_every_s=0)
+    worker = Worker("test", "jobs", handler=lambda *args: None, metrics=metrics)
+    method, properties, body = _message(1)
+    worker._handle(FakeChannel(), [(method, properties, body)])
+    metrics.observe_bytes("image", 1000)
+    metrics.observe_bytes("image", 3000)
+
+    sizes = metrics.sizes_snapshot()
+    assert sizes["message"]["total_bytes"] == len(body)
+    assert sizes["image"]["p50_bytes"] == 1000 and sizes["image"]["max_bytes"] == 3000
+    assert metrics.memory["peak_rss_bytes"] >= metrics.memory["rss_bytes"] > 0
+    assert "peak_rss=" in metrics.summary()
+
+    server = serve(metrics, "test", 0, host="127.0.0.1")
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/metrics") as resp:
+            text = resp.read().decode("utf-8")
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert 'worker_stage_duration_seconds_count{worker="test",stage="handle"} 1' in text
+    assert 'worker_payload_bytes{worker="test",kind="image",quantile="0.5"} 1000' in text
+    assert 'worker_peak_rss_bytes{worker="test"}' in text
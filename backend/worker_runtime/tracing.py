@@ -0,0 +1,179 @@
+"""
+End-to-end enrichment latency tracing
+
+The backend stamps every enrichment event with a trace id and its publish
+time (epoch milliseconds) in the message headers; retries keep them, so
+the latency of a retried message includes its backoff. A handler wraps its
+message(s) in a Trace and times its stages:
+
+    trace = Trace("resizer")
+    trace.add(post_id, properties)
+    with trace.stage("fetch"):
+        ...
+    with trace.stage("compute"):
+        ...
+    with trace.stage("write"):
+        ...
+    trace.save()
+
+Stage timings feed the worker's metrics. save() writes one row per post to
+`enrichment_traces`: queue wait (publish to handler start), the fetch,
+compute and write durations, and the total from publish to completion.
+The backend serves them as histograms at /api/analytics/enrichment-latency.
+
+Queue wait and total compare the backend's clock with the worker's, so
+they are only as accurate as the hosts' clock sync.
+"""
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+
+from sqlalchemy import text
+
+from .db import get_engine
+from .metrics import WorkerMetrics, metrics as default_metrics
+
+logger = logging.getLogger(__name__)
+
+TRACE_ID_HEADER = "x-trace-id"
+PUBLISHED_AT_HEADER = "x-published-at"
+
+# Columns of enrichment_traces, in milliseconds
+TRACE_STAGES = ("queue_wait", "fetch", "compute", "write", "total")
+
+_CREATE_TRACES_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS enrichment_traces (
+        id BIGSERIAL PRIMARY KEY,
+        trace_id VARCHAR(32),
+        service VARCHAR(50) NOT NULL,
+        post_id INTEGER,
+        published_at TIMESTAMP,
+        completed_at TIMESTAMP NOT NULL,
+        queue_wait_ms DOUBLE PRECISION,
+        fetch_ms DOUBLE PRECISION,
+        compute_ms DOUBLE PRECISION,
+        write_ms DOUBLE PRECISION,
+        total_ms DOUBLE PRECISION
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_enrichment_traces_service_completed_at "
+    "ON enrichment_traces (service, completed_at)",
+]
+
+_INSERT_TRACE = text("""
+    INSERT INTO enrichment_traces
+        (trace_id, service, post_id, published_at, completed_at,
+         queue_wait_ms, fetch_ms, compute_ms, write_ms, total_ms)
+    VALUES
+        (:trace_id, :service, :post_id,
+         CAST(to_timestamp(CAST(:published_at AS DOUBLE PRECISION)) AS TIMESTAMP),
+         CAST(to_timestamp(CAST(:completed_at AS DOUBLE PRECISION)) AS TIMESTAMP),
+         :queue_wait_ms, :fetch_ms, :compute_ms, :write_ms, :total_ms)
+""")
+
+
+def trace_headers(trace_id: Optional[str] = None) -> dict:
+    """Headers for a new enrichment event"""
+    return {
+        TRACE_ID_HEADER: trace_id or uuid.uuid4().hex,
+        PUBLISHED_AT_HEADER: int(time.time() * 1000),
+    }
+
+
+def published_at(properties) -> Optional[float]:
+    """Publish time (epoch seconds) stamped on a message, if any"""
+    value = (getattr(properties, "headers", None) or {}).get(PUBLISHED_AT_HEADER)
+    try:
+        return int(value) / 1000.0
+    except (TypeError, ValueError):
+        return None
+
+
+def queue_wait_s(properties, now: Optional[float] = None) -> Optional[float]:
+    """Seconds between publishing a message and `now`; None if unstamped"""
+    sent = published_at(properties)
+    if sent is None:
+        return None
+    return max(0.0, (time.time() if now is None else now) - sent)
+
+
+def init_trace_table(completed_column: Optional[str] = None) -> None:
+    """
+    Create enrichment_traces and, if given, the posts column holding the
+    service's completion time
+    """
+    with get_engine().begin() as conn:
+        # The API's schema upgrade normally adds the column already, and
+        # ALTER TABLE locks posts even when it is a no-op, so check first
+        if completed_column and not conn.execute(text("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'posts' AND column_name = :column
+        """), {"column": completed_column}).first():
+            conn.execute(text(
+                f"ALTER TABLE posts ADD COLUMN IF NOT EXISTS {completed_column} TIMESTAMP"
+            ))
+        for statement in _CREATE_TRACES_SQL:
+            conn.execute(text(statement))
+
+
+class Trace:
+    """Stage timings of the messages a handler call works on"""
+
+    def __init__(self, service: str, metrics: WorkerMetrics = default_metrics):
+        self.service = service
+        self.metrics = metrics
+        self.started_at = time.time()
+        self.stages = {}
+        self.posts = {}
+
+    def add(self, post_id: int, properties) -> None:
+        headers = getattr(properties, "headers", None) or {}
+        self.posts[post_id] = (headers.get(TRACE_ID_HEADER), published_at(properties))
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the block as `name` (once for all the trace's posts)"""
+        start = time.perf_counter()
+        try:
+            with self.metrics.time(name, max(1, len(self.posts))):
+                yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def rows(self, post_ids=None, completed_at: Optional[float] = None) -> list[dict]:
+        completed_at = time.time() if completed_at is None else completed_at
+        rows = []
+        for post_id in self.posts if post_ids is None else post_ids:
+            trace_id, sent = self.posts[post_id]
+            row = {
+                "trace_id": trace_id,
+                "service": self.service,
+                "post_id": post_id,
+                "published_at": sent,
+                "completed_at": completed_at,
+                "queue_wait_ms": None if sent is None else 1000 * max(0.0, self.started_at - sent),
+                "total_ms": None if sent is None else 1000 * max(0.0, completed_at - sent),
+            }
+            for name in ("fetch", "compute", "write"):
+                seconds = self.stages.get(name)
+                row[f"{name}_ms"] = None if seconds is None else 1000 * seconds
+            rows.append(row)
+        return rows
+
+    def save(self, post_ids=None) -> None:
+        """
+        Record the posts (all, or just `post_ids`) as enriched now
+
+        Never raises: losing a trace must not fail the message.
+        """
+        rows = self.rows(post_ids)
+        if not rows:
+            return
+        try:
+            with get_engine().begin() as conn:
+                conn.execute(_INSERT_TRACE, rows)
+        except Exception as e:
+            logger.warning(f"[{self.service}] Could not record {len(rows)} traces: {e!r}")
@@ -0,0 +1,312 @@
+"""
+Message transports: RabbitMQ, or an in-process broker stand-in
+
+MESSAGE_TRANSPORT picks where app.messaging publishes and where the
+Worker consumes:
+
+- "rabbitmq" (default): pika, as in production
+- "memory": a broker living in this process, for benchmarks and tests that
+  run the API publisher and the worker handlers in one process without any
+  external service (see pipeline_bench.py). Nothing leaves the process, so
+  publisher and workers must share it.
+
+A transport has `publish(queue, body, headers)` for publishers and
+`connect(should_stop)` for the Worker, which returns a pika
+BlockingConnection or something that behaves like one. The memory broker
+mimics the parts of RabbitMQ the workers rely on: per-channel prefetch,
+ack/nack/reject with requeue, persistent delivery tags, and queues
+declared with `x-message-ttl` plus `x-dead-letter-routing-key` (the retry
+delay queues), whose messages move to the dead-letter target once their
+TTL expires.
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+from typing import Optional
+
+import pika
+
+from .connection import RABBITMQ_URL, connect_with_retry
+
+TRANSPORTS = ("rabbitmq", "memory")
+
+
+class RabbitMQTransport:
+    name = "rabbitmq"
+
+    def __init__(self, url: str = RABBITMQ_URL):
+        self.url = url
+
+    def connect(self, should_stop=None):
+        return connect_with_retry(self.url, should_stop=should_stop)
+
+    def publish(self, queue: str, body, headers: Optional[dict] = None) -> None:
+        """Publish one persistent message on a short-lived connection"""
+        connection = pika.BlockingConnection(pika.URLParameters(self.url))
+        try:
+            channel = connection.channel()
+            channel.queue_declare(queue=queue, durable=True)
+            channel.basic_publish(
+                exchange="",
+                routing_key=queue,
+                body=body,
+                properties=pika.BasicProperties(
+                    delivery_mode=2,  # persist message
+                    headers=headers
+                )
+            )
+        finally:
+            connection.close()
+
+
+class MemoryBroker:
+    """Queues of (properties, body, redelivered), shared by all connections"""
+
+    def __init__(self):
+        self.cond = threading.Condition(threading.RLock())
+        self.queues = {}
+        self.arguments = {}
+        self._delayed = []  # (due, seq, target queue, properties, body)
+        self._seq = itertools.count()
+
+    def declare(self, queue: str, arguments: Optional[dict] = None) -> None:
+        with self.cond:
+            self.queues.setdefault(queue, deque())
+            if arguments:
+                self.arguments[queue] = arguments
+
+    def publish(self, queue: str, body, properties=None) -> None:
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        properties = properties or pika.BasicProperties()
+        with self.cond:
+            arguments = self.arguments.get(queue) or {}
+            target = arguments.get("x-dead-letter-routing-key")
+            if target and "x-message-ttl" in arguments:
+                due = time.monotonic() + arguments["x-message-ttl"] / 1000.0
+                heapq.heappush(self._delayed, (due, next(self._seq), target, properties, body))
+            else:
+                self.queues.setdefault(queue, deque()).append((properties, body, False))
+            self.cond.notify_all()
+
+    def requeue(self, queue: str, properties, body) -> None:
+        with self.cond:
+            self.queues.setdefault(queue, deque()).appendleft((properties, body, True))
+            self.cond.notify_all()
+
+    def get(self, queue: str) -> Optional[tuple]:
+        with self.cond:
+            self._promote()
+            messages = self.queues.get(queue)
+            return messages.popleft() if messages else None
+
+    def depth(self, queue: str) -> int:
+        with self.cond:
+            self._promote()
+            return len(self.queues.get(queue, ()))
+
+    def next_due_in(self) -> Optional[float]:
+        """Seconds until the next delayed message is due, if any"""
+        with self.cond:
+            return max(0.0, self._delayed[0][0] - time.monotonic()) if self._delayed else None
+
+    def _promote(self) -> None:
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, target, properties, body = heapq.heappop(self._delayed)
+            self.queues.setdefault(target, deque()).append((properties, body, False))
+
+
+class MemoryChannel:
+    """The subset of pika's BlockingChannel the workers use"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.broker = connection.broker
+        self.prefetch = 0
+        self.is_open = True
+        self._consumers = {}  # consumer tag -> (queue, callback)
+        self._unacked = {}  # delivery tag -> (queue, properties, body)
+        self._tags = itertools.count(1)
+        self._consumer_tags = itertools.count(1)
+
+    def queue_declare(self, queue: str, durable: bool = False, arguments: Optional[dict] = None,
+                      passive: bool = False, **kwargs):
+        self.broker.declare(queue, arguments)
+        consumers = sum(
+            1 for ch in self.connection.channels for q, _ in ch._consumers.values() if q == queue
+        )
+        return SimpleNamespace(method=SimpleNamespace(
+            queue=queue, message_count=self.broker.depth(queue), consumer_count=consumers
+        ))
+
+    def basic_qos(self, prefetch_count: int = 0, **kwargs) -> None:
+        self.prefetch = prefetch_count
+
+    def basic_consume(self, queue: str, on_message_callback, auto_ack: bool = False, **kwargs) -> str:
+        tag = f"ctag{next(self._consumer_tags)}"
+        self._consumers[tag] = (queue, on_message_callback)
+        return tag
+
+    def basic_cancel(self, consumer_tag: str) -> None:
+        self._consumers.pop(consumer_tag, None)
+
+    def basic_get(self, queue: str, auto_ack: bool = False) -> tuple:
+        message = self.broker.get(queue)
+        if message is None:
+            return None, None, None
+        return self._track(queue, "", message, auto_ack)
+
+    def _track(self, queue: str, consumer_tag: str, message: tuple, auto_ack: bool = False) -> tuple:
+        properties, body, redelivered = message
+        tag = next(self._tags)
+        if not auto_ack:
+            self._unacked[tag] = (queue, properties, body)
+        method = pika.spec.Basic.Deliver(
+            consumer_tag=consumer_tag,
+            delivery_tag=tag,
+            redelivered=redelivered,
+            exchange="",
+            routing_key=queue,
+        )
+        return method, properties, body
+
+    def _has_room(self) -> bool:
+        return self.prefetch == 0 or len(self._unacked) < self.prefetch
+
+    def deliver(self) -> bool:
+        """Hand queued messages to this channel's consumers, up to prefetch"""
+        delivered = False
+        for consumer_tag, (queue, callback) in list(self._consumers.items()):
+            while self._has_room() and consumer_tag in self._consumers:
+                message = self.broker.get(queue)
+                if message is None:
+                    break
+                callback(self, *self._track(queue, consumer_tag, message))
+                delivered = True
+        return delivered
+
+    def ready(self) -> bool:
+        """Whether deliver() has something to do"""
+        return self._has_room() and any(self.broker.depth(q) for q, _ in self._consumers.values())
+
+    def _settle(self, delivery_tag: int, multiple: bool) -> list:
+        if multiple:
+            tags = [tag for tag in self._unacked if tag <= delivery_tag]
+        else:
+            tags = [delivery_tag] if delivery_tag in self._unacked else []
+        settled = [self._unacked.pop(tag) for tag in tags]
+        if settled:
+            with self.broker.cond:
+                self.broker.cond.notify_all()  # room for more deliveries
+        return settled
+
+    def basic_ack(self, delivery_tag: int = 0, multiple: bool = False) -> None:
+        self._settle(delivery_tag, multiple)
+
+    def basic_nack(self, delivery_tag: int = 0, multiple: bool = False, requeue: bool = True) -> None:
+        for queue, properties, body in reversed(self._settle(delivery_tag, multiple)):
+            if requeue:
+                self.broker.requeue(queue, properties, body)
+
+    def basic_reject(self, delivery_tag: int = 0, requeue: bool = True) -> None:
+        self.basic_nack(delivery_tag, requeue=requeue)
+
+    def basic_publish(self, exchange: str, routing_key: str, body, properties=None, mandatory: bool = False) -> None:
+        self.broker.publish(routing_key, body, properties)
+
+    def close(self) -> None:
+        # Like a closed AMQP channel: whatever was not acked goes back
+        self.basic_nack(max(self._unacked, default=0), multiple=True, requeue=True)
+        self._consumers.clear()
+        self.is_open = False
+
+
+class MemoryConnection:
+    """The subset of pika's BlockingConnection the Worker uses"""
+
+    def __init__(self, broker: MemoryBroker):
+        self.broker = broker
+        self.channels = []
+        self.is_open = True
+        self._callbacks = deque()
+
+    def channel(self) -> MemoryChannel:
+        ch = MemoryChannel(self)
+        self.channels.append(ch)
+        return ch
+
+    def add_callback_threadsafe(self, callback) -> None:
+        with self.broker.cond:
+            self._callbacks.append(callback)
+            self.broker.cond.notify_all()
+
+    def process_data_events(self, time_limit: float = 0) -> None:
+        """Run pending callbacks and deliveries; wait up to time_limit for some"""
+        deadline = time.monotonic() + (time_limit or 0)
+        while True:
+            ran = self._run_callbacks()
+            delivered = any([ch.deliver() for ch in self.channels if ch.is_open])
+            remaining = deadline - time.monotonic()
+            if ran or delivered or remaining <= 0:
+                return
+            with self.broker.cond:
+                if self._callbacks or any(ch.ready() for ch in self.channels if ch.is_open):
+                    continue
+                due = self.broker.next_due_in()
+                self.broker.cond.wait(remaining if due is None else min(remaining, due))
+
+    def _run_callbacks(self) -> bool:
+        ran = False
+        while True:
+            with self.broker.cond:
+                if not self._callbacks:
+                    return ran
+                callback = self._callbacks.popleft()
+            callback()
+            ran = True
+
+    def close(self) -> None:
+        self._run_callbacks()
+        for ch in self.channels:
+            if ch.is_open:
+                ch.close()
+        self.is_open = False
+
+
+class MemoryTransport:
+    name = "memory"
+
+    def __init__(self, broker: Optional[MemoryBroker] = None):
+        self.broker = broker or MemoryBroker()
+
+    def connect(self, should_stop=None) -> MemoryConnection:
+        return MemoryConnection(self.broker)
+
+    def publish(self, queue: str, body, headers: Optional[dict] = None) -> None:
+        self.broker.publish(queue, body, pika.BasicProperties(delivery_mode=2, headers=headers))
+
+
+_memory_transport = None
+_memory_lock = threading.Lock()
+
+
+def get_transport(name: Optional[str] = None, url: str = RABBITMQ_URL):
+    """
+    The transport called `name` (default: MESSAGE_TRANSPORT, read on every
+    call). There is one memory transport per process.
+    """
+    global _memory_transport
+    name = name or os.getenv("MESSAGE_TRANSPORT", "rabbitmq")
+    if name == "rabbitmq":
+        return RabbitMQTransport(url)
+    if name == "memory":
+        with _memory_lock:
+            if _memory_transport is None:
+                _memory_transport = MemoryTransport()
+            return _memory_transport
+    raise ValueError(f"Unknown transport {name!r} (expected one of {', '.join(TRANSPORTS)})")
@@ -0,0 +1,351 @@
+"""
+Queue consumer loop shared by the workers
+
+A service only provides its handler; the Worker owns everything around it:
+
+- a connection that is re-established with backoff whenever it drops
+- prefetch (how many unacked messages the broker hands out) and
+  concurrency (how many handler calls run at once, on a thread pool)
+- optional micro-batching: up to `batch_size` messages, or whatever
+  arrived within `batch_wait_ms`, go to the handler together
+- priority lanes (see lanes.py): the live and bulk lanes of the queue are
+  consumed on separate channels and live work is always handed out first;
+  the bulk lane prefetches only WORKER_BULK_PREFETCH messages
+- graceful drain on SIGTERM/SIGINT: stop taking messages, give back the
+  ones not yet started, finish and ack the running ones, then exit
+- per-call timings, message sizes and RSS (see metrics.py), plus the queue
+  wait of every message stamped with a publish time (see tracing.py);
+  served for scraping when WORKER_METRICS_PORT is set
+
+WORKER_MODE=asyncio swaps the pika loop for an aio-pika one (see aio.py).
+MESSAGE_TRANSPORT=memory consumes from an in-process broker instead of
+RabbitMQ (see transport.py).
+
+Handlers ack or retry their own messages, exactly as before:
+`handler(ch, method, properties, body)` or
+`batch_handler(ch, [(method, properties, body), ...])`. An exception that
+escapes a handler sends all of its messages to retry_or_dead_letter.
+"""
+import logging
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import pika
+
+from .connection import RABBITMQ_URL, ThreadSafeChannel
+from .lanes import lanes as queue_lanes
+from .metrics import METRICS_PORT, WorkerMetrics, metrics as default_metrics, serve as serve_metrics
+from .retry import declare_retry_queues, retry_or_dead_letter
+from .tracing import queue_wait_s
+from .transport import get_transport
+
+logger = logging.getLogger(__name__)
+
+# Handler calls in flight at once; above 1 they run on a thread pool
+CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "1"))
+# Unacked messages the broker may hand out; 0 = batch_size * concurrency
+PREFETCH = int(os.getenv("WORKER_PREFETCH", "0"))
+# Same for the bulk lane; 0 = batch_size. Kept small so bulk work held by a
+# worker never stands between it and the next live message for long.
+BULK_PREFETCH = int(os.getenv("WORKER_BULK_PREFETCH", "0"))
+# How long a stopping worker waits for running handlers
+DRAIN_TIMEOUT_S = float(os.getenv("WORKER_DRAIN_TIMEOUT_S", "30"))
+# "blocking" (pika BlockingConnection) or "asyncio" (aio-pika, see aio.py)
+WORKER_MODE = os.getenv("WORKER_MODE", "blocking")
+
+
+def worker_prefetch(batch_size: int = 1, concurrency: int = CONCURRENCY, prefetch: int = PREFETCH) -> int:
+    """Live-lane prefetch of a Worker with these settings"""
+    return prefetch or max(1, batch_size) * max(1, concurrency)
+
+
+class Worker:
+    """Consume `queue` and feed its messages to a service's handler"""
+
+    def __init__(
+        self,
+        name: str,
+        queue: str,
+        handler: Optional[Callable] = None,
+        batch_handler: Optional[Callable] = None,
+        batch_size: int = 1,
+        batch_wait_ms: int = 50,
+        prefetch: int = PREFETCH,
+        bulk_prefetch: int = BULK_PREFETCH,
+        concurrency: int = CONCURRENCY,
+        url: str = RABBITMQ_URL,
+        metrics: WorkerMetrics = default_metrics,
+        mode: str = WORKER_MODE,
+        transport=None,
+        metrics_port: int = METRICS_PORT,
+    ):
+        if handler is None and batch_handler is None:
+            raise ValueError("Worker needs a handler or a batch_handler")
+        if batch_size > 1 and batch_handler is None:
+            raise ValueError("batch_size > 1 needs a batch_handler")
+        if mode not in ("blocking", "asyncio"):
+            raise ValueError(f"Unknown worker mode {mode!r}")
+        transport = transport or get_transport(url=url)
+        if mode == "asyncio" and transport.name != "rabbitmq":
+            raise ValueError("The asyncio mode needs the rabbitmq transport")
+
+        self.name = name
+        self.queue = queue
+        self.handler = handler
+        self.batch_handler = batch_handler
+        self.batch_size = max(1, batch_size)
+        self.batch_wait_ms = batch_wait_ms
+        self.concurrency = max(1, concurrency)
+        self.prefetch = worker_prefetch(self.batch_size, self.concurrency, prefetch)
+        self.bulk_prefetch = bulk_prefetch or self.batch_size
+        self.lanes = queue_lanes(queue)
+        self.url = url
+        self.transport = transport
+        self.metrics = metrics
+        self.metrics_port = metrics_port
+        self.mode = mode
+        self.prefix = f"[{name}]"
+
+        self._stopping = False
+        self._connection = None
+        self._pool = None
+        self._inflight = set()
+        self._lock = threading.Lock()
+
+    # --------------------------------------------------
+    # Lifecycle
+    # --------------------------------------------------
+    def run(self) -> None:
+        """Consume until stopped, reconnecting whenever the connection drops"""
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        server = self._serve_metrics()
+        try:
+            if self.mode == "asyncio":
+                from .aio import run_async
+                run_async(self)
+            else:
+                self._run_blocking()
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+    def _serve_metrics(self):
+        if not self.metrics_port:
+            return None
+        try:
+            server = serve_metrics(self.metrics, self.name, self.metrics_port)
+        except OSError as e:
+            logger.warning(f"{self.prefix} Cannot serve metrics on port {self.metrics_port}: {e}")
+            return None
+        logger.info(f"{self.prefix} Metrics on http://0.0.0.0:{self.metrics_port}/metrics")
+        return server
+
+    def _run_blocking(self) -> None:
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self._on_signal)
+            signal.signal(signal.SIGINT, self._on_signal)
+        if self.concurrency > 1:
+            self._pool = ThreadPoolExecutor(self.concurrency, thread_name_prefix=f"{self.name}-worker")
+
+        try:
+            while not self._stopping:
+                self._connection = self.transport.connect(should_stop=lambda: self._stopping)
+                if self._connection is None:
+                    break
+                try:
+                    self._consume(self._open_lanes())
+                    self._drain()
+                except pika.exceptions.AMQPError as e:
+                    if self._stopping:
+                        break
+                    logger.warning(f"{self.prefix} Lost RabbitMQ connection: {e!r}. Reconnecting...")
+                finally:
+                    self._close()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+            logger.info(f"{self.prefix} Stopped ({self.metrics.summary()})")
+
+    def stop(self) -> None:
+        """Stop taking messages; run() returns once running handlers finish"""
+        self._stopping = True
+
+    def _on_signal(self, signum, frame):
+        logger.info(f"{self.prefix} Got signal {signum}, draining...")
+        self.stop()
+
+    def _open_lanes(self) -> list:
+        """One channel per lane, each with its own prefetch"""
+        opened = []
+        for index, queue in enumerate(self.lanes):
+            ch = self._connection.channel()
+            ch.queue_declare(queue=queue, durable=True)
+            declare_retry_queues(ch, queue)
+            ch.basic_qos(prefetch_count=self.prefetch if index == 0 else self.bulk_prefetch)
+            opened.append(_Lane(queue, ch))
+        logger.info(
+            f"{self.prefix} Listening on {', '.join(self.lanes)} (prefetch={self.prefetch}/{self.bulk_prefetch}, "
+            f"concurrency={self.concurrency}, batch_size={self.batch_size}, wait={self.batch_wait_ms}ms)"
+        )
+        return opened
+
+    def _drain(self) -> None:
+        """Let running handlers finish and their acks go out"""
+        deadline = time.monotonic() + DRAIN_TIMEOUT_S
+        while self._inflight and time.monotonic() < deadline:
+            self._connection.process_data_events(time_limit=0.1)
+        self._connection.process_data_events(time_limit=0)
+        if self._inflight:
+            logger.warning(f"{self.prefix} {len(self._inflight)} handlers still running after "
+                           f"{DRAIN_TIMEOUT_S}s; their messages will be redelivered")
+
+    def _close(self) -> None:
+        try:
+            if self._connection is not None and self._connection.is_open:
+                self._connection.close()
+        except Exception as e:
+            logger.warning(f"{self.prefix} Error closing connection: {e!r}")
+        self._connection = None
+
+    # --------------------------------------------------
+    # Consuming
+    # --------------------------------------------------
+    def _consume(self, lanes: list) -> None:
+        for lane in lanes:
+            lane.tag = lane.channel.basic_consume(queue=lane.queue, on_message_callback=lane.add)
+
+        while not self._stopping:
+            self._connection.process_data_events(time_limit=self._idle_s(lanes))
+            self._dispatch_ready(lanes)
+            self.metrics.maybe_log(self.prefix)
+
+        for lane in lanes:
+            # Prefetched messages not yet delivered are nacked back by pika
+            lane.channel.basic_cancel(lane.tag)
+            lane.give_back()
+
+    def _has_slot(self) -> bool:
+        return self._pool is None or len(self._inflight) < self.concurrency
+
+    def _dispatch_ready(self, lanes: list) -> None:
+        """
+        Hand out ready batches, highest-priority lane first
+
+        A lane that holds messages but is still filling its batch blocks the
+        lanes after it, so a bulk batch never jumps ahead of live work. In
+        inline mode one batch is handled per call, so live messages that
+        arrive meanwhile are seen before the next bulk batch.
+        """
+        wait_s = self.batch_wait_ms / 1000.0
+        while self._has_slot():
+            lane = next((lane for lane in lanes if lane.pending), None)
+            if lane is None or not lane.ready(self.batch_size, wait_s, time.monotonic()):
+                return
+            self._dispatch(lane.channel, lane.take(self.batch_size))
+            if self._pool is None:
+                return
+
+    def _idle_s(self, lanes: list) -> float:
+        """How long to wait for deliveries before the next batch is due"""
+        if not self._has_slot():
+            return 1.0  # a finishing handler wakes the loop
+        now = time.monotonic()
+        wait_s = self.batch_wait_ms / 1000.0
+        due = [
+            0.0 if lane.ready(self.batch_size, wait_s, now) else lane.since + wait_s - now
+            for lane in lanes if lane.pending
+        ]
+        return max(0.0, min(due + [1.0]))
+
+    def _dispatch(self, ch, messages: list) -> None:
+        if self._pool is None:
+            self._handle(ch, messages)
+            return
+
+        future = self._pool.submit(self._handle, ThreadSafeChannel(self._connection, ch), messages)
+        with self._lock:
+            self._inflight.add(future)
+        future.add_done_callback(self._forget)
+
+    def _forget(self, future) -> None:
+        with self._lock:
+            self._inflight.discard(future)
+        # Wake the connection thread: there is a free slot now
+        connection = self._connection
+        if connection is not None:
+            try:
+                connection.add_callback_threadsafe(lambda: None)
+            except Exception:
+                pass
+
+    def _handle(self, ch, messages: list) -> None:
+        """Run the handler on `messages`, timed; retry them all if it raises"""
+        now = time.time()
+        for _, properties, body in messages:
+            self.metrics.observe_bytes("message", len(body))
+            wait = queue_wait_s(properties, now)
+            if wait is not None:
+                self.metrics.observe("queue_wait", wait)
+
+        start = time.perf_counter()
+        error = False
+        try:
+            if self.batch_size > 1 or self.handler is None:
+                self.batch_handler(ch, messages)
+            else:
+                method, properties, body = messages[0]
+                self.handler(ch, method, properties, body)
+        except Exception as e:
+            error = True
+            logger.error(f"{self.prefix} Handler failed on {len(messages)} messages: {e}", exc_info=True)
+            for method, properties, body in messages:
+                try:
+                    if ch.is_open:
+                        retry_or_dead_letter(ch, method, properties, body, self.queue, e)
+                except Exception as retry_error:
+                    # Unacked, so the broker redelivers it after a reconnect
+                    logger.error(f"{self.prefix} Could not schedule a retry: {retry_error!r}")
+        finally:
+            self.metrics.observe(
+                "batch" if self.batch_size > 1 else "handle",
+                time.perf_counter() - start,
+                len(messages),
+                error,
+            )
+            self.metrics.sample_memory()
+
+
+class _Lane:
+    """Messages delivered on one lane's channel, not handed out yet"""
+
+    def __init__(self, queue: str, channel):
+        self.queue = queue
+        self.channel = channel
+        self.tag = None
+        self.pending = []
+        self.since = None  # arrival of the oldest pending message
+
+    def add(self, ch, method, properties, body) -> None:
+        if not self.pending:
+            self.since = time.monotonic()
+        self.pending.append((method, properties, body))
+
+    def ready(self, batch_size: int, wait_s: float, now: float) -> bool:
+        return bool(self.pending) and (len(self.pending) >= batch_size or now - self.since >= wait_s)
+
+    def take(self, n: int) -> list:
+        batch, self.pending = self.pending[:n], self.pending[n:]
+        if not self.pending:
+            self.since = None
+        return batch
+
+    def give_back(self) -> None:
+        for method, _, _ in self.pending:
+            self.channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        self.pending = []
+        self.since = None